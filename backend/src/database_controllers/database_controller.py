@@ -1,10 +1,25 @@
 # app.py
 
-from flask import Flask, request, jsonify
+import os
+import hashlib
+from dotenv import load_dotenv
+from flask import Flask, request, jsonify, make_response
 from flask_cors import CORS
+from pymongo.errors import DuplicateKeyError, BulkWriteError
 from mongo.mongo_connector import get_db
+from mongo.employee_store import get_employees_collection, employee_document, employee_response, DUPLICATE_ACCOUNT_FIELD
+from mongo.data_version import get_master_data_version, bump_master_data_version
+
+load_dotenv()
+
+# Largest page of /getInstitutions, whatever limit is asked for
+MAX_INSTITUTIONS_PAGE_SIZE = int(os.getenv('MAX_INSTITUTIONS_PAGE_SIZE', '500'))
 
 app = Flask(__name__)
+
+# Employee fields that /editEmployee may change, the ID never changes
+EDITABLE_EMPLOYEE_FIELDS = ("name", "accountNo", "capital", "interest")
+
 CORS(app, resources={r"/*": {
     "origins": "*", 
     "methods": ["GET", "POST", "DELETE", "OPTIONS"],  # Added DELETE 
@@ -14,19 +29,110 @@ CORS(app, resources={r"/*": {
 
 @app.route('/getInstitutions', methods=['GET'])
 def get_institutions():
+    """
+    List the institutions with their employees.
+
+    Query parameters (all optional):
+        institution: Only this institution
+        fields: Comma separated institution fields to return, e.g. institution_name
+            for names only. employees is a field too. Defaults to all fields.
+        limit: Page size. Pages are ordered by institution name.
+        after: Institution name the page starts after, the next value of the previous page
+
+    Employees repeating an account number of their institution are listed with
+    duplicate set, and their institution with a duplicate_employees count.
+
+    The response carries an ETag of the master data version, and a request whose
+    If-None-Match still matches gets 304 after reading only the version counter.
+    The counter is read from MongoDB for every such request, as the version this
+    process remembers may lag behind changes made through other processes.
+    """
     try:
+        conditional = bool(request.if_none_match)
+        etag = institutions_etag(get_master_data_version(fresh=conditional), request.args)
+        if request.if_none_match.contains_weak(etag):
+            return not_modified_response(etag)
+
+        fields = request.args.get("fields")
+        fields = [field.strip() for field in fields.split(",") if field.strip()] if fields else None
+        institution_name = request.args.get("institution")
+        after = request.args.get("after")
+        limit = request.args.get("limit")
+
+        if limit is not None:
+            if not limit.isdigit() or int(limit) < 1:
+                return jsonify({"error": "limit must be a positive integer"}), 400
+            limit = min(int(limit), MAX_INSTITUTIONS_PAGE_SIZE)
+
         db = get_db()
         institutions_collection = db["institutions"]
-        
-        # Get all institutions (without the MongoDB _id field)
-        institutions = []
-        for institution in institutions_collection.find({}, {"_id": 0}):
-            institutions.append(institution)
-            
-        return jsonify({"institutions": institutions}), 200
+
+        query = {}
+        if institution_name:
+            query["institution_name"] = {"$eq": institution_name}
+        if after is not None:
+            query.setdefault("institution_name", {})["$gt"] = after
+
+        # Get the institutions (without the MongoDB _id field)
+        if fields is None:
+            projection = {"_id": 0}
+        else:
+            projection = {field: 1 for field in fields if field != "employees"}
+            projection.update({"_id": 0, "institution_name": 1})
+
+        cursor = institutions_collection.find(query, projection)
+        if limit is not None or after is not None:
+            cursor = cursor.sort("institution_name", 1)
+        if limit is not None:
+            # One extra institution tells whether there is a next page
+            cursor = cursor.limit(limit + 1)
+        institutions = list(cursor)
+
+        response = {}
+        if limit is not None and len(institutions) > limit:
+            institutions = institutions[:limit]
+            response["next"] = institutions[-1]["institution_name"]
+
+        # Attach the employees of the listed institutions, in insertion order
+        if fields is None or "employees" in fields:
+            employees_by_institution = {}
+            for institution in institutions:
+                institution["employees"] = employees_by_institution.setdefault(institution["institution_name"], [])
+
+            employees_collection = get_employees_collection(db)
+            employee_query = {"institution_name": {"$in": list(employees_by_institution)}}
+            for employee in employees_collection.find(employee_query, {"_id": 0}).sort([("institution_name", 1), ("_id", 1)]):
+                employees_by_institution[employee["institution_name"]].append(employee_response(employee))
+
+            for institution in institutions:
+                duplicates = sum(1 for employee in institution["employees"] if employee.get("duplicate"))
+                if duplicates:
+                    institution["duplicate_employees"] = duplicates
+
+        response["institutions"] = institutions
+        result = make_response(jsonify(response), 200)
+        result.set_etag(etag, weak=True)
+        result.headers["Cache-Control"] = "no-cache"
+        return result
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+
+
+def institutions_etag(version: int, args) -> str:
+    """
+    Build the ETag of a /getInstitutions response from the master data version
+    and the query parameters, which select the representation
+    """
+    query = "&".join(f"{key}={value}" for key, value in sorted(args.items(multi=True)))
+    return f"v{version}-{hashlib.sha1(query.encode('utf-8')).hexdigest()[:16]}"
+
+
+def not_modified_response(etag: str):
+    result = make_response("", 304)
+    result.set_etag(etag, weak=True)
+    result.headers["Cache-Control"] = "no-cache"
+    return result
     
     
 
@@ -42,15 +148,16 @@ def add_institution():
         db = get_db()
         institutions_collection = db["institutions"]
 
-        # Create the new institution document
+        # Create the new institution document, its employees are kept in the employees collection
         institution = {
-            "institution_name": institution_name,
-            "employees": []  # Initially no employees
+            "institution_name": institution_name
         }
 
         # Insert the institution into the database
         institutions_collection.insert_one(institution)
 
+        bump_master_data_version(db)
+
         return jsonify({"message": "Institution added successfully!"}), 200
 
     except Exception as e:
@@ -75,7 +182,12 @@ def delete_institution():
         
         if result.deleted_count == 0:
             return jsonify({"error": "Institution not found"}), 404
-            
+
+        # Delete its employees
+        get_employees_collection(db).delete_many({"institution_name": institution_name})
+
+        bump_master_data_version(db)
+
         return jsonify({"message": "Institution deleted successfully!"}), 200
         
     except Exception as e:
@@ -117,7 +229,15 @@ def edit_institution():
         
         if result.modified_count == 0:
             return jsonify({"error": "Failed to update institution name"}), 500
-            
+
+        # Move its employees to the new name
+        get_employees_collection(db).update_many(
+            {"institution_name": old_institution_name},
+            {"$set": {"institution_name": new_institution_name}}
+        )
+
+        bump_master_data_version(db)
+
         return jsonify({"message": "Institution name updated successfully!"}), 200
         
     except Exception as e:
@@ -140,28 +260,37 @@ def add_employees():
 
         db = get_db()
         institutions_collection = db["institutions"]
+        employees_collection = get_employees_collection(db)
 
-        # Find the institution in the database
-        institution = institutions_collection.find_one({"institution_name": institution_name})
-
-        if not institution:
+        if institutions_collection.count_documents({"institution_name": institution_name}, limit=1) == 0:
             return jsonify({"error": "Institution not found"}), 404
 
-        # Add the employees to the institution using provided NIC as ID
-        for nic, employee_data in employee_map.items():
-            institution["employees"].append({
-                "id": nic,
-                "name": employee_data.get("name"),
-                "accountNo": employee_data.get("accountNo"),
-                "capital": employee_data.get("capital"),
-                "interest": employee_data.get("interest")
-            })
-
-        # Update the institution with new employees
-        institutions_collection.update_one(
-            {"institution_name": institution_name},
-            {"$set": {"employees": institution["employees"]}}
+        # Using provided NIC as ID
+        employees = [
+            employee_document(institution_name, nic, employee_data)
+            for nic, employee_data in employee_map.items()
+        ]
+
+        # Account numbers must be unique within the institution, nothing is added otherwise
+        account_numbers = [employee["accountNo"] for employee in employees if "accountNo" in employee]
+        duplicates = {account_no for account_no in account_numbers if account_numbers.count(account_no) > 1}
+        duplicates.update(
+            employee["accountNo"] for employee in employees_collection.find(
+                {"institution_name": institution_name, "accountNo": {"$in": account_numbers}},
+                {"_id": 0, "accountNo": 1}
+            )
         )
+        if duplicates:
+            return jsonify({"error": f"Employees with these account numbers already exist: {', '.join(sorted(map(str, duplicates)))}"}), 409
+
+        try:
+            employees_collection.insert_many(employees, ordered=True)
+        except BulkWriteError:
+            # Another request added one of the account numbers meanwhile, keep the batch all or nothing
+            employees_collection.delete_many({"_id": {"$in": [employee["_id"] for employee in employees if "_id" in employee]}})
+            return jsonify({"error": "Employees with these account numbers already exist"}), 409
+
+        bump_master_data_version(db)
 
         return jsonify({"message": "Employees added successfully!"}), 200
 
@@ -183,27 +312,21 @@ def delete_employee():
             
         db = get_db()
         institutions_collection = db["institutions"]
-        
-        # Find the institution
-        institution = institutions_collection.find_one({"institution_name": institution_name})
-        
-        if not institution:
-            return jsonify({"error": "Institution not found"}), 404
-            
-        # Remove the employee from the list by account number
-        employees = institution["employees"]
-        initial_count = len(employees)
-        employees = [emp for emp in employees if emp["accountNo"] != account_no]
-        
-        if len(employees) == initial_count:
+        employees_collection = get_employees_collection(db)
+
+        # Remove every employee with the account number, including those that repeated it
+        result = employees_collection.delete_many({
+            "institution_name": institution_name,
+            "$or": [{"accountNo": account_no}, {DUPLICATE_ACCOUNT_FIELD: account_no}]
+        })
+
+        if result.deleted_count == 0:
+            if institutions_collection.count_documents({"institution_name": institution_name}, limit=1) == 0:
+                return jsonify({"error": "Institution not found"}), 404
             return jsonify({"error": "Employee with this account number not found"}), 404
-            
-        # Update the institution with the modified employees list
-        institutions_collection.update_one(
-            {"institution_name": institution_name},
-            {"$set": {"employees": employees}}
-        )
-        
+
+        bump_master_data_version(db)
+
         return jsonify({"message": "Employee deleted successfully!"}), 200
         
     except Exception as e:
@@ -224,42 +347,44 @@ def edit_employee():
             
         db = get_db()
         institutions_collection = db["institutions"]
-        
-        # Find the institution
-        institution = institutions_collection.find_one({"institution_name": institution_name})
-        
-        if not institution:
-            return jsonify({"error": "Institution not found"}), 404
-            
-        # Find and update the employee in the employees list
-        employees = institution["employees"]
-        employee_found = False
-        
-        for i, employee in enumerate(employees):
-            if employee["id"] == employee_id:
-                # Update employee data while preserving the ID
-                employees[i] = {
-                    "id": employee_id,  # Keep the original ID
-                    "name": updated_employee_data.get("name", employee.get("name")),
-                    "accountNo": updated_employee_data.get("accountNo", employee.get("accountNo")),
-                    "capital": updated_employee_data.get("capital", employee.get("capital")),
-                    "interest": updated_employee_data.get("interest", employee.get("interest"))
-                }
-                employee_found = True
-                break
-                
-        if not employee_found:
-            return jsonify({"error": "Employee not found"}), 404
-            
-        # Update the institution with the modified employees list
-        result = institutions_collection.update_one(
-            {"institution_name": institution_name},
-            {"$set": {"employees": employees}}
-        )
-        
-        if result.modified_count == 0:
+        employees_collection = get_employees_collection(db)
+
+        # Update only the given fields of the employee, the ID is kept
+        updates = {"$set": {}, "$unset": {}}
+        for field in EDITABLE_EMPLOYEE_FIELDS:
+            if field not in updated_employee_data:
+                continue
+            if field == "accountNo" and updated_employee_data[field] is None:
+                updates["$unset"][field] = ""
+            else:
+                updates["$set"][field] = updated_employee_data[field]
+        if "accountNo" in updated_employee_data:
+            # A new account number replaces one repeated from before they were unique
+            updates["$unset"].update({DUPLICATE_ACCOUNT_FIELD: "", "migrated_position": ""})
+        updates = {operator: fields for operator, fields in updates.items() if fields}
+
+        result = None
+        if updates:
+            try:
+                result = employees_collection.update_one(
+                    {"institution_name": institution_name, "id": employee_id},
+                    updates
+                )
+            except DuplicateKeyError:
+                return jsonify({"error": "Employee with this account number already exists"}), 409
+
+        if result is None or result.matched_count == 0:
+            # Only on failure, find out what was missing
+            if institutions_collection.count_documents({"institution_name": institution_name}, limit=1) == 0:
+                return jsonify({"error": "Institution not found"}), 404
+            if employees_collection.count_documents({"institution_name": institution_name, "id": employee_id}, limit=1) == 0:
+                return jsonify({"error": "Employee not found"}), 404
+
+        if result is None or result.modified_count == 0:
             return jsonify({"error": "Failed to update employee data"}), 500
-            
+
+        bump_master_data_version(db)
+
         return jsonify({"message": "Employee data updated successfully!"}), 200
         
     except Exception as e:
@@ -3,10 +3,14 @@ from openpyxl import load_workbook
 from flask_cors import CORS
 import logging
 from util.personal_accounts import update_personal_account
-from util.atomic_excel_operations import atomic_excel_operation  # Import our atomic operations
-from util.trial_balance_updates import update_capital_trial_balance, update_interest_trial_balance
-from util.main_ledger_update import update_main_ledger
+from util.workbook_writer import get_workbook_writer, wait_for_write, WriteTimeoutError  # Queued, group-committed cashbook writes
+from util.trial_balance_updates import update_capital_trial_balance, update_interest_trial_balance, update_trial_balance_batch
+from util.main_ledger_update import update_main_ledger, update_main_ledger_batch
 from util.validate_capital_limit_utilities import validate_capital_limit_xlsx
+from util.batch_personal_accounts import run_personal_account_phase
+from util.batch_payment_planner import plan_batch_payment
+from util.master_data import find_registered_employee, shared_account_error, MasterDataUnavailable
+from util.cashbook_cursor import find_insert_row, record_commit as record_cashbook_commit
 import os
 from dotenv import load_dotenv
 
@@ -39,21 +43,26 @@ def update_cell():
         if not cell or new_value is None:
             return jsonify({"error": "Cell and value are required"}), 400
 
-        # Use atomic operation for Excel file
-        with atomic_excel_operation(EXCEL_FILE_PATH) as wb:
+        def apply_update(wb):
             ws = wb[sheet_name]
             ws[cell] = new_value
-            # File is automatically saved and atomically replaced when exiting context
+
+        # Queued on the cashbook writer, returns once the change is saved
+        wait_for_write(get_workbook_writer(EXCEL_FILE_PATH).submit(apply_update))
 
         return jsonify({"message": f"Cell {cell} updated successfully!"})
 
+    except WriteTimeoutError as te:
+        return jsonify({"error": str(te)}), 503
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
-def perform_payment_operation(workbook, data):
+def perform_payment_operation(workbook, data, file_path=None):
     """
     Separated payment logic to work with atomic operations
+    
+    file_path is the cashbook path, used to resume the free row search from its cursor
     """
     # Extract all form data
     institute = data.get("institute")
@@ -88,46 +97,9 @@ def perform_payment_operation(workbook, data):
         except ValueError:
             raise ValueError("Interest amount must be a valid number")
     
-    # Check if the cells from Bfer to Jfer are empty
-    is_empty_row = True
-    for col in range(2, 11):  # B to J columns (2 to 10 in 0-based indexing)
-        cell_value = ws.cell(row=fer, column=col).value
-        if cell_value not in (None, ""):
-            is_empty_row = False
-            break
-    
-    # If the first row isn't empty, find three consecutive empty rows
-    current_row = fer
-    if not is_empty_row:
-        logger.info(f"First entry row {fer} is not empty, searching for three consecutive empty rows...")
-        found = False
-        
-        for row_num in range(fer, ws.max_row + 100):  # +100 to ensure we scan enough rows
-            empty_count = 0
-            empty_rows = []
-            
-            for check_row in range(row_num, row_num + 3):  # Check for 3 consecutive empty rows
-                row_empty = True
-                for col in range(2, 11):  # B to J columns
-                    if ws.cell(row=check_row, column=col).value not in (None, ""):
-                        row_empty = False
-                        break
-                
-                if row_empty:
-                    empty_count += 1
-                    empty_rows.append(check_row)
-                else:
-                    break
-            
-            if empty_count == 3:
-                # Use the second empty row
-                current_row = empty_rows[1]
-                logger.info(f"Found 3 consecutive empty rows, using row {current_row} for data entry")
-                found = True
-                break
-        
-        if not found:
-            raise ValueError("Could not find 3 consecutive empty rows for data entry")
+    # Use the first entry row if it is empty, otherwise the second row of the next 3 empty rows
+    current_row = find_insert_row(ws, file_path, fer)
+    logger.info(f"Using row {current_row} for data entry")
     
    
     ws.cell(row=current_row, column=1).value = date
@@ -201,17 +173,29 @@ def submit_payment():
         # Validate required fields
         if not all([institute, employee, cheq_no, acc_no, date]) or (capital_amount is None and interest_amount is None):
             return jsonify({"error": "Institution, Employee, Bill No, Cheq No, and Acc No are required. Either Capital or Interest amount must be provided."}), 400
+
+        # Take the registered name and account number of the employee from the master data
+        try:
+            registered_employee = find_registered_employee(institute, employee.get("accountNo"))
+            if registered_employee is None:
+                return jsonify({"error": f"Employee with account number {employee.get('accountNo')} is not registered in {institute}"}), 400
+            if registered_employee["shared_with"]:
+                return jsonify({"error": shared_account_error(registered_employee)}), 400
+            employee = dict(employee, name=registered_employee["employee_name"], accountNo=registered_employee["employee_accountNo"])
+        except MasterDataUnavailable as e:
+            logger.warning("Master data unavailable, using the employee details as sent: %s", str(e))
         
         if capital_amount:
             try:
                 logger.info(
             "INITIATING VALIDATION: Checking capital limit for %s (%s) at %s. Requested: %s", 
-            employee, acc_no, institute, capital_amount
+            employee, employee["accountNo"], institute, capital_amount
             )
+                # Validate the same account the personal account update below writes to
                 validate_capital_limit_xlsx(
-                    employee_name=employee,
+                    employee_name=employee["name"],
                     institution_name=institute,
-                    acc_no=acc_no,
+                    acc_no=employee["accountNo"],
                     capital=float(capital_amount)
                 )
                 logger.info("VALIDATION SUCCESS: Capital limit check passed for %s.", employee)
@@ -221,9 +205,12 @@ def submit_payment():
             except FileNotFoundError as fe:
                 return jsonify({"error": f"Account file not found: {str(fe)}"}), 404
         
-        # Perform atomic Excel operation
-        with atomic_excel_operation(EXCEL_FILE_PATH) as workbook:
-            current_row = perform_payment_operation(workbook, data)
+        # Queue the cashbook write, returns once it is saved
+        current_row = wait_for_write(get_workbook_writer(EXCEL_FILE_PATH).submit(
+            lambda workbook: perform_payment_operation(workbook, data, EXCEL_FILE_PATH),
+            # Rows current_row - 1 to current_row + 1 are now taken
+            on_commit=lambda row: record_cashbook_commit(EXCEL_FILE_PATH, int(data.get("firstEntry")), row + 2)
+        ))
         
         # After successful Excel update, update personal account
         logger.info("Updating personal account for employee: %s of institution: %s", employee["name"], institute)
@@ -291,6 +278,9 @@ def submit_payment():
             "personal_account_update": personal_account_result
         }), 200
         
+    except WriteTimeoutError as te:
+        logger.error("Cashbook write timed out in submit_payment: %s", str(te))
+        return jsonify({"error": str(te)}), 503
     except Exception as e:
         logger.error("Error in submit_payment: %s", str(e))
         import traceback
@@ -299,9 +289,11 @@ def submit_payment():
 
 
 
-def perform_batch_payment_operation(workbook, data):
+def perform_batch_payment_operation(workbook, data, file_path=None):
     """
     Enhanced batch payment logic with robust row availability checking
+    
+    file_path is the cashbook path, used to resume the free row search from its cursor
     """
     # Extract batch data
     date = data.get("date")
@@ -324,45 +316,9 @@ def perform_batch_payment_operation(workbook, data):
     # Find the starting row (either fer if empty, or first available position)
     starting_row = fer
     
-    # Check if the initial row (fer) is empty
-    is_initial_row_empty = True
-    for col in range(2, 11):  # B to J columns (2 to 10 in 0-based indexing)
-        cell_value = ws.cell(row=starting_row, column=col).value
-        if cell_value not in (None, ""):
-            is_initial_row_empty = False
-            break
-
-    # If the initial row isn't empty, find three consecutive empty rows
-    if not is_initial_row_empty:
-        logger.info(f"Row {starting_row} is not empty, searching for three consecutive empty rows...")
-        found = False
-        
-        for row_num in range(starting_row, ws.max_row + 100):  # +100 to ensure we scan enough rows
-            empty_count = 0
-            empty_rows = []
-            
-            for check_row in range(row_num, row_num + 3):  # Check for 3 consecutive empty rows
-                row_empty = True
-                for col in range(2, 11):  # B to J columns
-                    if ws.cell(row=check_row, column=col).value not in (None, ""):
-                        row_empty = False
-                        break
-                
-                if row_empty:
-                    empty_count += 1
-                    empty_rows.append(check_row)
-                else:
-                    break
-            
-            if empty_count == 3:
-                # Use the second empty row as starting point
-                starting_row = empty_rows[1]
-                logger.info(f"Found 3 consecutive empty rows, using row {starting_row} as starting point")
-                found = True
-                break
-        
-        if not found:
-            raise ValueError("Could not find 3 consecutive empty rows to start the batch operation")
+    # Use fer if it is empty, otherwise the second row of the next 3 empty rows
+    starting_row = find_insert_row(ws, file_path, starting_row)
+    logger.info(f"Using row {starting_row} as starting point")
 
     # Now validate that we have enough consecutive empty rows for the entire batch
     logger.info(f"Validating {required_rows} consecutive empty rows starting from row {starting_row}")
@@ -501,163 +457,104 @@ def submit_batch_payment():
 
         logs.append("Starting batch payment processing...")
 
-        
-        
-        # Perform atomic Excel operation
-        with atomic_excel_operation(EXCEL_FILE_PATH) as workbook:
-            updated_rows, processed_employees = perform_batch_payment_operation(workbook, data)
+        # Find every target row and check every limit before anything is written
+        plan = plan_batch_payment(data)
+
+        if plan["errors"]:
+            logs.append("Batch payment was not processed, nothing was written:")
+            logs.extend(f"✗ {error}" for error in plan["errors"])
+            return jsonify({
+                "error": "Batch payment validation failed",
+                "errors": plan["errors"],
+                "logs": logs,
+                "success": False
+            }), 400
+
+        personal_account_entries = plan["entries"]
+        logs.append(f"Planned payments for {len(personal_account_entries)} employees.")
+
+        def record_batch_commit(result):
+            rows = result[0]
+            if rows:
+                # Each employee takes 3 rows, the last one ends at its row + 1
+                record_cashbook_commit(EXCEL_FILE_PATH, int(first_entry), rows[-1] + 2)
+
+        # Queue the cashbook write, returns once it is saved
+        updated_rows, _ = wait_for_write(get_workbook_writer(EXCEL_FILE_PATH).submit(
+            lambda workbook: perform_batch_payment_operation(workbook, data, EXCEL_FILE_PATH),
+            on_commit=record_batch_commit
+        ))
 
         logs.append(f"Excel operation completed. Updated {len(updated_rows)} rows.")
 
-        # After successful Excel update, update personal accounts
+        # The planned rows are written, independent personal account files in parallel; outcomes come back in employee order
+        personal_account_outcomes = run_personal_account_phase(personal_account_entries)
+
         personal_account_results = []
-        for employee in processed_employees:
-            employee_name = employee.get("name")
-            institution_name = employee.get("institution")
-            capital_amount = employee.get("capitalAmount")
-            acc_no = employee.get("accNo")
-
-            b_no = employee.get("billNo") if employee.get("billNo") else "BS"
-            # If chequeNo is empty/None, use empty string
-            c_no = employee.get("chequeNo", "")
+        main_ledger_entries = []
+        for entry, outcome in zip(personal_account_entries, personal_account_outcomes):
+            employee_name = entry["employee_name"]
             
-            logs.append(f"Processing employee: {employee_name} from {institution_name}")
-
-            validation_failed = False # Flag to track status
-
-            if capital_amount:
-                try:
-                    logger.info(
-                        "INITIATING VALIDATION: Checking capital limit for %s (%s) at %s. Requested: %s", 
-                        employee_name, acc_no, institution_name, capital_amount
-                    )
-                    
-                    validate_capital_limit_xlsx(
-                        employee_name=employee_name,
-                        institution_name=institution_name,
-                        acc_no=acc_no,
-                        capital=float(capital_amount)
-                    )
-                    
-                    logger.info("VALIDATION SUCCESS: Capital limit check passed for %s.", employee_name)
-
-                except ValueError as ve:
-                    # Logic: If validation fails, LOG it, RECORD it, and SKIP to next person
-                    error_msg = str(ve)
-                    logger.warning(f"Validation Failed for {employee_name}: {error_msg}")
-                    logs.append(f"✗ SKIPPED {employee_name}: {error_msg}")
-                    validation_failed = True # Set flag to true
-                    
-                except FileNotFoundError as fe:
-                    error_msg = f"Account file not found: {str(fe)}"
-                    logger.error(f"Validation Error for {employee_name}: {error_msg}")
-                    logs.append(f"✗ SKIPPED {employee_name}: {error_msg}")
-                    validation_failed = True # Set flag to true
-
-            # CRITICAL CHECK: If validation failed, jump to the next employee immediately
-            if validation_failed:
-                continue
-            
-            # Update personal account
-            logger.info("Updating personal account for employee: %s of institution: %s", 
-                       employee_name, institution_name)
-            #logs.append(f"Updating personal account for {employee_name}")
-            personal_account_result = update_personal_account(
-                employee_name=employee_name,
-                employee_accountNo=employee.get("accNo"),
-                institution_name=institution_name,
-                date=date,
-                capital=float(employee.get("capitalAmount")) if employee.get("capitalAmount") else None,
-                interest=float(employee.get("interestAmount")) if employee.get("interestAmount") else None,
-                description=employee.get("description"),
-                bill_no=b_no,
-                cheque_no=c_no
-            )
+            logs.append(f"Processing employee: {employee_name} from {entry['institution_name']}")
+            logs.extend(outcome["logs"])
 
-            if personal_account_result["success"]:
-                logger.info("Personal account update successful for %s: %s", 
-                           employee_name, personal_account_result["message"])
-                logs.append(f"✓ Personal account updated successfully for {employee_name}")
-            else:
-                logger.error("Failed to update personal account for %s in %s: %s", 
-                           employee_name, institution_name, personal_account_result["error"])
-                logs.append(f"✗ Failed to update personal account for {employee_name} in {institution_name}: {personal_account_result['error']}")
-
-            # Update trial balance interest
-            logger.info("Updating trial balance interest for employee: %s of institution: %s", 
-                       employee_name, institution_name)
-            #logs.append(f"Updating trial balance interest for {employee_name}")
-            update_trial_balance_interest_result = update_interest_trial_balance(
-                employee_name=employee_name,
-                employee_accountNo=employee.get("accNo"),
-                institution_name=institution_name,
-                date=date,
-                capital=float(employee.get("capitalAmount")) if employee.get("capitalAmount") else None,
-                interest=float(employee.get("interestAmount")) if employee.get("interestAmount") else None
-            )
-
-            if update_trial_balance_interest_result["success"]:
-                logger.info("Trial balance interest update successful for %s: %s", 
-                           employee_name, update_trial_balance_interest_result["message"])
-                logs.append(f"✓ Trial balance interest updated successfully for {employee_name}")
-            else:
-                logger.error("Failed to update trial balance interest for %s: %s", 
-                           employee_name, update_trial_balance_interest_result["error"])
-                logs.append(f"✗ Failed to update trial balance interest for {employee_name}: {update_trial_balance_interest_result['error']}")
-
-            # Update trial balance capital
-            logger.info("Updating trial balance capital for employee: %s of institution: %s", 
-                       employee_name, institution_name)
-            #logs.append(f"Updating trial balance capital for {employee_name}")
-            update_trial_balance_capital_result = update_capital_trial_balance(
-                employee_name=employee_name,
-                employee_accountNo=employee.get("accNo"),
-                institution_name=institution_name,
-                date=date,
-                capital=float(employee.get("capitalAmount")) if employee.get("capitalAmount") else None,
-                interest=float(employee.get("interestAmount")) if employee.get("interestAmount") else None
-            )
-
-            if update_trial_balance_capital_result["success"]:
-                logger.info("Trial balance capital update successful for %s: %s", 
-                           employee_name, update_trial_balance_capital_result["message"])
-                logs.append(f"✓ Trial balance capital updated successfully for {employee_name}")
-            else:
-                logger.error("Failed to update trial balance capital for %s: %s", 
-                           employee_name, update_trial_balance_capital_result["error"])
-                logs.append(f"✗ Failed to update trial balance capital for {employee_name}: {update_trial_balance_capital_result['error']}")
-
-            # Update main ledger
-            logger.info("Updating main ledger for employee: %s of institution: %s", 
-                       employee_name, institution_name)
-            #logs.append(f"Updating main ledger for {employee_name}")
-            update_main_ledger_result = update_main_ledger(
-                employee_name=employee_name,
-                employee_accountNo=employee.get("accNo"),
-                institution_name=institution_name,
-                date=date,
-                ledger_debit_column=ledger_debit_column,
-                ledger_interest_column=ledger_interest_column,
-                capital=float(employee.get("capitalAmount")) if employee.get("capitalAmount") else None,
-                interest=float(employee.get("interestAmount")) if employee.get("interestAmount") else None
-            )
+            # If validation failed, the employee is skipped for the remaining files
+            if outcome["validation_failed"]:
+                continue
 
-            if update_main_ledger_result["success"]:
-                logger.info("Main ledger update successful for %s: %s", 
-                           employee_name, update_main_ledger_result["message"])
-                logs.append(f"✓ Main ledger updated successfully for {employee_name}")
-            else:
-                logger.error("Failed to update main ledger for %s: %s", 
-                           employee_name, update_main_ledger_result["error"])
-                logs.append(f"✗ Failed to update main ledger for {employee_name}: {update_main_ledger_result['error']}")
+            # Queue the trial balance and main ledger updates, both files are written once for the whole batch
+            main_ledger_entries.append({
+                "employee_name": employee_name,
+                "employee_accountNo": entry["employee_accountNo"],
+                "institution_name": entry["institution_name"],
+                "date": date,
+                "capital": entry["capital"],
+                "interest": entry["interest"],
+                "ledger_rows": entry["ledger_rows"]
+            })
 
             logs.append(f"Completed processing for {employee_name}")
 
             personal_account_results.append({
                 "employee": employee_name,
-                "result": personal_account_result
+                "result": outcome["result"]
             })
 
+        # Update trial balance (capital and interest) for all processed employees in a single load/save
+        if main_ledger_entries:
+            logger.info("Updating trial balance for %d employees", len(main_ledger_entries))
+            update_trial_balance_result = update_trial_balance_batch(main_ledger_entries)
+
+            for entry in main_ledger_entries:
+                employee_name = entry["employee_name"]
+                if update_trial_balance_result["success"]:
+                    logs.append(f"✓ Trial balance interest updated successfully for {employee_name}")
+                    logs.append(f"✓ Trial balance capital updated successfully for {employee_name}")
+                else:
+                    logger.error("Failed to update trial balance for %s: %s", 
+                               employee_name, update_trial_balance_result["error"])
+                    logs.append(f"✗ Failed to update trial balance for {employee_name}: {update_trial_balance_result['error']}")
+
+        # Update main ledger for all processed employees in a single load/save
+        if main_ledger_entries:
+            logger.info("Updating main ledger for %d employees", len(main_ledger_entries))
+            main_ledger_results = update_main_ledger_batch(
+                entries=main_ledger_entries,
+                ledger_debit_column=ledger_debit_column,
+                ledger_interest_column=ledger_interest_column
+            )
+
+            for entry, update_main_ledger_result in zip(main_ledger_entries, main_ledger_results):
+                employee_name = entry["employee_name"]
+                if update_main_ledger_result["success"]:
+                    logger.info("Main ledger update successful for %s: %s", 
+                               employee_name, update_main_ledger_result["message"])
+                    logs.append(f"✓ Main ledger updated successfully for {employee_name}")
+                else:
+                    logger.error("Failed to update main ledger for %s: %s", 
+                               employee_name, update_main_ledger_result["error"])
+                    logs.append(f"✗ Failed to update main ledger for {employee_name}: {update_main_ledger_result['error']}")
+
         logs.append("Batch payment processing completed successfully!")
 
         # Return success message with logs
@@ -669,6 +566,10 @@ def submit_batch_payment():
             "success": True
         }), 200
 
+    except WriteTimeoutError as te:
+        logger.error("Cashbook write timed out in submit_batch_payment: %s", str(te))
+        logs.append(f"Error occurred: {str(te)}")
+        return jsonify({"error": str(te), "logs": logs, "success": False}), 503
     except Exception as e:
         error_msg = str(e)
         logs.append(f"Error occurred: {error_msg}")
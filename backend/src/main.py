@@ -4,6 +4,8 @@ from flask import Flask
 from flask_cors import CORS
 from database_controllers.database_controller import add_institution, add_employees, delete_institution ,delete_employee, get_institutions, edit_institution, edit_employee
 from excel_controllers.excel_controller import update_cell, submit_payment, submit_batch_payment
+from util.excel_journal import recover_incomplete_operations
+from mongo.employee_store import prepare_employees_collection
 
 app = Flask(__name__)
 CORS(app, resources={r"/*": {
@@ -26,4 +28,11 @@ app.add_url_rule('/submitPayment', view_func=submit_payment, methods=['POST'])
 app.add_url_rule('/submitExcelBatchPayment', view_func=submit_batch_payment, methods=['POST'])
 
 if __name__ == '__main__':
+    # Only in the serving process: spawned batch pool workers import this module as __mp_main__
+    # Resolve Excel writes interrupted by a crash or power loss before serving requests
+    recover_incomplete_operations()
+
+    # Create the employees collection indexes and move any embedded employees into it
+    prepare_employees_collection()
+
     app.run(debug=True)
@@ -0,0 +1,79 @@
+# mongo/data_version.py
+
+import os
+import time
+import logging
+import threading
+from dotenv import load_dotenv
+from pymongo import ReturnDocument
+from mongo.mongo_connector import get_db
+
+load_dotenv()
+
+# Seconds a process trusts its last read of the master data version before reading it again.
+# Changes made by the process itself are seen at once, changes made by other processes after at most this long.
+MASTER_DATA_VERSION_TTL = float(os.getenv('MASTER_DATA_VERSION_TTL', '5'))
+
+COUNTERS_COLLECTION = "counters"
+MASTER_DATA_COUNTER = "master_data"
+
+logger = logging.getLogger(__name__)
+
+_version = None
+_version_read_at = 0.0
+_version_lock = threading.Lock()
+
+
+def _remember_version(version: int):
+    global _version, _version_read_at
+
+    with _version_lock:
+        # Never go back to an older version read by a slower request
+        if _version is None or version >= _version:
+            _version = version
+        _version_read_at = time.monotonic()
+
+
+def bump_master_data_version(db=None) -> int:
+    """
+    Record a change of the institutions or employees. Every endpoint that
+    changes them calls this after writing.
+
+    Args:
+        db (optional): The application database. Defaults to get_db().
+
+    Returns:
+        int: The new version
+    """
+    db = get_db() if db is None else db
+    counter = db[COUNTERS_COLLECTION].find_one_and_update(
+        {"_id": MASTER_DATA_COUNTER},
+        {"$inc": {"version": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    _remember_version(counter["version"])
+    return counter["version"]
+
+
+def get_master_data_version(db=None, fresh: bool = False) -> int:
+    """
+    Get the version of the institutions and employees, read from MongoDB at
+    most once every MASTER_DATA_VERSION_TTL seconds.
+
+    Args:
+        db (optional): The application database. Defaults to get_db().
+        fresh (bool, optional): Read it from MongoDB now, for answers that must
+            not lag behind other processes. Defaults to False.
+
+    Returns:
+        int: The current version, 0 before the first change
+    """
+    with _version_lock:
+        if not fresh and _version is not None and time.monotonic() - _version_read_at < MASTER_DATA_VERSION_TTL:
+            return _version
+
+    db = get_db() if db is None else db
+    counter = db[COUNTERS_COLLECTION].find_one({"_id": MASTER_DATA_COUNTER})
+    _remember_version(counter["version"] if counter else 0)
+    return _version
@@ -0,0 +1,206 @@
+# mongo/employee_store.py
+
+import logging
+import threading
+from pymongo import ASCENDING, UpdateOne
+from mongo.mongo_connector import get_db
+from mongo.data_version import bump_master_data_version
+
+INSTITUTIONS_COLLECTION = "institutions"
+EMPLOYEES_COLLECTION = "employees"
+
+# Employee fields as returned by the endpoints, in order
+EMPLOYEE_FIELDS = ("id", "name", "accountNo", "capital", "interest")
+# Field holding the account number of an employee that repeats one already taken in its
+# institution (from before account numbers were unique), outside the unique index
+DUPLICATE_ACCOUNT_FIELD = "duplicate_accountNo"
+
+logger = logging.getLogger(__name__)
+
+_ready = False
+_ready_lock = threading.Lock()
+
+
+def employee_document(institution_name: str, employee_id, employee_data: dict) -> dict:
+    """
+    Build the employees collection document of an employee.
+    A missing account number is left out of the document, so that the unique
+    (institution, accountNo) index only applies to employees that have one.
+
+    Args:
+        institution_name (str): Name of the employee's institution
+        employee_id: The employee ID (NIC)
+        employee_data (dict): name, accountNo, capital and interest
+
+    Returns:
+        dict: The document to store
+    """
+    document = {
+        "institution_name": institution_name,
+        "id": employee_id,
+        "name": employee_data.get("name"),
+        "capital": employee_data.get("capital"),
+        "interest": employee_data.get("interest")
+    }
+    if employee_data.get("accountNo") is not None:
+        document["accountNo"] = employee_data.get("accountNo")
+    return document
+
+
+def employee_response(document: dict) -> dict:
+    """
+    Turn an employees collection document into the employee JSON of the endpoints.
+    An employee repeating an account number gets it as accountNo too, marked with duplicate.
+    """
+    response = {field: document.get(field) for field in EMPLOYEE_FIELDS}
+    if DUPLICATE_ACCOUNT_FIELD in document:
+        response["accountNo"] = document[DUPLICATE_ACCOUNT_FIELD]
+        response["duplicate"] = True
+    return response
+
+
+def create_institution_indexes(db):
+    """
+    Create the index /getInstitutions pages the institutions by, if it does not exist yet
+    """
+    db[INSTITUTIONS_COLLECTION].create_index([("institution_name", ASCENDING)], name="institution_name")
+
+
+def create_employee_indexes(db):
+    """
+    Create the indexes of the employees collection, if they do not exist yet
+    """
+    employees_collection = db[EMPLOYEES_COLLECTION]
+    employees_collection.create_index(
+        [("institution_name", ASCENDING), ("accountNo", ASCENDING)],
+        name="institution_accountNo",
+        unique=True,
+        partialFilterExpression={"accountNo": {"$exists": True}}
+    )
+    # Employees of an institution in insertion order
+    employees_collection.create_index(
+        [("institution_name", ASCENDING), ("_id", ASCENDING)], name="institution_order"
+    )
+    employees_collection.create_index(
+        [("institution_name", ASCENDING), ("id", ASCENDING)], name="institution_id"
+    )
+    employees_collection.create_index([("accountNo", ASCENDING)], name="accountNo")
+    employees_collection.create_index(
+        [("institution_name", ASCENDING), (DUPLICATE_ACCOUNT_FIELD, ASCENDING)],
+        name="institution_duplicate_accountNo",
+        partialFilterExpression={DUPLICATE_ACCOUNT_FIELD: {"$exists": True}}
+    )
+
+
+def migrate_embedded_employees(db) -> int:
+    """
+    Move the employees embedded in institution documents into the employees
+    collection, keeping their order. Each institution is upserted then has its
+    embedded array removed, so an interrupted migration is simply run again.
+    Employees repeating an account number already taken in their institution
+    keep it in duplicate_accountNo instead, outside the unique index, and are
+    still listed by the endpoints.
+
+    Args:
+        db: The application database
+
+    Returns:
+        int: Number of institutions migrated
+    """
+    institutions_collection = db[INSTITUTIONS_COLLECTION]
+    employees_collection = db[EMPLOYEES_COLLECTION]
+    migrated = 0
+
+    # unmigrated_employees were left on institutions by earlier versions of this migration
+    pending = {"$or": [{"employees": {"$exists": True}}, {"unmigrated_employees": {"$exists": True}}]}
+    for institution in institutions_collection.find(pending):
+        institution_name = institution["institution_name"]
+        operations = []
+        duplicates = 0
+        seen_account_numbers = set()
+
+        embedded = institution.get("employees") or []
+        unmigrated = institution.get("unmigrated_employees") or []
+
+        for position, employee in enumerate(embedded + unmigrated):
+            document = employee_document(institution_name, employee.get("id"), employee)
+            account_no = document.get("accountNo")
+
+            if account_no is None:
+                key = {"institution_name": institution_name, "id": document["id"], "accountNo": {"$exists": False}}
+            elif account_no in seen_account_numbers or position >= len(embedded):
+                document[DUPLICATE_ACCOUNT_FIELD] = document.pop("accountNo")
+                # The position tells repeated entries apart when the migration is run again
+                document["migrated_position"] = position
+                key = {"institution_name": institution_name, DUPLICATE_ACCOUNT_FIELD: account_no, "migrated_position": position}
+                duplicates += 1
+            else:
+                seen_account_numbers.add(account_no)
+                key = {"institution_name": institution_name, "accountNo": account_no}
+
+            operations.append(UpdateOne(key, {"$setOnInsert": document}, upsert=True))
+
+        if operations:
+            employees_collection.bulk_write(operations, ordered=True)
+
+        institutions_collection.update_one(
+            {"_id": institution["_id"]}, {"$unset": {"employees": "", "unmigrated_employees": ""}}
+        )
+
+        if duplicates:
+            logger.warning(f"{duplicates} employees of {institution_name} repeat an account number, migrated with duplicate_accountNo")
+        logger.info(f"Migrated {len(operations)} employees of {institution_name} to the employees collection")
+        migrated += 1
+
+    return migrated
+
+
+def ensure_employees_collection(db=None):
+    """
+    Create the institution and employees collection indexes and migrate
+    embedded employees, once per process.
+
+    Args:
+        db (optional): The application database. Defaults to get_db().
+    """
+    global _ready
+
+    if _ready:
+        return
+
+    with _ready_lock:
+        if _ready:
+            return
+        db = get_db() if db is None else db
+        create_institution_indexes(db)
+        create_employee_indexes(db)
+        if migrate_embedded_employees(db):
+            bump_master_data_version(db)
+        duplicates = db[EMPLOYEES_COLLECTION].count_documents({DUPLICATE_ACCOUNT_FIELD: {"$exists": True}})
+        if duplicates:
+            logger.warning(f"{duplicates} employees repeat an account number of their institution and cannot be paid until it is changed")
+        _ready = True
+
+
+def get_employees_collection(db):
+    """
+    Get the employees collection of db, ready for use
+    """
+    ensure_employees_collection(db)
+    return db[EMPLOYEES_COLLECTION]
+
+
+def prepare_employees_collection() -> bool:
+    """
+    Prepare the employees collection at startup. When MongoDB cannot be reached
+    the error is logged and the first request using the collection tries again.
+
+    Returns:
+        bool: Whether the collection is ready
+    """
+    try:
+        ensure_employees_collection()
+        return True
+    except Exception as e:
+        logger.error(f"Could not prepare the employees collection: {str(e)}")
+        return False
@@ -3,16 +3,87 @@
 from pymongo import MongoClient
 from dotenv import load_dotenv
 import os
+import atexit
 import logging
+import threading
 
 load_dotenv()
 
 MONGO_URI = os.getenv('MONGO_URI')
+MONGO_DB_NAME = os.getenv('MONGO_DB_NAME', 'AlgoLoanSystem')
 
-def get_db():
-    client = MongoClient(MONGO_URI)  # Replace with your connection string if different
-    db = client["AlgoLoanSystem"]
-    return db
+# Connection pool of the shared client, per process
+MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', '50'))
+MONGO_MIN_POOL_SIZE = int(os.getenv('MONGO_MIN_POOL_SIZE', '0'))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv('MONGO_MAX_IDLE_TIME_MS', '300000'))
+
+# Timeouts in milliseconds
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000'))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', '5000'))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv('MONGO_SOCKET_TIMEOUT_MS', '30000'))
+
+logger = logging.getLogger(__name__)
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> MongoClient:
+    """
+    Get the MongoClient shared by the whole process, created on first use.
+
+    The client is created with connect=False, so nothing is sent to the server
+    until the first operation, and its connection pool is reused by every request.
+    A process forked after the client was created (e.g. a pre-forking server
+    worker) gets a client of its own, since pymongo clients are not fork-safe.
+
+    Returns:
+        MongoClient: The client of the current process
+    """
+    global _client, _client_pid
 
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
 
+    with _client_lock:
+        if _client is None or _client_pid != pid:
+            # A client inherited from the parent process is dropped without
+            # closing it, its sockets belong to the parent
+            _client = MongoClient(
+                MONGO_URI,
+                connect=False,
+                maxPoolSize=MONGO_MAX_POOL_SIZE,
+                minPoolSize=MONGO_MIN_POOL_SIZE,
+                maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+                serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+                socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+            )
+            _client_pid = pid
+            logger.info(f"Created MongoDB client for process {pid} with pool size {MONGO_MAX_POOL_SIZE}")
+        return _client
 
+
+def close_client():
+    """
+    Close the shared client of the current process, if one was created
+    """
+    global _client, _client_pid
+
+    with _client_lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
+
+
+atexit.register(close_client)
+
+
+def get_db():
+    """
+    Get the application database on the shared client. No connection is made here.
+    """
+    return get_client()[MONGO_DB_NAME]
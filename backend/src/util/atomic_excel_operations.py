@@ -1,64 +1,69 @@
 import os
-import shutil
+import glob
 import tempfile
 import logging
 from contextlib import contextmanager
-from openpyxl import load_workbook
+from util.file_locks import file_lock
+from util.file_stamps import get_file_stamp
+from util.workbook_cache import checkout_workbook, checkin_workbook
+from util.excel_journal import record_prepared, record_finished, fsync_directory, COMMITTED, ROLLED_BACK
 
 logger = logging.getLogger(__name__)
 
+# Files whose stale temporary files were already removed by this process
+_swept_paths = set()
+
+
 class AtomicExcelOperation:
     """
     Context manager for atomic Excel file operations.
-    Creates a temporary copy, performs operations, and atomically replaces the original.
+    Loads the original, performs operations, saves them to a temporary file in
+    the same directory and atomically replaces the original with it.
+    The original is never written in place, so a crash at any point leaves
+    either the old or the new file; at most a stray temporary file remains,
+    which is removed by the next operation on the file.
+    The file lock is held from before the load until the original is replaced,
+    so concurrent operations on the same file run one after another.
     """
     
-    def __init__(self, original_file_path):
+    def __init__(self, original_file_path, on_commit=None):
         self.original_file_path = original_file_path
-        self.temp_file_path = None
+        self.on_commit = on_commit
         self.workbook = None
+        self.lock_wait_seconds = None
+        self._lock = None
         
     def __enter__(self):
         """
-        Create temporary copy and return workbook for operations
+        Lock the file and return the loaded workbook for operations
         """
         try:
+            # Wait for any other thread or process working on this file
+            self._lock = file_lock(self.original_file_path)
+            self.lock_wait_seconds = self._lock.__enter__()
+            logger.info(f"Acquired lock on {self.original_file_path} after {self.lock_wait_seconds:.3f}s")
+            
             # Validate that original file exists
             if not os.path.exists(self.original_file_path):
                 raise FileNotFoundError(f"Original Excel file not found: {self.original_file_path}")
             
-            # Create temporary file with same extension
-            file_dir = os.path.dirname(self.original_file_path)
-            file_name = os.path.basename(self.original_file_path)
-            name, ext = os.path.splitext(file_name)
-            
-            # Create temporary file in the same directory as original
-            temp_fd, self.temp_file_path = tempfile.mkstemp(
-                suffix=ext, 
-                prefix=f"{name}_temp_", 
-                dir=file_dir
-            )
-            os.close(temp_fd)  # Close the file descriptor
-            
-            # Copy original file to temporary location
-            shutil.copy2(self.original_file_path, self.temp_file_path)
-            logger.info(f"Created temporary copy: {self.temp_file_path}")
-            
-            # Load workbook from temporary file
-            self.workbook = load_workbook(self.temp_file_path)
-            logger.info("Loaded workbook from temporary file")
+            # Reuse the cached workbook if the file is unchanged, otherwise load
+            # straight from the original, which is only read here
+            self.workbook, _ = checkout_workbook(self.original_file_path)
+            logger.info(f"Loaded workbook from {self.original_file_path}")
             
             return self.workbook
             
         except Exception as e:
             # Cleanup if initialization fails
-            self._cleanup_temp_file()
+            self._close_workbook()
+            self._release_lock()
             logger.error(f"Failed to initialize atomic operation: {str(e)}")
             raise
     
     def __exit__(self, exc_type, exc_val, exc_tb):
         """
-        Save changes and atomically replace original file, or cleanup on error
+        Save changes and atomically replace original file, or discard them on error
         """
         try:
             if exc_type is None:
@@ -66,76 +71,139 @@ class AtomicExcelOperation:
                 self._commit_changes()
                 logger.info("Atomic operation completed successfully")
             else:
-                # Exception occurred, cleanup without committing
+                # Exception occurred, the original was never touched; the
+                # workbook may hold partial changes so it is not cached again
                 logger.error(f"Exception in atomic operation: {exc_val}")
-                self._cleanup_temp_file()
                 
         except Exception as commit_error:
             logger.error(f"Error during commit: {str(commit_error)}")
-            self._cleanup_temp_file()
             raise commit_error
+        finally:
+            self._close_workbook()
+            self._release_lock()
     
     def _commit_changes(self):
         """
-        Save workbook and atomically replace original file
+        Save workbook to a temporary file and atomically replace original file
         """
-        try:
-            if self.workbook:
-                # Save changes to temporary file
-                self.workbook.save(self.temp_file_path)
-                logger.info("Saved changes to temporary file")
-                
-                # Close workbook to release file handles
-                self.workbook.close()
+        if self.workbook:
+            save_workbook_atomically(self.workbook, self.original_file_path)
+            
+            # Read while the lock is held, so it is the stamp of exactly this content
+            stamp = get_file_stamp(self.original_file_path)
+            
+            # The workbook now matches the saved file, keep it for the next operation
+            if checkin_workbook(self.original_file_path, self.workbook, stamp):
                 self.workbook = None
-                
-                # Create backup of original file (optional safety measure)
-                backup_path = f"{self.original_file_path}.backup"
-                if os.path.exists(backup_path):
-                    os.remove(backup_path)
-                shutil.copy2(self.original_file_path, backup_path)
-                logger.info(f"Created backup: {backup_path}")
-                
-                # Atomically replace original file
-                if os.name == 'nt':  # Windows
-                    # On Windows, we need to remove the target first
-                    if os.path.exists(self.original_file_path):
-                        os.remove(self.original_file_path)
-                    shutil.move(self.temp_file_path, self.original_file_path)
-                else:  # Unix/Linux/Mac
-                    # On Unix systems, os.rename is atomic
-                    os.rename(self.temp_file_path, self.original_file_path)
-                
-                logger.info("Atomically replaced original file")
-                
-                # Remove backup after successful operation
-                if os.path.exists(backup_path):
-                    os.remove(backup_path)
-                    
-        except Exception as e:
-            logger.error(f"Error during commit: {str(e)}")
-            self._cleanup_temp_file()
-            raise
+            
+            if self.on_commit is not None:
+                self.on_commit(stamp)
     
-    def _cleanup_temp_file(self):
+    def _release_lock(self):
+        """
+        Release the file lock if it is held
         """
-        Clean up temporary file
+        if self._lock is not None:
+            lock, self._lock = self._lock, None
+            lock.__exit__(None, None, None)
+
+    def _close_workbook(self):
+        """
+        Close the workbook to release file handles
         """
         try:
             if self.workbook:
                 self.workbook.close()
                 self.workbook = None
                 
-            if self.temp_file_path and os.path.exists(self.temp_file_path):
-                os.remove(self.temp_file_path)
-                logger.info(f"Cleaned up temporary file: {self.temp_file_path}")
-                
         except Exception as e:
-            logger.warning(f"Error cleaning up temporary file: {str(e)}")
+            logger.warning(f"Error closing workbook: {str(e)}")
+
+
+def _temp_file_prefix(file_path):
+    name, ext = os.path.splitext(os.path.basename(file_path))
+    return f"{name}_temp_", ext
+
+
+def remove_stale_temp_files(file_path):
+    """
+    Remove temporary files left next to file_path by an operation that crashed
+    before its replace. Done once per file and process; the caller must hold
+    the file lock, so no temporary file of a running operation can be removed.
+    """
+    key = os.path.normcase(os.path.abspath(file_path))
+    if key in _swept_paths:
+        return
+    
+    prefix, ext = _temp_file_prefix(file_path)
+    pattern = os.path.join(glob.escape(os.path.dirname(file_path)), f"{glob.escape(prefix)}*{glob.escape(ext)}")
+    for stale_path in glob.glob(pattern):
+        try:
+            os.remove(stale_path)
+            logger.info(f"Removed stale temporary file: {stale_path}")
+        except OSError as e:
+            logger.warning(f"Error removing stale temporary file {stale_path}: {str(e)}")
+    
+    _swept_paths.add(key)
+
+
+def replace_file_atomically(file_path, write_content):
+    """
+    Write new content for file_path to a temporary file next to it and
+    atomically replace file_path with it. The temporary file is flushed to disk
+    and recorded as prepared in the Excel journal before the replace; the
+    replace is recorded as committed as soon as it is done, then flushed
+    (directory fsync, a failure of which is only logged), and an interrupted
+    replace is resolved by journal recovery at startup.
+    The caller must hold the file lock.
+    
+    Args:
+        file_path: Path of the Excel file to replace
+        write_content: Called with the binary temporary file object to write the new content into
+    """
+    remove_stale_temp_files(file_path)
+    
+    file_dir = os.path.dirname(file_path)
+    prefix, ext = _temp_file_prefix(file_path)
+    temp_fd, temp_file_path = tempfile.mkstemp(suffix=ext, prefix=prefix, dir=file_dir)
+    op_id = None
+    try:
+        with os.fdopen(temp_fd, "wb") as temp_file:
+            write_content(temp_file)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        
+        op_id = record_prepared(file_path, temp_file_path)
+        os.replace(temp_file_path, file_path)
+    except Exception:
+        if os.path.exists(temp_file_path):
+            os.remove(temp_file_path)
+            record_finished(op_id, ROLLED_BACK)
+        raise
+    
+    # The new content is in place once os.replace returns, whatever happens to the directory fsync
+    record_finished(op_id, COMMITTED)
+    try:
+        fsync_directory(file_dir)
+    except OSError as e:
+        logger.warning(f"Replaced {file_path} but could not flush its directory, the replace may not survive a power loss: {str(e)}")
+    logger.info(f"Atomically replaced {file_path}")
+
+
+def save_workbook_atomically(workbook, file_path):
+    """
+    Save a workbook over file_path with replace_file_atomically.
+    The caller must hold the file lock.
+    
+    Args:
+        workbook: The openpyxl workbook to save
+        file_path: Path of the Excel file to replace
+    """
+    replace_file_atomically(file_path, workbook.save)
 
 
 @contextmanager
-def atomic_excel_operation(file_path):
+def atomic_excel_operation(file_path, on_commit=None):
     """
     Convenience function to use atomic Excel operations as a context manager
     
@@ -144,8 +212,13 @@ def atomic_excel_operation(file_path):
             ws = wb["Sheet1"]
             ws["A1"] = "New Value"
             # Changes are automatically committed when exiting the context
+    
+    Args:
+        file_path: Path to the Excel file
+        on_commit (optional): Called with the stamp of the saved file after the
+            replace, while the file lock is still held
     """
-    atomic_op = AtomicExcelOperation(file_path)
+    atomic_op = AtomicExcelOperation(file_path, on_commit)
     try:
         wb = atomic_op.__enter__()
         yield wb
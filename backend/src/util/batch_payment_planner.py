@@ -0,0 +1,115 @@
+import logging
+from util.batch_personal_accounts import plan_personal_account_phase
+from util.main_ledger_update import locate_main_ledger_rows
+from util.master_data import resolve_batch_entries
+
+logger = logging.getLogger(__name__)
+
+
+def _amount(value, label: str, employee_name: str):
+    """
+    Convert an amount from the request, None when it is not given
+    """
+    if not value:
+        return None
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        raise ValueError(f"{label} amount must be a valid number for employee {employee_name}")
+
+
+def build_batch_entries(data: dict) -> tuple:
+    """
+    Turn the employees of a batch payment request into personal account entries
+
+    Args:
+        data (dict): The batch payment request (date and employees)
+
+    Returns:
+        tuple: (entries, errors) with one entry per valid employee in request order,
+            and one message per invalid employee
+    """
+    entries = []
+    errors = []
+
+    for employee in data.get("employees", []):
+        employee_name = employee.get("name")
+        try:
+            if not all([employee.get("institution"), employee_name, employee.get("accNo")]) or (
+                employee.get("capitalAmount") is None and employee.get("interestAmount") is None
+            ):
+                raise ValueError(f"Missing required fields for employee {employee_name}")
+
+            entries.append({
+                "employee_name": employee_name,
+                "employee_accountNo": employee.get("accNo"),
+                "institution_name": employee.get("institution"),
+                "date": data.get("date"),
+                "capital": _amount(employee.get("capitalAmount"), "Capital", employee_name),
+                "interest": _amount(employee.get("interestAmount"), "Interest", employee_name),
+                "description": employee.get("description"),
+                "bill_no": employee.get("billNo") if employee.get("billNo") else "BS",
+                # If chequeNo is empty/None, use empty string
+                "cheque_no": employee.get("chequeNo", "")
+            })
+        except ValueError as ve:
+            errors.append(str(ve))
+
+    return entries, errors
+
+
+def plan_batch_payment(data: dict) -> dict:
+    """
+    Plan a batch payment before anything is written. Every employee is resolved
+    against the master data (registered name, personal account file and main
+    ledger rows), then the personal account sheet and target row are found and the capital limits checked
+    (in parallel over the personal account files, counting earlier payments of
+    the batch), and every main ledger row is located. Nothing is written.
+
+    The entries come back with their plan and ledger_rows attached, for
+    run_personal_account_phase and update_main_ledger_batch to apply without
+    searching again.
+
+    Args:
+        data (dict): The batch payment request (date, employees, ledger_debit_column, ledger_interest_column)
+
+    Returns:
+        dict: entries (planned entries in request order) and errors (every problem
+            found, the batch must not be written unless it is empty)
+    """
+    entries, errors = build_batch_entries(data)
+
+    if not data.get("ledger_debit_column"):
+        errors.append("Ledger debit column not provided")
+    if not data.get("ledger_interest_column"):
+        errors.append("Ledger interest column not provided")
+
+    if not entries:
+        return {"entries": entries, "errors": errors}
+
+    master_data_errors = resolve_batch_entries(entries)
+    errors.extend(error for error in master_data_errors if error)
+    # Unregistered employees are not planned any further, the batch is refused anyway
+    entries = [entry for entry, error in zip(entries, master_data_errors) if error is None]
+
+    if not entries:
+        return {"entries": entries, "errors": errors}
+
+    personal_account_plans = plan_personal_account_phase(entries)
+    ledger_locations = locate_main_ledger_rows(entries)
+
+    for entry, plan, location in zip(entries, personal_account_plans, ledger_locations):
+        employee_name = entry["employee_name"]
+
+        if plan["success"]:
+            entry["plan"] = plan["plan"]
+        else:
+            errors.append(f"{employee_name}: {plan['error']}")
+
+        if location["success"]:
+            entry["ledger_rows"] = location["ledger_rows"]
+        else:
+            errors.append(f"{employee_name}: Main ledger: {location['error']}")
+
+    logger.info(f"Planned batch payment of {len(entries)} employees with {len(errors)} errors")
+    return {"entries": entries, "errors": errors}
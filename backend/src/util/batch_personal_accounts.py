@@ -0,0 +1,234 @@
+import os
+import threading
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dotenv import load_dotenv
+from util.personal_accounts import update_personal_accounts_batch, plan_personal_account_entries
+from util.finding_files_sheets import find_entry_personal_account_file
+from util.file_stamps import get_file_stamp
+
+load_dotenv()
+
+# Number of worker processes for the personal account phase of batch payments, 1 runs it in-process
+BATCH_WORKER_POOL_SIZE = int(os.getenv('BATCH_WORKER_POOL_SIZE', '1'))
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_size = None
+_pool_lock = threading.Lock()
+
+
+def _outcome(entry: dict, personal_account_result: dict) -> dict:
+    """
+    Turn the personal account result of one batch entry into its outcome with log lines
+    """
+    employee_name = entry["employee_name"]
+    institution_name = entry["institution_name"]
+    logs = []
+
+    if personal_account_result.get("validation_failed"):
+        # The employee was skipped, nothing was written
+        logs.append(f"✗ SKIPPED {employee_name}: {personal_account_result['error']}")
+        return {"validation_failed": True, "result": None, "logs": logs}
+
+    if personal_account_result["success"]:
+        logger.info("Personal account update successful for %s: %s",
+                   employee_name, personal_account_result["message"])
+        logs.append(f"✓ Personal account updated successfully for {employee_name}")
+    else:
+        logger.error("Failed to update personal account for %s in %s: %s",
+                   employee_name, institution_name, personal_account_result["error"])
+        logs.append(f"✗ Failed to update personal account for {employee_name} in {institution_name}: {personal_account_result['error']}")
+
+    return {"validation_failed": False, "result": personal_account_result, "logs": logs}
+
+
+def process_personal_account_group(entries: list) -> list:
+    """
+    Validate the capital limits and update the personal accounts of batch employees.
+    Each personal account file is opened and saved once for all of its entries,
+    which are validated and appended in order.
+
+    Args:
+        entries (list): Entry dicts with employee_name, employee_accountNo, institution_name,
+            date, capital, interest, description, bill_no and cheque_no
+
+    Returns:
+        list: Per entry, the validation_failed flag, the personal account result (None when skipped) and the log lines
+    """
+    results = update_personal_accounts_batch(entries, check_capital_limit=True)
+    return [_outcome(entry, result) for entry, result in zip(entries, results)]
+
+
+def group_entries_by_file(entries: list) -> list:
+    """
+    Group entry positions by resolved personal account file, so that no two
+    workers ever write the same file. Entries whose file cannot be resolved get
+    a group of their own and report the error when processed.
+
+    Returns:
+        list: Lists of entry positions, each in original order
+    """
+    groups = {}
+
+    for position, entry in enumerate(entries):
+        try:
+            file_path = find_entry_personal_account_file(entry)
+            key = os.path.normcase(os.path.abspath(file_path))
+        except FileNotFoundError:
+            key = ("unresolved", position)
+        groups.setdefault(key, []).append(position)
+
+    return list(groups.values())
+
+
+def _get_pool(pool_size: int) -> ProcessPoolExecutor:
+    """
+    Get the shared worker pool, created on first use. Workers are spawned
+    (not forked) so they start from a clean interpreter on every platform.
+    """
+    global _pool, _pool_size
+
+    with _pool_lock:
+        if _pool is None or _pool_size != pool_size:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(max_workers=pool_size, mp_context=multiprocessing.get_context("spawn"))
+            _pool_size = pool_size
+            logger.info(f"Started personal account worker pool with {pool_size} processes")
+        return _pool
+
+
+def _discard_pool():
+    global _pool
+
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+            _pool = None
+
+
+def _group_file_stamp(group_entries: list):
+    """
+    Get the stamp of the personal account file of a group, None when it cannot be read
+    """
+    try:
+        return get_file_stamp(find_entry_personal_account_file(group_entries[0]))
+    except Exception:
+        return None
+
+
+def _recover_group(group_function, group_entries: list, stamp_before, failure_result) -> list:
+    """
+    Handle a group whose worker process died. When its file is unchanged the
+    worker wrote nothing, so the group is run again in this process; otherwise
+    it may or may not have been written and every entry is reported as failed.
+    """
+    stamp_after = _group_file_stamp(group_entries)
+
+    if stamp_before is not None and stamp_after == stamp_before:
+        logger.warning(f"Worker process died, running a group of {len(group_entries)} entries in-process")
+        return group_function(group_entries)
+
+    error_message = "The worker process updating this personal account file died, check the file before paying again"
+    logger.error(f"{error_message}: {[entry['employee_name'] for entry in group_entries]}")
+    return [failure_result(entry, error_message) for entry in group_entries]
+
+
+def run_file_groups(group_function, entries: list, pool_size: int = None, failure_result=None) -> list:
+    """
+    Run group_function over the batch entries, one call per personal account
+    file, spreading independent files over a process pool. Groups lost to a
+    dead worker process are recovered one by one (see _recover_group), the
+    other groups keep their results.
+
+    Args:
+        group_function: Top-level function taking a list of entries of the same
+            file and returning one result per entry
+        entries (list): Entry dicts as taken by process_personal_account_group
+        pool_size (int, optional): Number of worker processes. Defaults to BATCH_WORKER_POOL_SIZE.
+        failure_result (optional): Called with an entry and an error message to build the
+            result of an entry whose group could not be recovered. Defaults to
+            {"success": False, "error": message}.
+
+    Returns:
+        list: One result per entry, in the original order
+    """
+    pool_size = BATCH_WORKER_POOL_SIZE if pool_size is None else pool_size
+    failure_result = failure_result or (lambda entry, error_message: {"success": False, "error": error_message})
+
+    if pool_size <= 1 or len(entries) <= 1:
+        return group_function(entries)
+
+    groups = group_entries_by_file(entries)
+    logger.info(f"Processing {len(entries)} personal accounts in {len(groups)} file groups with {pool_size} workers")
+
+    results = [None] * len(entries)
+    submitted = []
+    broken = False
+
+    try:
+        pool = _get_pool(pool_size)
+        for group in groups:
+            group_entries = [entries[position] for position in group]
+            submitted.append((group, group_entries, _group_file_stamp(group_entries), pool.submit(group_function, group_entries)))
+    except BrokenProcessPool:
+        broken = True
+
+    submitted_positions = {position for group, _, _, _ in submitted for position in group}
+    for group in groups:
+        if group[0] not in submitted_positions:
+            # Never reached a worker, nothing was written
+            group_entries = [entries[position] for position in group]
+            submitted.append((group, group_entries, None, None))
+
+    for group, group_entries, stamp_before, future in submitted:
+        if future is None:
+            group_results = group_function(group_entries)
+        else:
+            try:
+                group_results = future.result()
+            except BrokenProcessPool:
+                broken = True
+                group_results = _recover_group(group_function, group_entries, stamp_before, failure_result)
+
+        for position, result in zip(group, group_results):
+            results[position] = result
+
+    if broken:
+        # Start a fresh pool next time
+        _discard_pool()
+
+    return results
+
+
+def run_personal_account_phase(entries: list, pool_size: int = None) -> list:
+    """
+    Run the validation and personal account update of every batch entry,
+    spreading independent personal account files over a process pool.
+
+    Args:
+        entries (list): Entry dicts as taken by process_personal_account_group
+        pool_size (int, optional): Number of worker processes. Defaults to BATCH_WORKER_POOL_SIZE.
+
+    Returns:
+        list: One outcome per entry (see process_personal_account_group), in the original order
+    """
+    return run_file_groups(
+        process_personal_account_group, entries, pool_size,
+        failure_result=lambda entry, error_message: _outcome(entry, {"success": False, "error": error_message})
+    )
+
+
+def plan_personal_account_phase(entries: list, pool_size: int = None) -> list:
+    """
+    Plan the personal account update of every batch entry without writing
+    (see plan_personal_account_entries), spread over the process pool like the updates.
+
+    Returns:
+        list: One plan result per entry, in the original order
+    """
+    return run_file_groups(plan_personal_account_entries, entries, pool_size)
@@ -0,0 +1,134 @@
+import threading
+import logging
+from util.file_stamps import get_file_stamp
+from util.sheet_scanner import iter_row_values, find_empty_run
+
+logger = logging.getLogger(__name__)
+
+# A cashbook row is free when columns B to J are empty
+FIRST_CHECKED_COLUMN = 2
+LAST_CHECKED_COLUMN = 10
+FREE_BLOCK_ROWS = 3
+
+# How far past ws.max_row the search may look for a free block
+SEARCH_MARGIN_ROWS = 100
+
+_cursors = {}
+_cursor_lock = threading.Lock()
+
+
+def _is_empty_row(values) -> bool:
+    return all(value in (None, "") for value in values)
+
+
+def is_cashbook_row_empty(ws, row: int) -> bool:
+    """
+    Check whether columns B to J of a cashbook row are empty
+    """
+    _, values = next(iter_row_values(ws, FIRST_CHECKED_COLUMN, LAST_CHECKED_COLUMN, row, row))
+    return _is_empty_row(values)
+
+
+def find_free_block(ws, start_row: int, block_rows: int = FREE_BLOCK_ROWS):
+    """
+    Find the first run of block_rows consecutive empty rows at or after start_row.
+    Columns B to J are streamed once, rows past the end of the sheet count as empty.
+    
+    Args:
+        ws: The openpyxl worksheet
+        start_row (int): First row that may belong to the block
+        block_rows (int, optional): Number of consecutive empty rows required
+        
+    Returns:
+        int: The first row of the block, or None if there is none within the search margin
+    """
+    last_row = max(ws.max_row, start_row) + SEARCH_MARGIN_ROWS + block_rows - 2
+    rows = iter_row_values(ws, FIRST_CHECKED_COLUMN, LAST_CHECKED_COLUMN, start_row, last_row)
+    
+    return find_empty_run(((row, _is_empty_row(values)) for row, values in rows), block_rows)
+
+
+def _get_hint(file_path: str, first_entry_row: int):
+    """
+    Get the remembered free-block row for this file if it is still valid for a search starting at first_entry_row
+    """
+    with _cursor_lock:
+        cursor = _cursors.get(file_path)
+    
+    if cursor is None:
+        return None
+    
+    try:
+        if get_file_stamp(file_path) != cursor["stamp"]:
+            return None
+    except OSError:
+        return None
+    
+    # The hint only says there is no free block between scanned_from and row
+    if cursor["scanned_from"] <= first_entry_row < cursor["row"]:
+        return cursor["row"]
+    return None
+
+
+def find_insert_row(ws, file_path: str, first_entry_row: int) -> int:
+    """
+    Find the cashbook row to write the next entry into.
+    
+    first_entry_row is used when it is empty. Otherwise the first block of 3
+    consecutive empty rows is found and its second row returned. The search
+    resumes from the cursor remembered for file_path after the last commit,
+    so in steady state only the rows written since then are checked.
+    
+    Args:
+        ws: The cashbook worksheet (Sheet1)
+        file_path (str): Path of the cashbook file, or None to always scan from first_entry_row
+        first_entry_row (int): The first entry row requested by the client
+        
+    Returns:
+        int: The row to write into
+        
+    Raises:
+        ValueError: If no block of empty rows could be found
+    """
+    if is_cashbook_row_empty(ws, first_entry_row):
+        return first_entry_row
+    
+    start_row = first_entry_row
+    if file_path:
+        hint = _get_hint(file_path, first_entry_row)
+        if hint is not None:
+            logger.info(f"Resuming free row search at cached cursor row {hint}")
+            start_row = hint
+    
+    logger.info(f"First entry row {first_entry_row} is not empty, searching for three consecutive empty rows from row {start_row}...")
+    block_row = find_free_block(ws, start_row)
+    
+    if block_row is None:
+        raise ValueError("Could not find 3 consecutive empty rows for data entry")
+    
+    # Use the second empty row of the block
+    return block_row + 1
+
+
+def record_commit(file_path: str, first_entry_row: int, next_free_row: int):
+    """
+    Remember where the next free block can start, after a commit that wrote
+    every row before next_free_row. Must be called after the file was saved
+    so the stored stamp matches the committed file.
+    
+    Args:
+        file_path (str): Path of the cashbook file
+        first_entry_row (int): The first entry row the search started from
+        next_free_row (int): The row after the last row written
+    """
+    try:
+        stamp = get_file_stamp(file_path)
+    except OSError:
+        return
+    
+    with _cursor_lock:
+        _cursors[file_path] = {
+            "scanned_from": first_entry_row,
+            "row": next_free_row,
+            "stamp": stamp
+        }
@@ -0,0 +1,244 @@
+import os
+import json
+import atexit
+import hashlib
+import threading
+import logging
+from dotenv import load_dotenv
+from util.file_stamps import get_file_stamp
+from util.file_locks import file_lock
+from util.atomic_excel_operations import replace_file_atomically
+
+load_dotenv()
+
+PERSONAL_ACCOUNT_ROOTPATH = os.getenv('PERSONAL_ACCOUNT_ROOTPATH')
+# One index file per personal account folder is kept in this directory
+SHEET_INDEX_DIR = os.getenv('PERSONAL_ACCOUNT_SHEET_INDEX_DIRPATH') or (
+    os.path.join(PERSONAL_ACCOUNT_ROOTPATH, ".sheet_index") if PERSONAL_ACCOUNT_ROOTPATH else None
+)
+# Changes are kept in memory and saved at most this often, and when the process exits
+SHEET_INDEX_FLUSH_SECONDS = float(os.getenv('PERSONAL_ACCOUNT_SHEET_INDEX_FLUSH_SECONDS', '30'))
+
+logger = logging.getLogger(__name__)
+
+
+class _FolderSheetIndex:
+    """
+    Sheet titles of the workbooks of one folder, with the changes not saved yet
+    """
+
+    def __init__(self, workbooks: dict):
+        self.workbooks = workbooks  # normalized file name -> {"stamp": {...}, "sheets": {account: sheet title}}
+        self.changes = {}  # normalized file name -> entry, or None when removed
+
+
+_folders = {}  # normalized folder path -> _FolderSheetIndex
+_sheet_index_lock = threading.Lock()
+_flush_timer = None
+
+
+def parse_account_from_j2(j2_value):
+    """
+    Extract the account number from a J2 tag: the part between the 2nd and 3rd '/'
+    
+    Returns:
+        str: The account number, or None if J2 is not a tag
+    """
+    if j2_value and isinstance(j2_value, str):
+        parts = j2_value.split('/')
+        if len(parts) >= 3:
+            return parts[2]
+    return None
+
+
+def _workbook_key(file_path: str) -> str:
+    return os.path.normcase(os.path.abspath(file_path))
+
+
+def _split_path(file_path: str) -> tuple:
+    folder, name = os.path.split(_workbook_key(file_path))
+    return folder, name
+
+
+def _index_file(folder_key: str) -> str:
+    return os.path.join(SHEET_INDEX_DIR, hashlib.sha1(folder_key.encode("utf-8")).hexdigest()[:16] + ".json")
+
+
+def _read_index_file(index_file: str) -> dict:
+    """
+    Read the saved workbooks of a folder, empty when there is no index file or it cannot be read
+    """
+    if not os.path.exists(index_file):
+        return {}
+    
+    try:
+        with open(index_file, "r", encoding="utf-8") as file:
+            return json.load(file)["workbooks"]
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable sheet index {index_file}: {str(e)}")
+        return {}
+
+
+def _get_folder(folder_key: str) -> _FolderSheetIndex:
+    """
+    Get the index of a folder, read from its index file on first use (outside the lock)
+    """
+    with _sheet_index_lock:
+        folder = _folders.get(folder_key)
+    if folder is not None:
+        return folder
+    
+    workbooks = _read_index_file(_index_file(folder_key)) if SHEET_INDEX_DIR else {}
+    with _sheet_index_lock:
+        return _folders.setdefault(folder_key, _FolderSheetIndex(workbooks))
+
+
+def _set_entry(folder: _FolderSheetIndex, name: str, entry):
+    """
+    Change the entry of a workbook in memory and schedule saving it (called with the lock held)
+    """
+    global _flush_timer
+    
+    if entry is None:
+        folder.workbooks.pop(name, None)
+    else:
+        folder.workbooks[name] = entry
+    folder.changes[name] = entry
+    
+    if SHEET_INDEX_DIR and _flush_timer is None:
+        _flush_timer = threading.Timer(SHEET_INDEX_FLUSH_SECONDS, flush_employee_sheet_index)
+        _flush_timer.daemon = True
+        _flush_timer.start()
+
+
+def _save_folder(folder_key: str, changes: dict) -> dict:
+    """
+    Merge the changes of a folder into its index file, under the file lock of
+    the index file as other processes save it too. Workbooks no longer in the
+    folder are dropped.
+    
+    Returns:
+        dict: The workbooks saved
+    """
+    index_file = _index_file(folder_key)
+    os.makedirs(SHEET_INDEX_DIR, exist_ok=True)
+    
+    with file_lock(index_file):
+        workbooks = _read_index_file(index_file)
+        for name, entry in changes.items():
+            if entry is None:
+                workbooks.pop(name, None)
+            else:
+                workbooks[name] = entry
+        
+        if os.path.isdir(folder_key):
+            present = {os.path.normcase(file) for file in os.listdir(folder_key)}
+            workbooks = {name: entry for name, entry in workbooks.items() if name in present}
+        
+        content = json.dumps({"folder": folder_key, "workbooks": workbooks}).encode("utf-8")
+        replace_file_atomically(index_file, lambda file: file.write(content))
+    
+    return workbooks
+
+
+def flush_employee_sheet_index():
+    """
+    Save the changed folder indexes. Runs SHEET_INDEX_FLUSH_SECONDS after the
+    first unsaved change and when the process exits; the index files are read
+    and written without holding the in-process lock.
+    """
+    global _flush_timer
+    
+    with _sheet_index_lock:
+        _flush_timer = None
+        pending = {folder_key: folder.changes for folder_key, folder in _folders.items() if folder.changes}
+        for folder_key in pending:
+            _folders[folder_key].changes = {}
+    
+    if not SHEET_INDEX_DIR:
+        return
+    
+    for folder_key, changes in pending.items():
+        try:
+            saved = _save_folder(folder_key, changes)
+        except Exception as e:
+            logger.warning(f"Could not save the sheet index of {folder_key}: {str(e)}")
+            with _sheet_index_lock:
+                folder = _folders[folder_key]
+                for name, entry in changes.items():
+                    if name not in folder.changes:
+                        _set_entry(folder, name, entry)
+            continue
+        
+        # Take in what other processes saved, the changes made meanwhile win
+        with _sheet_index_lock:
+            folder = _folders[folder_key]
+            folder.workbooks = {**saved, **{name: entry for name, entry in folder.workbooks.items() if name in folder.changes}}
+
+
+atexit.register(flush_employee_sheet_index)
+
+
+def get_indexed_sheet_title(file_path: str, employee_accountNo: str):
+    """
+    Get the sheet title recorded for an account, if the workbook has not changed since
+    
+    Returns:
+        str: The sheet title, or None when the workbook is not indexed, changed, or has no such account
+    """
+    folder_key, name = _split_path(file_path)
+    folder = _get_folder(folder_key)
+    
+    try:
+        stamp = get_file_stamp(file_path)
+    except OSError:
+        with _sheet_index_lock:
+            if name in folder.workbooks:
+                _set_entry(folder, name, None)
+        return None
+    
+    with _sheet_index_lock:
+        entry = folder.workbooks.get(name)
+        if entry is None or entry["stamp"] != stamp:
+            return None
+        return entry["sheets"].get(employee_accountNo)
+
+
+def record_sheet_titles(file_path: str, sheets: dict, stamp: dict):
+    """
+    Record the account -> sheet title mapping of a workbook, saved with the next flush
+    
+    Args:
+        file_path (str): Path to the workbook
+        sheets (dict): account number -> sheet title
+        stamp (dict): Stamp of the workbook the mapping was read from
+    """
+    folder_key, name = _split_path(file_path)
+    folder = _get_folder(folder_key)
+    
+    with _sheet_index_lock:
+        _set_entry(folder, name, {"stamp": stamp, "sheets": sheets})
+
+
+def refresh_employee_sheet_index(file_path: str, previous_stamp: dict, new_stamp: dict):
+    """
+    Keep a workbook's mapping after the app itself rewrote the workbook. Entries
+    are only appended below the headers, J2 is never written, so the mapping is
+    still valid when it was current before the write. Only the in-memory entry
+    is changed, it is saved with the next flush.
+    
+    Args:
+        file_path (str): Path to the workbook that was written
+        previous_stamp (dict): Stamp of the workbook before the write
+        new_stamp (dict): Stamp of the workbook as saved, read under its lock, or None
+            when it is unknown (the mapping is then left to go stale)
+    """
+    folder_key, name = _split_path(file_path)
+    
+    with _sheet_index_lock:
+        folder = _folders.get(folder_key)
+        entry = folder.workbooks.get(name) if folder is not None else None
+        if entry is None or entry["stamp"] != previous_stamp or new_stamp is None:
+            return
+        
+        _set_entry(folder, name, {"stamp": new_stamp, "sheets": entry["sheets"]})
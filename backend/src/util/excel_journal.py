@@ -0,0 +1,186 @@
+import os
+import json
+import time
+import uuid
+import tempfile
+import logging
+from dotenv import load_dotenv
+from util.file_locks import file_lock
+
+load_dotenv()
+
+CASHBOOK_FILEPATH = os.getenv('CASHBOOK_FILEPATH')
+JOURNAL_FILE = os.getenv('EXCEL_JOURNAL_FILEPATH') or (
+    os.path.join(os.path.dirname(os.path.abspath(CASHBOOK_FILEPATH)), ".excel_journal.jsonl") if CASHBOOK_FILEPATH else None
+)
+# The journal is compacted once it grows past this size
+JOURNAL_COMPACT_BYTES = int(os.getenv('EXCEL_JOURNAL_COMPACT_BYTES', str(1024 * 1024)))
+
+# Record states. An operation is finished once it has a committed or rolled_back record.
+PREPARED = "prepared"
+COMMITTED = "committed"
+ROLLED_BACK = "rolled_back"
+
+logger = logging.getLogger(__name__)
+
+
+def fsync_directory(dir_path: str):
+    """
+    Flush a directory entry change (create, rename, replace) to disk.
+    Directories cannot be opened for fsync on Windows, where this is a no-op.
+    """
+    if os.name == 'nt':
+        return
+
+    dir_fd = os.open(dir_path or ".", os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def _read_records() -> list:
+    records = []
+    try:
+        with open(JOURNAL_FILE, "r", encoding="utf-8") as journal:
+            for line in journal:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # A torn last line from a crash during an append
+                    logger.warning(f"Skipping unreadable journal record in {JOURNAL_FILE}")
+    except FileNotFoundError:
+        pass
+    return records
+
+
+def _unfinished(records: list) -> dict:
+    """
+    Get the prepared records of operations that have not finished, by operation id
+    """
+    pending = {}
+    for record in records:
+        if record["state"] == PREPARED:
+            pending[record["id"]] = record
+        else:
+            pending.pop(record["id"], None)
+    return pending
+
+
+def _compact():
+    """
+    Rewrite the journal with only the records of unfinished operations.
+    The caller must hold the journal lock.
+    """
+    pending = _unfinished(_read_records())
+    journal_dir = os.path.dirname(os.path.abspath(JOURNAL_FILE))
+
+    temp_fd, temp_path = tempfile.mkstemp(prefix=".excel_journal_", dir=journal_dir)
+    try:
+        with os.fdopen(temp_fd, "w", encoding="utf-8") as journal:
+            for record in pending.values():
+                journal.write(json.dumps(record) + "\n")
+            journal.flush()
+            os.fsync(journal.fileno())
+        os.replace(temp_path, JOURNAL_FILE)
+        fsync_directory(journal_dir)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def _append(record: dict):
+    """
+    Append a record to the journal and flush it to disk before returning
+    """
+    line = (json.dumps(record) + "\n").encode("utf-8")
+
+    with file_lock(JOURNAL_FILE):
+        journal_fd = os.open(JOURNAL_FILE, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o666)
+        try:
+            os.write(journal_fd, line)
+            os.fsync(journal_fd)
+            size = os.fstat(journal_fd).st_size
+        finally:
+            os.close(journal_fd)
+
+        if record["state"] != PREPARED and size > JOURNAL_COMPACT_BYTES:
+            _compact()
+
+
+def record_prepared(file_path: str, temp_file_path: str) -> str:
+    """
+    Record that temp_file_path holds the complete, flushed new content of
+    file_path and is about to replace it.
+
+    Returns:
+        str: The operation id, or None when journaling is not configured
+    """
+    if not JOURNAL_FILE:
+        return None
+
+    op_id = uuid.uuid4().hex
+    _append({
+        "id": op_id,
+        "state": PREPARED,
+        "path": os.path.abspath(file_path),
+        "temp": os.path.abspath(temp_file_path),
+        "pid": os.getpid(),
+        "time": time.time()
+    })
+    return op_id
+
+
+def record_finished(op_id: str, state: str):
+    """
+    Record that a prepared operation was committed (the replace is on disk) or rolled back
+    """
+    if op_id is None:
+        return
+
+    _append({"id": op_id, "state": state, "time": time.time()})
+
+
+def recover_incomplete_operations():
+    """
+    Finish the operations that were prepared but never recorded as finished,
+    e.g. after a crash or power loss. Each is resolved under the lock of its file:
+
+    - the temp file is gone: the replace already happened, it is recorded as committed
+    - the temp file is still there: the replace never happened, the temp file is removed
+      and the operation recorded as rolled back (the original is untouched)
+
+    Returns:
+        int: Number of operations recovered
+    """
+    if not JOURNAL_FILE or not os.path.exists(JOURNAL_FILE):
+        return 0
+
+    recovered = 0
+
+    for op_id, record in _unfinished(_read_records()).items():
+        # Waits for the operation if it is still running in another process
+        with file_lock(record["path"]):
+            if op_id not in _unfinished(_read_records()):
+                continue
+
+            if os.path.exists(record["temp"]):
+                os.remove(record["temp"])
+                fsync_directory(os.path.dirname(record["temp"]))
+                record_finished(op_id, ROLLED_BACK)
+                logger.warning(f"Rolled back incomplete write of {record['path']}")
+            else:
+                record_finished(op_id, COMMITTED)
+                logger.warning(f"Completed interrupted write of {record['path']}")
+            recovered += 1
+
+    with file_lock(JOURNAL_FILE):
+        _compact()
+
+    if recovered:
+        logger.info(f"Recovered {recovered} incomplete Excel operations from {JOURNAL_FILE}")
+    return recovered
@@ -0,0 +1,137 @@
+import os
+import time
+import threading
+import logging
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+if os.name == 'nt':  # Windows
+    import msvcrt
+else:  # Unix/Linux/Mac
+    import fcntl
+
+load_dotenv()
+
+# How long to wait for another thread or process to release a workbook
+EXCEL_LOCK_TIMEOUT_SECONDS = float(os.getenv('EXCEL_LOCK_TIMEOUT_SECONDS', '120'))
+LOCK_POLL_INTERVAL_SECONDS = 0.05
+LOCK_FILE_SUFFIX = ".lock"
+
+logger = logging.getLogger(__name__)
+
+
+class _PathLock:
+    """
+    Lock state of one file: a re-entrant lock for the threads of this process
+    and, while held, an OS advisory lock on <file>.lock for other processes
+    """
+
+    def __init__(self, lock_file_path: str):
+        self.lock_file_path = lock_file_path
+        self.thread_lock = threading.RLock()
+        self.depth = 0
+        self.lock_fd = None
+
+
+_path_locks = {}
+_registry_lock = threading.Lock()
+
+
+def _get_path_lock(file_path: str) -> _PathLock:
+    key = os.path.normcase(os.path.abspath(file_path))
+    with _registry_lock:
+        path_lock = _path_locks.get(key)
+        if path_lock is None:
+            path_lock = _PathLock(f"{os.path.abspath(file_path)}{LOCK_FILE_SUFFIX}")
+            _path_locks[key] = path_lock
+        return path_lock
+
+
+def _try_os_lock(lock_fd: int) -> bool:
+    try:
+        if os.name == 'nt':
+            os.lseek(lock_fd, 0, os.SEEK_SET)
+            msvcrt.locking(lock_fd, msvcrt.LK_NBLCK, 1)
+        else:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+def _os_unlock(lock_fd: int):
+    if os.name == 'nt':
+        os.lseek(lock_fd, 0, os.SEEK_SET)
+        msvcrt.locking(lock_fd, msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(lock_fd, fcntl.LOCK_UN)
+
+
+def _acquire_os_lock(path_lock: _PathLock, deadline: float):
+    lock_fd = os.open(path_lock.lock_file_path, os.O_RDWR | os.O_CREAT, 0o666)
+    try:
+        while not _try_os_lock(lock_fd):
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"Timed out waiting for another process to release {path_lock.lock_file_path}")
+            time.sleep(LOCK_POLL_INTERVAL_SECONDS)
+    except Exception:
+        os.close(lock_fd)
+        raise
+    path_lock.lock_fd = lock_fd
+
+
+def _release_os_lock(path_lock: _PathLock):
+    lock_fd, path_lock.lock_fd = path_lock.lock_fd, None
+    try:
+        _os_unlock(lock_fd)
+    except OSError as e:
+        logger.warning(f"Error releasing lock {path_lock.lock_file_path}: {str(e)}")
+    finally:
+        os.close(lock_fd)
+
+
+@contextmanager
+def file_lock(file_path: str, timeout: float = None):
+    """
+    Hold the exclusive lock of a file against other threads of this process
+    and against other processes using the same lock (an OS advisory lock on
+    <file_path>.lock). Re-entrant within a thread.
+
+    Usage:
+        with file_lock(EXCEL_FILE_PATH) as wait_seconds:
+            ...  # read, modify and replace the file
+
+    Args:
+        file_path (str): Path of the file to lock
+        timeout (float, optional): Seconds to wait. Defaults to EXCEL_LOCK_TIMEOUT_SECONDS.
+
+    Yields:
+        float: Seconds spent waiting for the lock
+
+    Raises:
+        TimeoutError: If the lock could not be acquired in time
+    """
+    timeout = EXCEL_LOCK_TIMEOUT_SECONDS if timeout is None else timeout
+    path_lock = _get_path_lock(file_path)
+    started = time.monotonic()
+    deadline = started + timeout
+
+    if not path_lock.thread_lock.acquire(timeout=timeout):
+        raise TimeoutError(f"Timed out waiting for another request to release {file_path}")
+
+    try:
+        if path_lock.depth == 0:
+            _acquire_os_lock(path_lock, deadline)
+        path_lock.depth += 1
+    except Exception:
+        path_lock.thread_lock.release()
+        raise
+
+    wait_seconds = time.monotonic() - started
+    try:
+        yield wait_seconds
+    finally:
+        path_lock.depth -= 1
+        if path_lock.depth == 0:
+            _release_os_lock(path_lock)
+        path_lock.thread_lock.release()
@@ -0,0 +1,23 @@
+import os
+
+
+def get_file_stamp(file_path: str) -> dict:
+    """
+    Get a cheap identity stamp for a file, used to tell whether a cached
+    view of the file is still current.
+    
+    Args:
+        file_path (str): Path to the file
+        
+    Returns:
+        dict: mtime_ns, size and inode of the file
+        
+    Raises:
+        FileNotFoundError: If the file does not exist
+    """
+    stat_result = os.stat(file_path)
+    return {
+        "mtime_ns": stat_result.st_mtime_ns,
+        "size": stat_result.st_size,
+        "inode": stat_result.st_ino
+    }
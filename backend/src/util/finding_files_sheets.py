@@ -1,10 +1,15 @@
 import os
+import threading
+from bisect import bisect_left
 from openpyxl import load_workbook
 import xlrd
 import xlwt
 from xlutils.copy import copy
 import logging
 from dotenv import load_dotenv
+from util.file_stamps import get_file_stamp
+from util.employee_sheet_index import get_indexed_sheet_title, record_sheet_titles, parse_account_from_j2
+from util.sheet_scanner import iter_row_values, find_empty_run
 from util.atomic_excel_operations import atomic_excel_operation  # Import our atomic operations
 
 
@@ -20,6 +25,111 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+class PersonalAccountDirectoryIndex:
+    """
+    In-process listing of one institution folder, sorted so that every file
+    starting with an employee name can be found by bisection. Results are
+    memoized per employee name. The index is tied to the directory's mtime,
+    which changes whenever a file is added, removed or renamed in it.
+    """
+    
+    def __init__(self, directory_path: str, mtime_ns: int):
+        self.directory_path = directory_path
+        self.mtime_ns = mtime_ns
+        self.file_names = sorted(
+            file for file in os.listdir(directory_path)
+            if file.endswith('.xlsx') or file.endswith('.xls')
+        )
+        self._matches = {}
+    
+    def find(self, employee_name: str) -> list:
+        """
+        Get the paths of all files starting with employee_name, .xlsx files first
+        """
+        matches = self._matches.get(employee_name)
+        
+        if matches is None:
+            matches = []
+            position = bisect_left(self.file_names, employee_name)
+            while position < len(self.file_names) and self.file_names[position].startswith(employee_name):
+                matches.append(os.path.join(self.directory_path, self.file_names[position]))
+                logger.info(f"Found matching file: {self.file_names[position]}")
+                position += 1
+            
+            # Prioritize .xlsx over .xls
+            matches.sort(key=lambda x: (not x.endswith('.xlsx'), x))
+            self._matches[employee_name] = matches
+        
+        return list(matches)
+
+
+_directory_indexes = {}
+_directory_index_lock = threading.Lock()
+
+
+def _get_directory_index(directory_path: str) -> PersonalAccountDirectoryIndex:
+    """
+    Get the index of a personal account directory, relisting it only when its
+    mtime changed. The listing is done without holding the index lock, so
+    lookups in other folders do not wait for it.
+    """
+    try:
+        mtime_ns = os.stat(directory_path).st_mtime_ns
+    except FileNotFoundError:
+        raise FileNotFoundError(f"Directory not found: {directory_path}")
+    
+    with _directory_index_lock:
+        index = _directory_indexes.get(directory_path)
+    
+    if index is not None and index.mtime_ns == mtime_ns:
+        return index
+    
+    index = PersonalAccountDirectoryIndex(directory_path, mtime_ns)
+    logger.info(f"Indexed {len(index.file_names)} files in {directory_path}")
+    
+    with _directory_index_lock:
+        _directory_indexes[directory_path] = index
+    
+    return index
+
+
+def get_directory_mtime_ns(file_path: str):
+    """
+    Get the mtime of the folder of file_path, or None if it cannot be read
+    """
+    try:
+        return os.stat(os.path.dirname(file_path)).st_mtime_ns
+    except OSError:
+        return None
+
+
+def refresh_personal_account_directory_index(file_path: str, mtime_before: int, mtime_after: int):
+    """
+    Keep the index of the folder of file_path after the app replaced that
+    file. The atomic replace renames a temporary file in the folder, which
+    changes its mtime but not the files in it. The index is moved to the new
+    mtime only when it was current just before the replace; otherwise the
+    folder changed meanwhile and the index is dropped, the next lookup lists
+    the folder again.
+    
+    Args:
+        file_path (str): Path of the personal account file that was written
+        mtime_before (int): Folder mtime read under the file lock before the replace
+        mtime_after (int): Folder mtime read under the file lock after the replace
+    """
+    directory_path = os.path.dirname(file_path)
+    
+    with _directory_index_lock:
+        index = _directory_indexes.get(directory_path)
+        if index is None:
+            return
+        
+        if mtime_before is not None and mtime_after is not None and index.mtime_ns == mtime_before:
+            index.mtime_ns = mtime_after
+        else:
+            _directory_indexes.pop(directory_path, None)
+
+
 def find_personal_account_file(employee_name: str, employee_accountNo: str, institution_name: str) -> str:
     """
     Find the personal account file for an employee using a single flexible search logic.
@@ -42,26 +152,14 @@ def find_personal_account_file(employee_name: str, employee_accountNo: str, inst
     """
     directory_path = f"{PERSONAL_ACCOUNT_ROOTPATH}/{institution_name}"
     
-    # Check if directory exists
-    if not os.path.exists(directory_path):
-        raise FileNotFoundError(f"Directory not found: {directory_path}")
-    
-    # Search for files that match employee_name.xlsx or employee_name.xls
-    matching_files = []
-    
-    for file in os.listdir(directory_path):
-        if (file.startswith(employee_name) and 
-            (file.endswith('.xlsx') or file.endswith('.xls'))):
-            matching_files.append(os.path.join(directory_path, file))
-            logger.info(f"Found matching file: {file}")
+    # Look up files that match employee_name.xlsx or employee_name.xls in the directory index
+    matching_files = _get_directory_index(directory_path).find(employee_name)
     
     if not matching_files:
         raise FileNotFoundError(f"Personal account file not found or file closed for {employee_name} in {institution_name} with account number {employee_accountNo}.")
     
-    # If multiple matches found, prioritize .xlsx over .xls, then use first match
+    # If multiple matches found, .xlsx files come first (see PersonalAccountDirectoryIndex.find)
     if len(matching_files) > 1:
-        # Sort to prioritize .xlsx files
-        matching_files.sort(key=lambda x: (not x.endswith('.xlsx'), x))
         logger.warning(f"Multiple files found for {employee_name}-{employee_accountNo}: {[os.path.basename(f) for f in matching_files]}")
         logger.warning(f"Using the first match (prioritizing .xlsx): {os.path.basename(matching_files[0])}")
     
@@ -70,15 +168,35 @@ def find_personal_account_file(employee_name: str, employee_accountNo: str, inst
 
 
 
+def find_entry_personal_account_file(entry: dict) -> str:
+    """
+    Get the personal account file of a payment entry: the personal_account_file
+    resolved from the master data when the entry has one, otherwise found
+    with find_personal_account_file.
 
-def find_employee_sheet(workbook, employee_accountNo: str):
+    Raises:
+        FileNotFoundError: If no matching file is found
+    """
+    if entry.get("personal_account_file"):
+        return entry["personal_account_file"]
+    return find_personal_account_file(entry["employee_name"], entry["employee_accountNo"], entry["institution_name"])
+
+
+
+
+def find_employee_sheet(workbook, employee_accountNo: str, file_path: str = None):
     """
     Find the correct sheet for an employee by matching account number in cell J2.
     Searches from last sheet to first sheet.
     
+    When file_path is given, the sheet recorded for the account in the sheet
+    index is fetched directly; otherwise every sheet's J2 is read once and the
+    account -> sheet mapping of the workbook is recorded for next time.
+    
     Args:
         workbook: The openpyxl workbook object
         employee_accountNo (str): Account number to match
+        file_path (str, optional): Path the workbook was loaded from. Defaults to None.
         
     Returns:
         worksheet: The matching worksheet object
@@ -86,27 +204,45 @@ def find_employee_sheet(workbook, employee_accountNo: str):
     Raises:
         ValueError: If no matching sheet is found
     """
-    # Get all worksheets and reverse the order (last to first)
-    worksheets = workbook.worksheets
+    if file_path:
+        title = get_indexed_sheet_title(file_path, employee_accountNo)
+        if title is not None and title in workbook.sheetnames:
+            ws = workbook[title]
+            if parse_account_from_j2(ws.cell(row=2, column=10).value) == employee_accountNo:
+                logger.info(f"Found matching sheet from sheet index: {ws.title} with account number {employee_accountNo}")
+                return ws
+    
+    stamp = _get_stamp_or_none(file_path)
+    sheets = {}
+    matching_ws = None
     
-    for ws in reversed(worksheets):
+    # Get all worksheets and reverse the order (last to first)
+    for ws in reversed(workbook.worksheets):
         try:
-            # Get value from cell J2
-            j2_value = ws.cell(row=2, column=10).value  # Column J is 10
-            
-            if j2_value and isinstance(j2_value, str):
-                # Split by '/' and check if we have at least 3 parts
-                parts = j2_value.split('/')
-                if len(parts) >= 3:
-                    # Extract the string between 2nd and 3rd slash (index 2)
-                    account_part = parts[2]
-                    if account_part == employee_accountNo:
-                        logger.info(f"Found matching sheet: {ws.title} with account number {employee_accountNo}")
-                        return ws
+            # Get the account number from cell J2 (Column J is 10)
+            account_part = parse_account_from_j2(ws.cell(row=2, column=10).value)
         except Exception as e:
             # Log warning but continue searching other sheets
             logger.warning(f"Error reading cell J2 from sheet {ws.title}: {e}")
             continue
+        
+        if account_part is None:
+            continue
+        
+        # The last sheet carrying an account number wins, as in the search order
+        sheets.setdefault(account_part, ws.title)
+        
+        if matching_ws is None and account_part == employee_accountNo:
+            logger.info(f"Found matching sheet: {ws.title} with account number {employee_accountNo}")
+            matching_ws = ws
+            if stamp is None:
+                break
+    
+    if stamp is not None:
+        record_sheet_titles(file_path, sheets, stamp)
+    
+    if matching_ws is not None:
+        return matching_ws
     
     # If no matching sheet found
     raise ValueError(f"No sheet found with account number {employee_accountNo} in cell J2")
@@ -115,14 +251,25 @@ def find_employee_sheet(workbook, employee_accountNo: str):
 
 
 
-def find_employee_sheet_xls(rb, employee_accountNo: str):
+def _read_j2_xls(sheet):
+    """
+    Read cell J2 of an xlrd sheet (row 1, column 9 in 0-indexed), or None if the sheet is smaller
+    """
+    # Check if sheet has at least 2 rows and 10 columns (J is column 9, 0-indexed)
+    if sheet.nrows >= 2 and sheet.ncols >= 10:
+        return sheet.cell_value(1, 9)
+    return None
+
+
+def find_employee_sheet_xls(rb, employee_accountNo: str, file_path: str = None):
     """
     Find the correct sheet for an employee by matching account number in cell J2 for .xls files.
-    Searches from last sheet to first sheet.
+    Searches from last sheet to first sheet, using the sheet index like find_employee_sheet.
     
     Args:
         rb: The xlrd workbook object
         employee_accountNo (str): Account number to match
+        file_path (str, optional): Path the workbook was opened from. Defaults to None.
         
     Returns:
         tuple: (sheet_index, sheet_object) of the matching sheet
@@ -130,30 +277,80 @@ def find_employee_sheet_xls(rb, employee_accountNo: str):
     Raises:
         ValueError: If no matching sheet is found
     """
+    if file_path:
+        title = get_indexed_sheet_title(file_path, employee_accountNo)
+        sheet_names = rb.sheet_names()
+        if title is not None and title in sheet_names:
+            sheet_index = sheet_names.index(title)
+            sheet = rb.sheet_by_index(sheet_index)
+            if parse_account_from_j2(_read_j2_xls(sheet)) == employee_accountNo:
+                logger.info(f"Found matching sheet from sheet index: {sheet.name} (index {sheet_index}) with account number {employee_accountNo}")
+                return sheet_index, sheet
+    
+    stamp = _get_stamp_or_none(file_path)
+    sheets = {}
+    match = None
+    
     # Get all sheets and search from last to first
     for sheet_index in range(rb.nsheets - 1, -1, -1):
         try:
             sheet = rb.sheet_by_index(sheet_index)
-            
-            # Check if sheet has at least 2 rows and 10 columns (J is column 9, 0-indexed)
-            if sheet.nrows >= 2 and sheet.ncols >= 10:
-                # Get value from cell J2 (row 1, column 9 in 0-indexed)
-                j2_value = sheet.cell_value(1, 9)
-                
-                if j2_value and isinstance(j2_value, str):
-                    # Split by '/' and check if we have at least 3 parts
-                    parts = j2_value.split('/')
-                    if len(parts) >= 3:
-                        # Extract the string between 2nd and 3rd slash (index 2)
-                        account_part = parts[2]
-                        if account_part == employee_accountNo:
-                            logger.info(f"Found matching sheet: {sheet.name} (index {sheet_index}) with account number {employee_accountNo}")
-                            return sheet_index, sheet
+            account_part = parse_account_from_j2(_read_j2_xls(sheet))
         except Exception as e:
             # Log warning but continue searching other sheets
             logger.warning(f"Error reading cell J2 from sheet index {sheet_index}: {e}")
             continue
+        
+        if account_part is None:
+            continue
+        
+        sheets.setdefault(account_part, sheet.name)
+        
+        if match is None and account_part == employee_accountNo:
+            logger.info(f"Found matching sheet: {sheet.name} (index {sheet_index}) with account number {employee_accountNo}")
+            match = (sheet_index, sheet)
+            if stamp is None:
+                break
+    
+    if stamp is not None:
+        record_sheet_titles(file_path, sheets, stamp)
+    
+    if match is not None:
+        return match
     
     # If no matching sheet found
     raise ValueError(f"No sheet found with account number {employee_accountNo} in cell J2")
 
+
+def _get_stamp_or_none(file_path: str):
+    if not file_path:
+        return None
+    try:
+        return get_file_stamp(file_path)
+    except OSError:
+        return None
+
+
+
+
+
+def find_personal_account_entry_row(ws, start_row: int = 1):
+    """
+    Find the row for the next personal account entry: the first of 4 consecutive
+    rows with empty cells in columns A, H and I.
+    
+    Args:
+        ws: The openpyxl worksheet of the employee
+        start_row (int, optional): Row to start searching from. Defaults to 1.
+        
+    Returns:
+        int: The first empty row of the run, or None if no run was found
+    """
+    # Columns A to I of the rows up to 99 past the end of the sheet (+100 to ensure we check enough rows)
+    rows = iter_row_values(ws, 1, 9, start_row, max(ws.max_row, start_row) + 99)
+    
+    # A row is empty when its date (A), interest (H) and capital (I) cells are empty
+    return find_empty_run(
+        ((row, all(values[index] in (None, "") for index in (0, 7, 8))) for row, values in rows),
+        4
+    )
@@ -0,0 +1,435 @@
+import re
+import logging
+from decimal import Decimal, ROUND_HALF_UP
+from functools import lru_cache
+from openpyxl.utils import column_index_from_string
+
+logger = logging.getLogger(__name__)
+
+
+class FormulaError(ValueError):
+    """
+    Raised when a formula evaluates to an Excel error value (#REF!, #VALUE!, #DIV/0!...)
+    or cannot be evaluated at all (UnsupportedFormulaError)
+    """
+
+
+class UnsupportedFormulaError(FormulaError):
+    """
+    Raised when a formula cannot be evaluated in-process (unsupported syntax or
+    function, circular reference), so its result is unknown rather than an error value
+    """
+
+
+_TOKEN_RE = re.compile(r"""
+    \s*(?:
+        (?P<number>(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?)
+      | (?P<string>"(?:[^"]|"")*")
+      | (?P<func>[A-Za-z_][\w.]*)(?=\s*\()
+      | (?P<ref>(?:(?:'(?:[^']|'')+'|[A-Za-z_][\w.]*)!)?\$?[A-Za-z]{1,3}\$?\d+(?::\$?[A-Za-z]{1,3}\$?\d+)?)
+      | (?P<bool>TRUE|FALSE)\b
+      | (?P<error>\#[A-Z0-9/]+[!?]?)
+      | (?P<op><>|<=|>=|[-+*/^&=<>%(),])
+    )""", re.VERBOSE | re.IGNORECASE)
+
+_CELL_RE = re.compile(r"\$?([A-Za-z]{1,3})\$?(\d+)")
+
+_COMPARISON_OPS = ("=", "<>", "<", ">", "<=", ">=")
+
+
+def _tokenize(formula: str) -> list:
+    tokens = []
+    position = 0
+    formula = formula.rstrip()
+
+    while position < len(formula):
+        match = _TOKEN_RE.match(formula, position)
+        if not match or match.end() == position:
+            raise UnsupportedFormulaError(f"Unsupported formula syntax near '{formula[position:]}'")
+        kind = match.lastgroup
+        tokens.append((kind, match.group(kind)))
+        position = match.end()
+
+    return tokens
+
+
+def _parse_reference(text: str) -> tuple:
+    sheet = None
+    if "!" in text:
+        sheet, text = text.rsplit("!", 1)
+        if sheet.startswith("'"):
+            sheet = sheet[1:-1].replace("''", "'")
+
+    corners = []
+    for part in text.split(":"):
+        col_letters, row = _CELL_RE.fullmatch(part).groups()
+        corners.append((int(row), column_index_from_string(col_letters.upper())))
+
+    (first_row, first_col), (last_row, last_col) = corners[0], corners[-1]
+    return (
+        "ref",
+        sheet,
+        min(first_row, last_row),
+        min(first_col, last_col),
+        max(first_row, last_row),
+        max(first_col, last_col),
+        len(corners) > 1
+    )
+
+
+class _Parser:
+    """
+    Recursive descent parser producing a small tuple-based syntax tree.
+    Precedence follows Excel: comparison < & < +- < */ < ^ < unary minus < %
+    """
+
+    def __init__(self, tokens: list):
+        self.tokens = tokens
+        self.position = 0
+
+    def _peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def _next(self):
+        token = self._peek()
+        self.position += 1
+        return token
+
+    def _expect(self, value: str):
+        kind, text = self._next()
+        if kind != "op" or text != value:
+            raise UnsupportedFormulaError(f"Expected '{value}' in formula")
+
+    def parse(self):
+        node = self._comparison()
+        if self.position != len(self.tokens):
+            raise UnsupportedFormulaError(f"Unexpected token '{self._peek()[1]}' in formula")
+        return node
+
+    def _comparison(self):
+        node = self._concat()
+        while self._peek()[0] == "op" and self._peek()[1] in _COMPARISON_OPS:
+            op = self._next()[1]
+            node = ("bin", op, node, self._concat())
+        return node
+
+    def _concat(self):
+        node = self._additive()
+        while self._peek() == ("op", "&"):
+            self._next()
+            node = ("bin", "&", node, self._additive())
+        return node
+
+    def _additive(self):
+        node = self._term()
+        while self._peek()[0] == "op" and self._peek()[1] in ("+", "-"):
+            op = self._next()[1]
+            node = ("bin", op, node, self._term())
+        return node
+
+    def _term(self):
+        node = self._power()
+        while self._peek()[0] == "op" and self._peek()[1] in ("*", "/"):
+            op = self._next()[1]
+            node = ("bin", op, node, self._power())
+        return node
+
+    def _power(self):
+        node = self._unary()
+        while self._peek() == ("op", "^"):
+            self._next()
+            node = ("bin", "^", node, self._unary())
+        return node
+
+    def _unary(self):
+        if self._peek()[0] == "op" and self._peek()[1] in ("+", "-"):
+            op = self._next()[1]
+            operand = self._unary()
+            return ("neg", operand) if op == "-" else ("pos", operand)
+        return self._postfix()
+
+    def _postfix(self):
+        node = self._primary()
+        while self._peek() == ("op", "%"):
+            self._next()
+            node = ("pct", node)
+        return node
+
+    def _primary(self):
+        kind, text = self._next()
+
+        if kind == "number":
+            return ("const", float(text))
+        if kind == "string":
+            return ("const", text[1:-1].replace('""', '"'))
+        if kind == "bool":
+            return ("const", text.upper() == "TRUE")
+        if kind == "error":
+            return ("error", text.upper())
+        if kind == "ref":
+            return _parse_reference(text)
+        if kind == "func":
+            self._expect("(")
+            args = []
+            if self._peek() != ("op", ")"):
+                args.append(self._comparison())
+                while self._peek() == ("op", ","):
+                    self._next()
+                    args.append(self._comparison())
+            self._expect(")")
+            return ("func", text.upper(), args)
+        if kind == "op" and text == "(":
+            node = self._comparison()
+            self._expect(")")
+            return node
+
+        raise UnsupportedFormulaError(f"Unexpected token '{text}' in formula")
+
+
+@lru_cache(maxsize=4096)
+def parse_formula(formula: str):
+    """
+    Parse a formula (with or without the leading '=') into a syntax tree
+    """
+    if formula.startswith("="):
+        formula = formula[1:]
+    return _Parser(_tokenize(formula)).parse()
+
+
+def _to_number(value) -> float:
+    if value is None or value == "":
+        return 0.0
+    if isinstance(value, bool):
+        return 1.0 if value else 0.0
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return float(value.strip())
+        except ValueError:
+            raise FormulaError(f"#VALUE! (text '{value}' used as a number)")
+    raise FormulaError(f"#VALUE! (unsupported value {value!r})")
+
+
+def _to_text(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _compare(op: str, left, right) -> bool:
+    if isinstance(left, str) or isinstance(right, str):
+        left, right = _to_text(left).lower(), _to_text(right).lower()
+    else:
+        left, right = _to_number(left), _to_number(right)
+
+    return {
+        "=": left == right,
+        "<>": left != right,
+        "<": left < right,
+        ">": left > right,
+        "<=": left <= right,
+        ">=": left >= right
+    }[op]
+
+
+def _round_half_up(value: float, digits: int) -> float:
+    quantum = Decimal(1).scaleb(-digits)
+    return float(Decimal(repr(value)).quantize(quantum, rounding=ROUND_HALF_UP))
+
+
+class FormulaEvaluator:
+    """
+    Evaluates the formula subset used in the personal account sheets directly
+    from openpyxl cell formulas: arithmetic, comparisons, cell and range
+    references (also to other sheets of the same workbook) and the functions
+    SUM, MIN, MAX, AVERAGE, ABS, ROUND and IF.
+
+    Results are memoized per cell, so evaluating rows top-down costs one
+    evaluation per formula.
+    """
+
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+        self.workbook = worksheet.parent
+        self._values = {}
+        self._in_progress = set()
+
+    def _sheet(self, title: str):
+        if title is None:
+            return self.worksheet
+        try:
+            return self.workbook[title]
+        except KeyError:
+            raise FormulaError(f"#REF! (sheet '{title}' not found)")
+
+    def cell_value(self, row: int, column: int, sheet_title: str = None):
+        """
+        Get the computed value of a cell. Constants are returned as stored and
+        empty cells as None, a formula never gives None: like Excel, a formula
+        that only refers to an empty cell gives 0.
+        """
+        ws = self._sheet(sheet_title)
+        key = (ws.title, row, column)
+
+        if key in self._values:
+            value = self._values[key]
+            if isinstance(value, FormulaError):
+                raise value
+            return value
+
+        raw = ws.cell(row=row, column=column).value
+        formula = getattr(raw, "text", raw)  # ArrayFormula keeps its formula in .text
+
+        if not (isinstance(formula, str) and formula.startswith("=")):
+            self._values[key] = raw
+            return raw
+
+        if key in self._in_progress:
+            raise UnsupportedFormulaError(f"Circular reference at {ws.title}!{ws.cell(row=row, column=column).coordinate}")
+
+        self._in_progress.add(key)
+        try:
+            value = self._evaluate(parse_formula(formula), ws)
+            if isinstance(value, list):
+                raise FormulaError("#VALUE! (range used where a single value is expected)")
+            if value is None:
+                value = 0.0
+        except FormulaError as e:
+            self._values[key] = e
+            raise
+        except RecursionError:
+            raise UnsupportedFormulaError("Formula dependency chain too deep, evaluate earlier rows first")
+        finally:
+            self._in_progress.discard(key)
+
+        self._values[key] = value
+        return value
+
+    def evaluate_column(self, column: int, last_row: int, first_row: int = 1):
+        """
+        Evaluate a column top-down so that formulas referring to earlier rows
+        hit the memo instead of recursing through the whole chain. Errors are
+        kept in the memo and only raised when the cell is used.
+        """
+        for row in range(first_row, last_row + 1):
+            try:
+                self.cell_value(row, column)
+            except FormulaError:
+                continue
+
+    def _evaluate(self, node, ws):
+        kind = node[0]
+
+        if kind == "const":
+            return node[1]
+
+        if kind == "error":
+            raise FormulaError(node[1])
+
+        if kind == "ref":
+            _, sheet_title, first_row, first_col, last_row, last_col, is_range = node
+            sheet_title = sheet_title if sheet_title is not None else (None if ws is self.worksheet else ws.title)
+            if not is_range:
+                return self.cell_value(first_row, first_col, sheet_title)
+            return [
+                self.cell_value(row, col, sheet_title)
+                for row in range(first_row, last_row + 1)
+                for col in range(first_col, last_col + 1)
+            ]
+
+        if kind == "neg":
+            return -_to_number(self._evaluate(node[1], ws))
+
+        if kind == "pos":
+            return _to_number(self._evaluate(node[1], ws))
+
+        if kind == "pct":
+            return _to_number(self._evaluate(node[1], ws)) / 100.0
+
+        if kind == "bin":
+            _, op, left_node, right_node = node
+            left = self._evaluate(left_node, ws)
+            right = self._evaluate(right_node, ws)
+            if isinstance(left, list) or isinstance(right, list):
+                raise FormulaError("#VALUE! (range used in an operator)")
+
+            if op in _COMPARISON_OPS:
+                return _compare(op, left, right)
+            if op == "&":
+                return _to_text(left) + _to_text(right)
+
+            left, right = _to_number(left), _to_number(right)
+            if op == "+":
+                return left + right
+            if op == "-":
+                return left - right
+            if op == "*":
+                return left * right
+            if op == "/":
+                if right == 0:
+                    raise FormulaError("#DIV/0!")
+                return left / right
+            if op == "^":
+                return left ** right
+
+        if kind == "func":
+            return self._call(node[1], node[2], ws)
+
+        raise UnsupportedFormulaError(f"Unsupported formula element: {kind}")
+
+    def _numbers(self, arg_nodes, ws) -> list:
+        """
+        Collect numeric arguments the way SUM does: text, booleans and blanks inside ranges are ignored
+        """
+        numbers = []
+        for arg_node in arg_nodes:
+            value = self._evaluate(arg_node, ws)
+            if isinstance(value, list):
+                numbers.extend(
+                    float(item) for item in value
+                    if isinstance(item, (int, float)) and not isinstance(item, bool)
+                )
+            elif value is not None:
+                numbers.append(_to_number(value))
+        return numbers
+
+    def _call(self, name: str, arg_nodes: list, ws):
+        if name == "SUM":
+            return sum(self._numbers(arg_nodes, ws))
+
+        if name == "MIN":
+            numbers = self._numbers(arg_nodes, ws)
+            return min(numbers) if numbers else 0.0
+
+        if name == "MAX":
+            numbers = self._numbers(arg_nodes, ws)
+            return max(numbers) if numbers else 0.0
+
+        if name == "AVERAGE":
+            numbers = self._numbers(arg_nodes, ws)
+            if not numbers:
+                raise FormulaError("#DIV/0!")
+            return sum(numbers) / len(numbers)
+
+        if name == "ABS" and len(arg_nodes) == 1:
+            return abs(_to_number(self._evaluate(arg_nodes[0], ws)))
+
+        if name == "ROUND" and len(arg_nodes) == 2:
+            value = _to_number(self._evaluate(arg_nodes[0], ws))
+            digits = int(_to_number(self._evaluate(arg_nodes[1], ws)))
+            return _round_half_up(value, digits)
+
+        if name == "IF" and len(arg_nodes) in (2, 3):
+            condition = self._evaluate(arg_nodes[0], ws)
+            if isinstance(condition, str):
+                raise FormulaError("#VALUE! (text used as a condition)")
+            if _to_number(condition) != 0:
+                return self._evaluate(arg_nodes[1], ws)
+            return self._evaluate(arg_nodes[2], ws) if len(arg_nodes) == 3 else False
+
+        raise UnsupportedFormulaError(f"Unsupported function {name} with {len(arg_nodes)} argument(s)")
@@ -0,0 +1,197 @@
+import os
+import json
+import tempfile
+import threading
+import logging
+from openpyxl import load_workbook
+from util.file_stamps import get_file_stamp
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE_SUFFIX = ".index.json"
+INDEX_FORMAT_VERSION = 1
+
+# Columns read to build the index (L = names, R = account numbers).
+# Writes to any other column do not move index rows.
+NAME_COLUMN = 12
+ACCOUNT_COLUMN = 18
+
+# perform_main_ledger_update stops looking for an employee after this many empty cells in column L
+EMPTY_RUN_LIMIT = 5
+
+_index_cache = {}
+_index_lock = threading.Lock()
+
+
+def _normalize(value) -> str:
+    return str(value).strip().lower()
+
+
+def _employee_key(employee_name: str, employee_accountNo) -> str:
+    return f"{_normalize(employee_name)}\x1f{_normalize(employee_accountNo)}"
+
+
+class MainLedgerIndex:
+    """
+    Maps (institution, employee name, account no) to a row of the main ledger.
+
+    Rows are grouped into segments separated by runs of 5 empty cells in
+    column L, which is where the linear employee search of
+    perform_main_ledger_update gives up. An employee belongs to an institution
+    when its row comes after the institution row within the same segment.
+    """
+
+    def __init__(self, ledger_path: str, stamp: dict, names: dict, employees: dict):
+        self.ledger_path = ledger_path
+        self.stamp = stamp
+        self.names = names  # normalized column L value -> [first row, segment]
+        self.employees = employees  # "name\x1faccount" -> [[row, segment], ...] in row order
+
+    def lookup(self, institution_name: str, employee_name: str, employee_accountNo: str):
+        """
+        Find the institution and employee rows
+
+        Returns:
+            tuple: (institution_row, employee_row), or None if not indexed
+        """
+        institution = self.names.get(_normalize(institution_name))
+        if institution is None:
+            return None
+
+        institution_row, segment = institution
+        for row, row_segment in self.employees.get(_employee_key(employee_name, employee_accountNo), []):
+            if row > institution_row and row_segment == segment:
+                return institution_row, row
+
+        return None
+
+    def to_dict(self) -> dict:
+        return {
+            "version": INDEX_FORMAT_VERSION,
+            "stamp": self.stamp,
+            "names": self.names,
+            "employees": self.employees
+        }
+
+    @classmethod
+    def from_dict(cls, ledger_path: str, data: dict):
+        if data.get("version") != INDEX_FORMAT_VERSION:
+            raise ValueError(f"Unsupported main ledger index version: {data.get('version')}")
+        return cls(ledger_path, data["stamp"], data["names"], data["employees"])
+
+
+def get_index_path(ledger_path: str) -> str:
+    return f"{ledger_path}{INDEX_FILE_SUFFIX}"
+
+
+def build_main_ledger_index(ledger_path: str) -> MainLedgerIndex:
+    """
+    Build the index with a single streaming pass over columns L to R of the active sheet
+    """
+    stamp = get_file_stamp(ledger_path)
+    names = {}
+    employees = {}
+    segment = 0
+    empty_count = 0
+
+    wb = load_workbook(ledger_path, read_only=True, data_only=True)
+    try:
+        ws = wb.active
+        for row, values in enumerate(ws.iter_rows(min_col=NAME_COLUMN, max_col=ACCOUNT_COLUMN, values_only=True), start=1):
+            name_value = values[0] if values else None
+            account_value = values[ACCOUNT_COLUMN - NAME_COLUMN] if len(values) > ACCOUNT_COLUMN - NAME_COLUMN else None
+
+            if name_value in (None, ""):
+                empty_count += 1
+                if empty_count == EMPTY_RUN_LIMIT:
+                    segment += 1
+                continue
+
+            empty_count = 0
+            names.setdefault(_normalize(name_value), [row, segment])
+            employees.setdefault(_employee_key(name_value, account_value), []).append([row, segment])
+    finally:
+        wb.close()
+
+    logger.info(f"Built main ledger index for {ledger_path}: {len(names)} names, {segment + 1} segments")
+    return MainLedgerIndex(ledger_path, stamp, names, employees)
+
+
+def _save_index(index: MainLedgerIndex):
+    index_path = get_index_path(index.ledger_path)
+    temp_fd, temp_path = tempfile.mkstemp(
+        suffix=".tmp",
+        prefix=f"{os.path.basename(index_path)}_",
+        dir=os.path.dirname(index_path) or None
+    )
+    try:
+        with os.fdopen(temp_fd, "w", encoding="utf-8") as temp_file:
+            json.dump(index.to_dict(), temp_file)
+        os.replace(temp_path, index_path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def _load_saved_index(ledger_path: str):
+    index_path = get_index_path(ledger_path)
+    if not os.path.exists(index_path):
+        return None
+
+    try:
+        with open(index_path, "r", encoding="utf-8") as index_file:
+            return MainLedgerIndex.from_dict(ledger_path, json.load(index_file))
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable main ledger index {index_path}: {str(e)}")
+        return None
+
+
+def get_main_ledger_index(ledger_path: str) -> MainLedgerIndex:
+    """
+    Get an up-to-date index for the ledger, from memory, from the saved
+    index file, or by rebuilding it when the ledger's mtime/size changed.
+    """
+    with _index_lock:
+        stamp = get_file_stamp(ledger_path)
+
+        index = _index_cache.get(ledger_path)
+        if index is not None and index.stamp == stamp:
+            return index
+
+        index = _load_saved_index(ledger_path)
+        if index is None or index.stamp != stamp:
+            index = build_main_ledger_index(ledger_path)
+            try:
+                _save_index(index)
+            except Exception as e:
+                logger.warning(f"Could not save main ledger index: {str(e)}")
+
+        _index_cache[ledger_path] = index
+        return index
+
+
+def restamp_main_ledger_index(ledger_path: str, index: MainLedgerIndex, stamp):
+    """
+    Mark the index as current after the app itself rewrote the ledger
+    without touching columns L or R, so the next update does not rebuild it.
+
+    Args:
+        ledger_path (str): Path of the main ledger
+        index (MainLedgerIndex): The index the rewrite was based on
+        stamp: Stamp of the rewritten ledger, read while its file lock was held.
+            None leaves the index to be rebuilt on its next use.
+    """
+    with _index_lock:
+        if _index_cache.get(ledger_path) is not index:
+            return
+
+        if stamp is None:
+            _index_cache.pop(ledger_path, None)
+            return
+
+        index.stamp = stamp
+        try:
+            _save_index(index)
+        except Exception as e:
+            logger.warning(f"Could not save main ledger index: {str(e)}")
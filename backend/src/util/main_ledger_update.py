@@ -2,7 +2,12 @@ import os
 from openpyxl import load_workbook
 import logging
 from dotenv import load_dotenv
+from openpyxl.utils import column_index_from_string
 from util.atomic_excel_operations import atomic_excel_operation
+from util.main_ledger_index import get_main_ledger_index, restamp_main_ledger_index, NAME_COLUMN, ACCOUNT_COLUMN
+from util.xlsx_patch import patch_xlsx_cells, PatchConflict
+from util.sheet_scanner import iter_row_values
+from util.workbook_cache import cached_workbook
 
 load_dotenv()
 
@@ -15,41 +20,28 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def perform_main_ledger_update(workbook, employee_name: str, employee_accountNo: str, institution_name: str, date: str, ledger_interest_column: str, ledger_debit_column: str, capital: float = None, interest: float = None):
-    logger.info(f"Starting main ledger update for employee: {employee_name}, institution: {institution_name}")
-    logger.info(f"Parameters - capital: {capital}, interest: {interest}, date: {date}")
-    
-    if (capital is None or capital == 0) and (interest is None or interest == 0):
-        logger.info(f"No capital or interest amount provided for {employee_name}, skipping main ledger update")
-        return {"success": True, "message": "No amounts to update", "action": "skipped"}
-    
-    logger.info("Getting active worksheet from workbook")
-    ws = workbook.active
-    logger.info(f"Worksheet max_row: {ws.max_row}")
-    
-    logger.info("Converting column letters to column numbers")
+def _get_ledger_index(ledger_debit_column: str, ledger_interest_column: str):
+    """
+    Get the main ledger row index, or None when it cannot be used for this update
+    """
     try:
-        if ledger_interest_column:
-            from openpyxl.utils import column_index_from_string
-            interest_col_num = column_index_from_string(ledger_interest_column)
-            logger.info(f"Interest column '{ledger_interest_column}' converted to column number: {interest_col_num}")
-        else:
-            raise ValueError("ledger interest column variable not set")
-            
-        if ledger_debit_column:
-            debit_col_num = column_index_from_string(ledger_debit_column)
-            logger.info(f"Debit column '{ledger_debit_column}' converted to column number: {debit_col_num}")
-        else:
-            raise ValueError("ledger debit column variable not set")
+        if {column_index_from_string(ledger_debit_column), column_index_from_string(ledger_interest_column)} & {NAME_COLUMN, ACCOUNT_COLUMN}:
+            # Writing into the indexed columns would invalidate the index
+            return None
+        return get_main_ledger_index(MAIN_LEDGER_FILE)
     except Exception as e:
-        logger.error(f"Error converting column letters to numbers: {str(e)}")
-        raise ValueError(f"Error converting column letters to numbers: {str(e)}")
-    
+        logger.warning(f"Main ledger index unavailable, falling back to scanning: {str(e)}")
+        return None
+
+
+def _find_institution_row(ws, institution_name: str) -> int:
+    """
+    Linear search of column L for the institution header row
+    """
     institution_row = None
     logger.info(f"Starting search for institution '{institution_name}' in column L (column 12)")
     
-    for row in range(1, ws.max_row + 1):
-        cell_value = ws.cell(row=row, column=12).value
+    for row, (cell_value,) in iter_row_values(ws, 12, 12, 1, ws.max_row):
         logger.debug(f"Row {row}, Column L value: '{cell_value}'")
         
         if cell_value:
@@ -69,15 +61,23 @@ def perform_main_ledger_update(workbook, employee_name: str, employee_accountNo:
         logger.error(f"Institution '{institution_name}' NOT FOUND in column L after searching {ws.max_row} rows")
         raise ValueError(f"Institution '{institution_name}' not found in column L")
     
+    return institution_row
+
+
+def _find_employee_row(ws, institution_row: int, employee_name: str, employee_accountNo: str, institution_name: str) -> int:
+    """
+    Linear search below the institution row for the employee name (column L) and account number (column R)
+    """
     employee_row = None
     empty_count = 0
     search_start_row = institution_row + 1
     search_end_row = ws.max_row + 10
     logger.info(f"Starting search for employee '{employee_name}' from row {search_start_row} to {search_end_row}")
     
-    for row in range(search_start_row, search_end_row):
-        cell_value = ws.cell(row=row, column=12).value
-        cell_value_accountNo = ws.cell(row=row, column=18).value  
+    # Columns L to R, streamed once
+    for row, values in iter_row_values(ws, 12, 18, search_start_row, search_end_row - 1):
+        cell_value = values[0]
+        cell_value_accountNo = values[6]
         logger.debug(f"Row {row}, Column L value: '{cell_value}'")
         
         if cell_value in (None, ""):
@@ -110,25 +110,202 @@ def perform_main_ledger_update(workbook, employee_name: str, employee_accountNo:
         logger.error(f"Employee '{employee_name}' NOT FOUND under institution '{institution_name}' in column L")
         raise ValueError(f"Employee '{employee_name}' not found under institution '{institution_name}' in column L")
     
+    return employee_row
+
+
+def _verify_indexed_rows(ws, institution_row: int, employee_row: int, employee_name: str, employee_accountNo: str, institution_name: str) -> bool:
+    """
+    Check that rows returned by the ledger index still hold the expected names
+    """
+    institution_value = ws.cell(row=institution_row, column=12).value
+    name_value = ws.cell(row=employee_row, column=12).value
+    account_value = ws.cell(row=employee_row, column=18).value
+
+    return (
+        institution_value is not None
+        and name_value is not None
+        and str(institution_value).strip().lower() == institution_name.strip().lower()
+        and str(name_value).strip().lower() == employee_name.strip().lower()
+        and str(account_value).strip().lower() == employee_accountNo.strip().lower()
+    )
+
+
+def _current_amount(value, label: str) -> float:
+    """
+    Read the current amount of a ledger cell, empty or non-numeric values count as 0
+    """
+    logger.info(f"Current {label} value in cell: '{value}'")
+    
+    if value is None or value == "":
+        logger.info(f"Current {label} was None/empty, treating as 0.0")
+        return 0.0
+    
+    try:
+        amount = float(value)
+        logger.info(f"Successfully converted current {label} to float: {amount}")
+        return amount
+    except (ValueError, TypeError):
+        logger.warning(f"Invalid {label} value '{value}' in cell, treating as 0")
+        return 0.0
+
+
+def _add_amount(amount: float, label: str, cell_label: str, updates_made: list):
+    """
+    Build the patch delta that adds amount to a ledger cell and records it in updates_made
+    """
+    def apply(value):
+        current = _current_amount(value, cell_label)
+        new_value = current + amount
+        updates_made.append(f"{label}: {current} + {amount} = {new_value}")
+        return new_value
+    return apply
+
+
+def _same_text(expected: str):
+    """
+    Build the patch expectation that a cell holds expected, ignoring case and surrounding spaces
+    """
+    return lambda value: value is not None and str(value).strip().lower() == expected.strip().lower()
+
+
+def _patch_main_ledger(entries: list, ledger_interest_column: str, ledger_debit_column: str, ledger_index, on_commit=None) -> list:
+    """
+    Apply main ledger updates by patching the amount cells in place instead of
+    loading and saving the whole ledger. Used when every entry is found in the
+    ledger index; the indexed name, account and institution cells are checked
+    in the same locked pass, so a stale index never leads to a wrong row.
+
+    Args:
+        entries (list): Dicts with employee_name, employee_accountNo, institution_name, date, capital and interest
+        ledger_interest_column (str): Column letter for interest
+        ledger_debit_column (str): Column letter for capital
+        ledger_index (MainLedgerIndex): Row index of the ledger
+        on_commit (optional): Called with the stamp of the patched ledger while its lock is held
+
+    Returns:
+        list: One result dict per entry shaped like update_main_ledger's result,
+            or None when the ledger has to be updated through openpyxl instead
+    """
+    interest_col_num = column_index_from_string(ledger_interest_column)
+    debit_col_num = column_index_from_string(ledger_debit_column)
+    cells = {}
+    expectations = {}
+    results = []
+
+    for entry in entries:
+        employee_name = entry.get("employee_name")
+        employee_accountNo = entry.get("employee_accountNo")
+        institution_name = entry.get("institution_name")
+        capital = entry.get("capital")
+        interest = entry.get("interest")
+
+        if (capital is None or capital == 0) and (interest is None or interest == 0):
+            logger.info(f"No capital or interest amount provided for {employee_name}, skipping main ledger update")
+            results.append({
+                "success": True,
+                "message": f"Successfully updated main ledger for {employee_name}",
+                "details": {"success": True, "message": "No amounts to update", "action": "skipped"}
+            })
+            continue
+
+        located = entry.get("ledger_rows") or ledger_index.lookup(institution_name, employee_name, employee_accountNo)
+        if located is None:
+            logger.info(f"Ledger index miss for '{employee_name}' ({employee_accountNo}), patching not possible")
+            return None
+
+        institution_row, employee_row = located
+        expectations[(institution_row, NAME_COLUMN)] = _same_text(institution_name)
+        expectations[(employee_row, NAME_COLUMN)] = _same_text(employee_name)
+        expectations[(employee_row, ACCOUNT_COLUMN)] = _same_text(employee_accountNo)
+
+        updates_made = []
+        for amount, label, cell_label, column in ((interest, "interest", "interest", interest_col_num), (capital, "capital", "debit", debit_col_num)):
+            if amount is None or amount == 0:
+                continue
+            delta = _add_amount(amount, label, cell_label, updates_made)
+            previous = cells.get((employee_row, column))
+            # The same employee twice in a batch: apply both additions in order
+            cells[(employee_row, column)] = delta if previous is None else (lambda value, first=previous, second=delta: second(first(value)))
+
+        results.append({
+            "success": True,
+            "message": f"Successfully updated main ledger for {employee_name}",
+            "details": {
+                "success": True,
+                "message": f"Main ledger updated for {employee_name}",
+                "action": "updated",
+                "row_updated": employee_row,
+                "updates_made": updates_made,
+                "institution_row": institution_row
+            }
+        })
+
+    if cells:
+        try:
+            patch_xlsx_cells(MAIN_LEDGER_FILE, cells, expectations=expectations, on_commit=on_commit)
+        except PatchConflict as pc:
+            logger.info(f"Ledger index is stale ({str(pc)}), falling back to openpyxl")
+            return None
+
+    logger.info(f"Patched main ledger for {len(entries)} entries")
+    return results
+
+
+def perform_main_ledger_update(workbook, employee_name: str, employee_accountNo: str, institution_name: str, date: str, ledger_interest_column: str, ledger_debit_column: str, capital: float = None, interest: float = None, ledger_index=None, ledger_rows=None):
+    logger.info(f"Starting main ledger update for employee: {employee_name}, institution: {institution_name}")
+    logger.info(f"Parameters - capital: {capital}, interest: {interest}, date: {date}")
+    
+    if (capital is None or capital == 0) and (interest is None or interest == 0):
+        logger.info(f"No capital or interest amount provided for {employee_name}, skipping main ledger update")
+        return {"success": True, "message": "No amounts to update", "action": "skipped"}
+    
+    logger.info("Getting active worksheet from workbook")
+    ws = workbook.active
+    logger.info(f"Worksheet max_row: {ws.max_row}")
+    
+    logger.info("Converting column letters to column numbers")
+    try:
+        if ledger_interest_column:
+            interest_col_num = column_index_from_string(ledger_interest_column)
+            logger.info(f"Interest column '{ledger_interest_column}' converted to column number: {interest_col_num}")
+        else:
+            raise ValueError("ledger interest column variable not set")
+            
+        if ledger_debit_column:
+            debit_col_num = column_index_from_string(ledger_debit_column)
+            logger.info(f"Debit column '{ledger_debit_column}' converted to column number: {debit_col_num}")
+        else:
+            raise ValueError("ledger debit column variable not set")
+    except Exception as e:
+        logger.error(f"Error converting column letters to numbers: {str(e)}")
+        raise ValueError(f"Error converting column letters to numbers: {str(e)}")
+    
+    institution_row = None
+    employee_row = None
+
+    # Rows located when the batch was planned, otherwise from the index
+    located = ledger_rows
+    if located is None and ledger_index is not None:
+        located = ledger_index.lookup(institution_name, employee_name, employee_accountNo)
+
+    if located is not None or ledger_index is not None:
+        if located and _verify_indexed_rows(ws, located[0], located[1], employee_name, employee_accountNo, institution_name):
+            institution_row, employee_row = located
+            logger.info(f"Ledger rows known: institution '{institution_name}' at row {institution_row}, employee '{employee_name}' at row {employee_row}")
+        else:
+            logger.info(f"Ledger index miss for '{employee_name}' ({employee_accountNo}), falling back to scanning column L")
+
+    if employee_row is None:
+        institution_row = _find_institution_row(ws, institution_name)
+        employee_row = _find_employee_row(ws, institution_row, employee_name, employee_accountNo, institution_name)
+    
     updates_made = []
     logger.info("Starting to update interest and capital amounts")
     
     if interest is not None and interest != 0:
         logger.info(f"Updating interest amount: {interest}")
         interest_cell = ws.cell(row=employee_row, column=interest_col_num)
-        current_interest = interest_cell.value
-        logger.info(f"Current interest value in cell: '{current_interest}'")
-        
-        if current_interest is None or current_interest == "":
-            current_interest = 0.0
-            logger.info("Current interest was None/empty, treating as 0.0")
-        else:
-            try:
-                current_interest = float(current_interest)
-                logger.info(f"Successfully converted current interest to float: {current_interest}")
-            except (ValueError, TypeError):
-                logger.warning(f"Invalid interest value '{current_interest}' in cell, treating as 0")
-                current_interest = 0.0
+        current_interest = _current_amount(interest_cell.value, "interest")
         
         new_interest = current_interest + interest
         interest_cell.value = new_interest
@@ -139,19 +316,7 @@ def perform_main_ledger_update(workbook, employee_name: str, employee_accountNo:
     if capital is not None and capital != 0:
         logger.info(f"Updating capital amount: {capital}")
         debit_cell = ws.cell(row=employee_row, column=debit_col_num)
-        current_debit = debit_cell.value
-        logger.info(f"Current debit value in cell: '{current_debit}'")
-        
-        if current_debit is None or current_debit == "":
-            current_debit = 0.0
-            logger.info("Current debit was None/empty, treating as 0.0")
-        else:
-            try:
-                current_debit = float(current_debit)
-                logger.info(f"Successfully converted current debit to float: {current_debit}")
-            except (ValueError, TypeError):
-                logger.warning(f"Invalid debit value '{current_debit}' in cell, treating as 0")
-                current_debit = 0.0
+        current_debit = _current_amount(debit_cell.value, "debit")
         
         new_debit = current_debit + capital
         debit_cell.value = new_debit
@@ -209,22 +374,43 @@ def update_main_ledger(employee_name: str, employee_accountNo: str, institution_
         else:
             logger.info(f"Main ledger file exists: {MAIN_LEDGER_FILE}")
         
-        logger.info("Starting atomic Excel operation for main ledger update")
+        ledger_index = _get_ledger_index(ledger_debit_column, ledger_interest_column)
+        committed = {}
         
-        with atomic_excel_operation(MAIN_LEDGER_FILE) as workbook:
-            logger.info("Successfully opened workbook with atomic operation")
-            result = perform_main_ledger_update(
-                workbook, 
-                employee_name, 
-                employee_accountNo, 
-                institution_name, 
-                date, 
-                ledger_interest_column, 
-                ledger_debit_column,
-                capital, 
-                interest
-            )
-            logger.info("Main ledger update operation completed")
+        patched = None
+        if ledger_index is not None:
+            patched = _patch_main_ledger([{
+                "employee_name": employee_name,
+                "employee_accountNo": employee_accountNo,
+                "institution_name": institution_name,
+                "date": date,
+                "capital": capital,
+                "interest": interest
+            }], ledger_interest_column, ledger_debit_column, ledger_index, on_commit=lambda stamp: committed.update(stamp=stamp))
+        
+        if patched is not None:
+            result = patched[0]["details"]
+        else:
+            logger.info("Starting atomic Excel operation for main ledger update")
+            
+            with atomic_excel_operation(MAIN_LEDGER_FILE, on_commit=lambda stamp: committed.update(stamp=stamp)) as workbook:
+                logger.info("Successfully opened workbook with atomic operation")
+                result = perform_main_ledger_update(
+                    workbook, 
+                    employee_name, 
+                    employee_accountNo, 
+                    institution_name, 
+                    date, 
+                    ledger_interest_column, 
+                    ledger_debit_column,
+                    capital, 
+                    interest,
+                    ledger_index=ledger_index
+                )
+                logger.info("Main ledger update operation completed")
+        
+        if ledger_index is not None and "stamp" in committed:
+            restamp_main_ledger_index(MAIN_LEDGER_FILE, ledger_index, committed["stamp"])
         
         success_message = f"Successfully updated main ledger for {employee_name}"
         logger.info(success_message)
@@ -263,4 +449,201 @@ def update_main_ledger(employee_name: str, employee_accountNo: str, institution_
         return {
             "success": False,
             "error": error_message
-        }
\ No newline at end of file
+        }
+
+
+def perform_main_ledger_batch_update(workbook, entries: list, ledger_interest_column: str, ledger_debit_column: str, ledger_index=None) -> list:
+    """
+    Apply several main ledger updates to an already opened workbook
+
+    Each entry is applied with perform_main_ledger_update, so a failing entry
+    (e.g. employee not found) is recorded and the remaining entries still run.
+
+    Args:
+        workbook: The openpyxl workbook object to work with
+        entries (list): Dicts with employee_name, employee_accountNo, institution_name, date, capital and interest
+        ledger_interest_column (str): Column letter for interest
+        ledger_debit_column (str): Column letter for capital
+        ledger_index (MainLedgerIndex, optional): Row index used to skip the column L scans
+
+    Returns:
+        list: One result dict per entry, in the same order, shaped like update_main_ledger's result
+    """
+    results = []
+
+    for entry in entries:
+        employee_name = entry.get("employee_name")
+        try:
+            result = perform_main_ledger_update(
+                workbook,
+                employee_name,
+                entry.get("employee_accountNo"),
+                entry.get("institution_name"),
+                entry.get("date"),
+                ledger_interest_column,
+                ledger_debit_column,
+                entry.get("capital"),
+                entry.get("interest"),
+                ledger_index=ledger_index,
+                ledger_rows=entry.get("ledger_rows")
+            )
+            results.append({
+                "success": True,
+                "message": f"Successfully updated main ledger for {employee_name}",
+                "details": result
+            })
+
+        except ValueError as ve:
+            error_message = str(ve)
+            logger.error(f"Validation error updating main ledger for {employee_name}: {error_message}")
+            results.append({
+                "success": False,
+                "error": error_message
+            })
+
+        except Exception as e:
+            error_message = f"Error updating main ledger for {employee_name}: {str(e)}"
+            logger.error(error_message)
+            results.append({
+                "success": False,
+                "error": error_message
+            })
+
+    return results
+
+
+def update_main_ledger_batch(entries: list, ledger_debit_column: str, ledger_interest_column: str) -> list:
+    """
+    Updates the main ledger for a whole batch of employees with a single
+    load/save of the ledger workbook.
+
+    Args:
+        entries (list): Dicts with employee_name, employee_accountNo, institution_name, date, capital
+            and interest, and optionally the ledger_rows found by locate_main_ledger_rows
+        ledger_debit_column (str): Column letter for capital
+        ledger_interest_column (str): Column letter for interest
+
+    Returns:
+        list: One result dict per entry, in the same order as entries
+    """
+    logger.info(f"=== STARTING MAIN LEDGER BATCH UPDATE ({len(entries)} entries) ===")
+
+    if not entries:
+        return []
+
+    try:
+        if not MAIN_LEDGER_FILE:
+            raise ValueError("MAIN_LEDGER_FILEPATH environment variable not set")
+
+        if not ledger_interest_column:
+            raise ValueError("Ledger interest column not provided")
+
+        if not ledger_debit_column:
+            raise ValueError("Ledger debit column not provided")
+
+        if not os.path.exists(MAIN_LEDGER_FILE):
+            raise FileNotFoundError(f"Main ledger file not found: {MAIN_LEDGER_FILE}")
+
+        ledger_index = _get_ledger_index(ledger_debit_column, ledger_interest_column)
+        committed = {}
+
+        results = None
+        if ledger_index is not None:
+            results = _patch_main_ledger(entries, ledger_interest_column, ledger_debit_column, ledger_index, on_commit=lambda stamp: committed.update(stamp=stamp))
+
+        if results is None:
+            with atomic_excel_operation(MAIN_LEDGER_FILE, on_commit=lambda stamp: committed.update(stamp=stamp)) as workbook:
+                results = perform_main_ledger_batch_update(
+                    workbook,
+                    entries,
+                    ledger_interest_column,
+                    ledger_debit_column,
+                    ledger_index=ledger_index
+                )
+
+        if ledger_index is not None and "stamp" in committed:
+            restamp_main_ledger_index(MAIN_LEDGER_FILE, ledger_index, committed["stamp"])
+
+        succeeded = sum(1 for result in results if result["success"])
+        logger.info(f"=== MAIN LEDGER BATCH UPDATE COMPLETED: {succeeded}/{len(entries)} entries updated ===")
+        return results
+
+    except ValueError as ve:
+        error_message = str(ve)
+        logger.error(f"Validation error in main ledger batch update: {error_message}")
+
+    except FileNotFoundError as fe:
+        error_message = f"File not found: {str(fe)}"
+        logger.error(f"File error in main ledger batch update: {error_message}")
+
+    except Exception as e:
+        error_message = f"Error updating main ledger batch: {str(e)}"
+        logger.error(error_message)
+        import traceback
+        logger.error(traceback.format_exc())
+
+    # The ledger was not committed, so every entry in the batch failed
+    logger.error("=== MAIN LEDGER BATCH UPDATE FAILED ===")
+    return [{"success": False, "error": error_message} for _ in entries]
+
+
+def locate_main_ledger_rows(entries: list) -> list:
+    """
+    Find the institution and employee rows of batch entries in the main ledger
+    without writing it: from the ledger_rows already resolved from the master
+    data, from the ledger index, or by scanning the cached workbook for entries
+    the index does not have.
+
+    Args:
+        entries (list): Dicts with employee_name, employee_accountNo, institution_name, capital and interest,
+            and optionally ledger_rows
+
+    Returns:
+        list: One result per entry, in the same order: success and ledger_rows
+            ((institution_row, employee_row), None when there is nothing to update),
+            or success False and the error
+    """
+    if not MAIN_LEDGER_FILE or not os.path.exists(MAIN_LEDGER_FILE):
+        error_message = f"Main ledger file not found: {MAIN_LEDGER_FILE}"
+        return [{"success": False, "error": error_message} for _ in entries]
+
+    try:
+        ledger_index = get_main_ledger_index(MAIN_LEDGER_FILE)
+    except Exception as e:
+        logger.warning(f"Main ledger index unavailable, scanning instead: {str(e)}")
+        ledger_index = None
+
+    results = [None] * len(entries)
+    misses = []
+
+    for position, entry in enumerate(entries):
+        capital = entry.get("capital")
+        interest = entry.get("interest")
+
+        if (capital is None or capital == 0) and (interest is None or interest == 0):
+            results[position] = {"success": True, "ledger_rows": None}
+            continue
+
+        # Rows resolved from the master data are taken as they are
+        located = entry.get("ledger_rows")
+        if located is None and ledger_index is not None:
+            located = ledger_index.lookup(entry.get("institution_name"), entry.get("employee_name"), entry.get("employee_accountNo"))
+
+        if located is None:
+            misses.append(position)
+        else:
+            results[position] = {"success": True, "ledger_rows": located}
+
+    if misses:
+        with cached_workbook(MAIN_LEDGER_FILE) as workbook:
+            ws = workbook.active
+            for position in misses:
+                entry = entries[position]
+                try:
+                    institution_row = _find_institution_row(ws, entry.get("institution_name"))
+                    employee_row = _find_employee_row(ws, institution_row, entry.get("employee_name"), entry.get("employee_accountNo"), entry.get("institution_name"))
+                    results[position] = {"success": True, "ledger_rows": (institution_row, employee_row)}
+                except ValueError as ve:
+                    results[position] = {"success": False, "error": str(ve)}
+
+    return results
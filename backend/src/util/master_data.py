@@ -0,0 +1,287 @@
+import os
+import time
+import threading
+import logging
+from dotenv import load_dotenv
+from mongo.mongo_connector import get_db
+from mongo.data_version import get_master_data_version
+from mongo.employee_store import get_employees_collection, DUPLICATE_ACCOUNT_FIELD
+from util.finding_files_sheets import find_personal_account_file
+from util.main_ledger_index import get_main_ledger_index
+
+load_dotenv()
+
+MAIN_LEDGER_FILE = os.getenv('MAIN_LEDGER_FILEPATH')
+# Drop the cache as soon as MongoDB reports a change, where change streams are available (replica sets)
+MASTER_DATA_CHANGE_STREAM = os.getenv('MASTER_DATA_CHANGE_STREAM', 'true').lower() in ('1', 'true', 'yes')
+# Seconds to wait after a failed load before MongoDB is tried again, payments use the details as sent meanwhile
+MASTER_DATA_RETRY_SECONDS = float(os.getenv('MASTER_DATA_RETRY_SECONDS', '30'))
+
+logger = logging.getLogger(__name__)
+
+
+def _key(institution_name: str, employee_accountNo) -> tuple:
+    return (str(institution_name).strip(), str(employee_accountNo).strip())
+
+
+class MasterDataCache:
+    """
+    In-process copy of the employees of every institution, keyed by
+    (institution, account number). The copy is tied to the master data
+    version it was loaded at (see mongo.data_version), which every endpoint
+    changing institutions or employees moves forward.
+    """
+
+    def __init__(self, version: int, employees: dict):
+        self.version = version
+        self.employees = employees  # (institution_name, accountNo) -> {"employee_name", "employee_accountNo", "institution_name", "id", "shared_with"}
+
+    @classmethod
+    def load(cls, db):
+        """
+        Read the employees of every institution, as of the current master data version
+        """
+        # The version is read first, so a change made while loading is picked up next time
+        version = get_master_data_version(db)
+        employees = {}
+
+        employees_collection = get_employees_collection(db)
+        projection = {"_id": 0, "institution_name": 1, "accountNo": 1, "name": 1, "id": 1}
+        for employee in employees_collection.find({"accountNo": {"$exists": True}}, projection):
+            employees[_key(employee["institution_name"], employee["accountNo"])] = {
+                "employee_name": employee.get("name"),
+                "employee_accountNo": employee["accountNo"],
+                "institution_name": employee["institution_name"],
+                "id": employee.get("id"),
+                "shared_with": []
+            }
+
+        # Employees repeating an account number make it ambiguous, see mongo.employee_store
+        projection = {"_id": 0, "institution_name": 1, DUPLICATE_ACCOUNT_FIELD: 1, "name": 1}
+        for employee in employees_collection.find({DUPLICATE_ACCOUNT_FIELD: {"$exists": True}}, projection):
+            registered = employees.get(_key(employee["institution_name"], employee[DUPLICATE_ACCOUNT_FIELD]))
+            if registered is not None:
+                registered["shared_with"].append(employee.get("name"))
+
+        logger.info(f"Loaded {len(employees)} employees into the master data cache at version {version}")
+        return cls(version, employees)
+
+    def lookup(self, institution_name: str, employee_accountNo):
+        """
+        Get an employee, or None if the institution has no such account number
+        """
+        return self.employees.get(_key(institution_name, employee_accountNo))
+
+
+class MasterDataUnavailable(Exception):
+    """
+    The master data could not be loaded from MongoDB
+    """
+
+
+_cache = None
+_cache_lock = threading.Lock()
+_retry_at = 0.0
+_watcher_pid = None
+
+
+def invalidate_master_data():
+    """
+    Drop the cache, the next lookup loads it again
+    """
+    global _cache
+
+    with _cache_lock:
+        _cache = None
+
+
+def _watch_changes():
+    """
+    Drop the cache on every change to institutions or employees. Ends quietly
+    when the server does not support change streams (standalone servers).
+    """
+    try:
+        db = get_db()
+        pipeline = [{"$match": {"ns.coll": {"$in": ["institutions", "employees"]}}}]
+        with db.watch(pipeline) as stream:
+            logger.info("Watching institution and employee changes for the master data cache")
+            for _ in stream:
+                invalidate_master_data()
+    except Exception as e:
+        logger.info(f"Master data change stream unavailable, relying on the version counter: {str(e)}")
+
+
+def _start_watcher():
+    """
+    Start the change stream watcher of this process, once
+    """
+    global _watcher_pid
+
+    if not MASTER_DATA_CHANGE_STREAM or _watcher_pid == os.getpid():
+        return
+
+    _watcher_pid = os.getpid()
+    threading.Thread(target=_watch_changes, name="master-data-watcher", daemon=True).start()
+
+
+def get_master_data(fresh: bool = False) -> MasterDataCache:
+    """
+    Get the master data cache, loading it again when the master data version
+    changed. MongoDB is read without holding the cache lock, so a slow or
+    unreachable server only delays the request that reads it. After a failure
+    MongoDB is not tried again for MASTER_DATA_RETRY_SECONDS.
+
+    Args:
+        fresh (bool, optional): Check the version against MongoDB now instead of
+            trusting the version read in the last MASTER_DATA_VERSION_TTL seconds
+
+    Raises:
+        MasterDataUnavailable: When MongoDB cannot be reached to check or load it
+    """
+    global _cache, _retry_at
+
+    if time.monotonic() < _retry_at:
+        raise MasterDataUnavailable("MongoDB was unreachable, waiting before trying again")
+
+    try:
+        version = get_master_data_version(fresh=fresh)
+        cache = _cache
+        if cache is not None and cache.version == version:
+            return cache
+
+        cache = MasterDataCache.load(get_db())
+    except Exception as e:
+        _retry_at = time.monotonic() + MASTER_DATA_RETRY_SECONDS
+        raise MasterDataUnavailable(str(e))
+
+    with _cache_lock:
+        # A concurrent load may have stored a newer copy meanwhile
+        if _cache is None or _cache.version <= cache.version:
+            _cache = cache
+        _start_watcher()
+        return _cache
+
+
+def find_registered_employee(institution_name: str, employee_accountNo, master_data: MasterDataCache = None):
+    """
+    Look an employee up in the master data. On a miss the version is checked
+    against MongoDB again, so an employee just added through another process
+    is found without waiting for the version TTL.
+
+    Returns:
+        dict: employee_name, employee_accountNo, institution_name, id and shared_with, or None when not registered
+
+    Raises:
+        MasterDataUnavailable: When MongoDB cannot be reached
+    """
+    master_data = get_master_data() if master_data is None else master_data
+    employee = master_data.lookup(institution_name, employee_accountNo)
+
+    if employee is None:
+        employee = get_master_data(fresh=True).lookup(institution_name, employee_accountNo)
+
+    return employee
+
+
+def shared_account_error(employee: dict) -> str:
+    """
+    Error message for a payment to an account number several employees of the institution have
+    """
+    names = ", ".join(str(name) for name in [employee["employee_name"]] + employee["shared_with"])
+    return (f"Account number {employee['employee_accountNo']} is shared by several employees of "
+            f"{employee['institution_name']} ({names}), give each its own account number before paying")
+
+
+def resolve_employee(institution_name: str, employee_accountNo, master_data: MasterDataCache = None) -> dict:
+    """
+    Resolve an employee from the master data: the registered name and account
+    number, the personal account file and the main ledger rows. The file and
+    rows come from the in-memory directory and ledger indexes.
+
+    Args:
+        institution_name (str): Name of the institution
+        employee_accountNo: Account number of the employee
+        master_data (MasterDataCache, optional): Defaults to get_master_data()
+
+    Returns:
+        dict: employee_name, employee_accountNo, institution_name, personal_account_file
+            (None if not found) and ledger_rows ((institution_row, employee_row), None if
+            not indexed) and shared_with (names of other employees repeating the account
+            number), or None when the employee is not registered
+
+    Raises:
+        MasterDataUnavailable: When MongoDB cannot be reached
+    """
+    employee = find_registered_employee(institution_name, employee_accountNo, master_data)
+    if employee is None:
+        return None
+
+    resolved = dict(employee)
+
+    try:
+        resolved["personal_account_file"] = find_personal_account_file(
+            employee["employee_name"], employee["employee_accountNo"], employee["institution_name"]
+        )
+    except FileNotFoundError:
+        resolved["personal_account_file"] = None
+
+    resolved["ledger_rows"] = None
+    if MAIN_LEDGER_FILE and os.path.exists(MAIN_LEDGER_FILE):
+        try:
+            resolved["ledger_rows"] = get_main_ledger_index(MAIN_LEDGER_FILE).lookup(
+                employee["institution_name"], employee["employee_name"], employee["employee_accountNo"]
+            )
+        except Exception as e:
+            logger.warning(f"Main ledger index unavailable: {str(e)}")
+
+    return resolved
+
+
+def resolve_batch_entries(entries: list) -> list:
+    """
+    Resolve batch entries against the master data. A registered employee's
+    entry takes the registered name and gets its personal_account_file and,
+    when indexed, its ledger_rows, so the planner does not look them up again.
+    When MongoDB cannot be reached the entries are left as sent.
+
+    Args:
+        entries (list): Entry dicts with employee_name, employee_accountNo and institution_name
+
+    Returns:
+        list: One error message per entry, None when it was resolved or left as sent
+    """
+    try:
+        master_data = get_master_data()
+    except MasterDataUnavailable as e:
+        logger.warning(f"Master data unavailable, using the employee details as sent: {str(e)}")
+        return [None for _ in entries]
+
+    errors = []
+    for entry in entries:
+        try:
+            resolved = resolve_employee(entry["institution_name"], entry["employee_accountNo"], master_data)
+        except MasterDataUnavailable as e:
+            logger.warning(f"Master data unavailable, using the remaining employee details as sent: {str(e)}")
+            return errors + [None for _ in entries[len(errors):]]
+
+        if resolved is None:
+            errors.append(f"Employee with account number {entry['employee_accountNo']} is not registered in {entry['institution_name']}")
+            continue
+
+        if resolved["shared_with"]:
+            errors.append(shared_account_error(resolved))
+            continue
+
+        if resolved["employee_name"] != entry["employee_name"]:
+            logger.info(f"Using registered name {resolved['employee_name']} for {entry['employee_name']} ({entry['employee_accountNo']})")
+
+        entry["employee_name"] = resolved["employee_name"]
+        entry["employee_accountNo"] = resolved["employee_accountNo"]
+        entry["institution_name"] = resolved["institution_name"]
+        if resolved["personal_account_file"]:
+            entry["personal_account_file"] = resolved["personal_account_file"]
+        if resolved["ledger_rows"] and (entry.get("capital") or entry.get("interest")):
+            entry["ledger_rows"] = resolved["ledger_rows"]
+        errors.append(None)
+
+    return errors
@@ -0,0 +1,80 @@
+import os
+import threading
+import logging
+from util.file_stamps import get_file_stamp
+
+logger = logging.getLogger(__name__)
+
+_summaries = {}
+_summary_lock = threading.Lock()
+
+
+def _summary_key(file_path: str, employee_accountNo: str) -> tuple:
+    return os.path.normcase(os.path.abspath(file_path)), str(employee_accountNo).strip()
+
+
+def get_account_summary(file_path: str, employee_accountNo: str):
+    """
+    Get the summary of a personal account if the file has not changed since it was recorded
+    
+    Args:
+        file_path (str): Path to the personal account file
+        employee_accountNo (str): Account number of the employee sheet
+        
+    Returns:
+        dict: limit_row, limit, next_free_row and stamp, or None when missing or out of date
+    """
+    key = _summary_key(file_path, employee_accountNo)
+    
+    with _summary_lock:
+        summary = _summaries.get(key)
+    
+    if summary is None:
+        return None
+    
+    try:
+        if get_file_stamp(file_path) != summary["stamp"]:
+            logger.info(f"Account summary for {employee_accountNo} is out of date, file changed")
+            return None
+    except OSError:
+        return None
+    
+    return summary
+
+
+def store_account_summary(file_path: str, employee_accountNo: str, limit_row: int, limit: float, next_free_row: int = None, stamp: dict = None):
+    """
+    Record the summary of a personal account
+    
+    Args:
+        file_path (str): Path to the personal account file
+        employee_accountNo (str): Account number of the employee sheet
+        limit_row (int): Target row of the capital limit check
+        limit (float): Capital limit (Column K) at limit_row
+        next_free_row (int, optional): Row the next personal account entry goes to, if known
+        stamp (dict, optional): File stamp the values were read from. Defaults to the current stamp.
+    """
+    try:
+        if stamp is None:
+            stamp = get_file_stamp(file_path)
+    except OSError:
+        return
+    
+    with _summary_lock:
+        _summaries[_summary_key(file_path, employee_accountNo)] = {
+            "limit_row": limit_row,
+            "limit": limit,
+            "next_free_row": next_free_row,
+            "stamp": stamp
+        }
+
+
+def discard_account_summaries(file_path: str):
+    """
+    Forget every account summary recorded for a file
+    """
+    normalized_path = os.path.normcase(os.path.abspath(file_path))
+    
+    with _summary_lock:
+        for key in [key for key in _summaries if key[0] == normalized_path]:
+            del _summaries[key]
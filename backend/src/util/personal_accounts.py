@@ -5,14 +5,24 @@ import xlwt
 from xlutils.copy import copy
 import logging
 from dotenv import load_dotenv
-from util.atomic_excel_operations import atomic_excel_operation  # Import our atomic operations
-from util.validate_capital_limit_utilities import validate_capital_limit_xlsx  # Import the capital limit validation function
-from util.finding_files_sheets import find_personal_account_file, find_employee_sheet_xls, find_employee_sheet  # Import file and sheet finding functions
+from util.atomic_excel_operations import atomic_excel_operation, replace_file_atomically  # Import our atomic operations
+from util.file_locks import file_lock
+from util.validate_capital_limit_utilities import validate_capital_limit_xlsx, compute_capital_limit  # Import the capital limit validation functions
+from util.finding_files_sheets import find_personal_account_file, find_entry_personal_account_file, find_employee_sheet_xls, find_employee_sheet, find_personal_account_entry_row, get_directory_mtime_ns, refresh_personal_account_directory_index  # Import file and sheet finding functions
+from util.personal_account_summary import get_account_summary, store_account_summary, discard_account_summaries
+from util.employee_sheet_index import refresh_employee_sheet_index
+from util.file_stamps import get_file_stamp
+from util.workbook_cache import cached_workbook
+from util.formula_evaluator import UnsupportedFormulaError
+from util.sheet_scanner import SheetOverlay
+from util.xls_migration import migrate_personal_account_file, XlsConversionError
 
 
 load_dotenv()
 
 PERSONAL_ACCOUNT_ROOTPATH = os.getenv('PERSONAL_ACCOUNT_ROOTPATH')
+# Migrate .xls personal account files to .xlsx on their first update
+MIGRATE_XLS_PERSONAL_ACCOUNTS = os.getenv('MIGRATE_XLS_PERSONAL_ACCOUNTS', 'true').lower() in ('1', 'true', 'yes')
 
 # Configure logging
 logging.basicConfig(
@@ -25,31 +35,39 @@ logger = logging.getLogger(__name__)
 
 
 
-def perform_personal_account_update_xls(file_path: str, employee_name: str, employee_accountNo: str, date: str, capital: float = None, interest: float = None, description: str = None, bill_no: str = "BS", cheque_no: str = "") -> int:
+def resolve_xls_personal_account_file(file_path: str) -> str:
     """
-    Handle .xls files using xlrd/xlwt
+    Migrate an .xls personal account file to .xlsx (see migrate_personal_account_file)
+    so it takes the .xlsx path. Files that cannot be converted exactly keep the .xls path.
     
     Args:
-        file_path (str): Full path to the .xls file
-        employee_name (str): Name of the employee
-        employee_accountNo (str): Account number of the employee
-        date (str): Date of the payment
-        capital (float, optional): Capital amount. Defaults to None.
-        interest (float, optional): Interest amount. Defaults to None.
-        description (str, optional): Description for the entry. Defaults to None.
+        file_path (str): Path of the personal account file
         
     Returns:
-        int: The row number that was updated
+        str: The path to update, the .xlsx file when the file was migrated
     """
+    if not MIGRATE_XLS_PERSONAL_ACCOUNTS or not file_path.lower().endswith('.xls'):
+        return file_path
     
-    # Read the existing file
-    rb = xlrd.open_workbook(file_path, formatting_info=True)
-    
-    # Find the correct sheet for this employee
-    sheet_index, sheet = find_employee_sheet_xls(rb, employee_accountNo)
+    try:
+        return os.path.join(os.path.dirname(file_path), os.path.basename(migrate_personal_account_file(file_path)["xlsx"]))
+    except XlsConversionError as ce:
+        logger.warning(f"Keeping {file_path} in .xls format, it cannot be migrated: {str(ce)}")
+        return file_path
+
+
+
+def find_personal_account_entry_row_xls(sheet):
+    """
+    Find the row of a new entry in an .xls employee sheet: the first of 4
+    consecutive rows with empty columns A, H and I
     
-    # Find 4 consecutive empty rows
-    current_row = None
+    Args:
+        sheet: The xlrd sheet of the employee
+        
+    Returns:
+        int: The 0-based row, or None if no such rows were found
+    """
     empty_rows_count = 0
     first_empty_row = None
     
@@ -80,35 +98,68 @@ def perform_personal_account_update_xls(file_path: str, employee_name: str, empl
             empty_rows_count += 1
             
             if empty_rows_count >= 4:
-                current_row = first_empty_row
-                break
+                return first_empty_row
         else:
             empty_rows_count = 0
             first_empty_row = None
     
-    if current_row is None:
-        raise ValueError(f"Could not find 4 consecutive empty rows in personal account file for {employee_name}")
+    return None
+
+
+
+def perform_personal_account_update_xls(file_path: str, employee_name: str, employee_accountNo: str, date: str, capital: float = None, interest: float = None, description: str = None, bill_no: str = "BS", cheque_no: str = "") -> int:
+    """
+    Handle .xls files using xlrd/xlwt
+    
+    Args:
+        file_path (str): Full path to the .xls file
+        employee_name (str): Name of the employee
+        employee_accountNo (str): Account number of the employee
+        date (str): Date of the payment
+        capital (float, optional): Capital amount. Defaults to None.
+        interest (float, optional): Interest amount. Defaults to None.
+        description (str, optional): Description for the entry. Defaults to None.
+        
+    Returns:
+        int: The row number that was updated
+    """
     
-    # Create a copy of the workbook for writing
-    wb = copy(rb)
-    ws = wb.get_sheet(sheet_index)  # Use the found sheet index
+    # Hold the file lock from the read until the save, like the atomic .xlsx operations
+    with file_lock(file_path) as lock_wait_seconds:
+        logger.info(f"Acquired lock on {file_path} after {lock_wait_seconds:.3f}s")
+        
+        # Read the existing file
+        rb = xlrd.open_workbook(file_path, formatting_info=True)
     
-    # Update the cells
-    ws.write(current_row, 0, date)  # Date in Column A (0)
-    ws.write(current_row, 1, bill_no)   # Column B (1) - Bill No
-    ws.write(current_row, 2, cheque_no) # Column C (2) - Cheque No
+        # Find the correct sheet for this employee
+        sheet_index, sheet = find_employee_sheet_xls(rb, employee_accountNo, file_path)
     
-    if interest is not None:
-        ws.write(current_row, 7, interest)  # Interest in Column H (7)
+        # Find 4 consecutive empty rows
+        current_row = find_personal_account_entry_row_xls(sheet)
+    
+        if current_row is None:
+            raise ValueError(f"Could not find 4 consecutive empty rows in personal account file for {employee_name}")
+    
+        # Create a copy of the workbook for writing
+        wb = copy(rb)
+        ws = wb.get_sheet(sheet_index)  # Use the found sheet index
+    
+        # Update the cells
+        ws.write(current_row, 0, date)  # Date in Column A (0)
+        ws.write(current_row, 1, bill_no)   # Column B (1) - Bill No
+        ws.write(current_row, 2, cheque_no) # Column C (2) - Cheque No
+    
+        if interest is not None:
+            ws.write(current_row, 7, interest)  # Interest in Column H (7)
         
-    if capital is not None:
-        ws.write(current_row, 8, capital)  # Capital in Column I (8)
+        if capital is not None:
+            ws.write(current_row, 8, capital)  # Capital in Column I (8)
 
-    if description is not None:
-        ws.write(current_row, 4, description)  # Description in Column E (4)
+        if description is not None:
+            ws.write(current_row, 4, description)  # Description in Column E (4)
     
-    # Save the file
-    wb.save(file_path)
+        # Save the file through a temporary file, like the .xlsx operations
+        replace_file_atomically(file_path, wb.save)
     
     return current_row
 
@@ -116,7 +167,7 @@ def perform_personal_account_update_xls(file_path: str, employee_name: str, empl
 
 
 
-def perform_personal_account_update(workbook, file_path:str, employee_name: str, employee_accountNo: str, institution_name: str, date: str, capital: float = None, interest: float = None, description: str = None, bill_no: str = "BS", cheque_no: str = "") -> int:
+def perform_personal_account_update(workbook, file_path:str, employee_name: str, employee_accountNo: str, institution_name: str, date: str, capital: float = None, interest: float = None, description: str = None, bill_no: str = "BS", cheque_no: str = "", search_from_row: int = 1) -> int:
     """
     Separated personal account update logic to work with atomic operations
     
@@ -129,72 +180,83 @@ def perform_personal_account_update(workbook, file_path:str, employee_name: str,
         capital (float, optional): Capital amount. Defaults to None.
         interest (float, optional): Interest amount. Defaults to None.
         description (str, optional): Description for the entry. Defaults to None.
+        search_from_row (int, optional): Row known to be at or before the next free rows. Defaults to 1.
         
     Returns:
         int: The row number that was updated
     """
     
     # Find the correct sheet for this employee
-    ws = find_employee_sheet(workbook, employee_accountNo)
+    ws = find_employee_sheet(workbook, employee_accountNo, file_path)
     
     # Find 4 consecutive empty rows
-    current_row = None
-    empty_rows_count = 0
-    first_empty_row = None
-    
-    for row in range(1, ws.max_row + 100):  # +100 to ensure we check enough rows
-        # Check if current row is empty in columns A, H, and I
-        date_cell = ws.cell(row=row, column=1)  # Column A
-        interest_cell = ws.cell(row=row, column=8)  # Column H
-        capital_cell = ws.cell(row=row, column=9)  # Column I
-        
-        is_row_empty = all(
-            cell.value in (None, "") 
-            for cell in [date_cell, interest_cell, capital_cell]
-        )
-        
-        if is_row_empty:
-            if empty_rows_count == 0:
-                # Remember the first empty row of the sequence
-                first_empty_row = row
-            empty_rows_count += 1
-            
-            if empty_rows_count >= 4:
-                current_row = first_empty_row
-                break
-        else:
-            # Reset counter if we find a non-empty row
-            empty_rows_count = 0
-            first_empty_row = None
+    current_row = find_personal_account_entry_row(ws, search_from_row)
     
     if current_row is None:
         raise ValueError(f"Could not find 4 consecutive empty rows in personal account file for {employee_name}")
     
-        
+    write_personal_account_entry(ws, current_row, date, capital, interest, description, bill_no, cheque_no)
+    
+    return current_row
+
+
+
+def write_personal_account_entry(ws, row: int, date: str, capital: float = None, interest: float = None, description: str = None, bill_no: str = "BS", cheque_no: str = ""):
+    """
+    Write a payment entry into a row of an employee sheet
+    
+    Args:
+        ws: The employee worksheet (or a SheetOverlay of it)
+        row (int): The row to write
+        date (str): Date of the payment
+        capital (float, optional): Capital amount. Defaults to None.
+        interest (float, optional): Interest amount. Defaults to None.
+        description (str, optional): Description for the entry. Defaults to None.
+    """
     # Update the cells
     # Date in Column A
-    ws.cell(row=current_row, column=1).value = date
+    ws.cell(row=row, column=1).value = date
 
     # Bill No in Column B (2) - Replaces the hardcoded "BS"
-    ws.cell(row=current_row, column=2).value = bill_no
+    ws.cell(row=row, column=2).value = bill_no
     
     # Cheque No in Column C (3)
-    ws.cell(row=current_row, column=3).value = cheque_no
+    ws.cell(row=row, column=3).value = cheque_no
     
     # Interest in Column H (if provided)
     if interest is not None:
-        ws.cell(row=current_row, column=8).value = interest
+        ws.cell(row=row, column=8).value = interest
         
     # Capital in Column I (if provided)
     if capital is not None:
-        ws.cell(row=current_row, column=9).value = capital
+        ws.cell(row=row, column=9).value = capital
     
     if description is not None:
-        ws.cell(row=current_row, column=4).value = description
-    # Updating column 2 with the word BS
-   
+        ws.cell(row=row, column=4).value = description
+
+
+
+def summarize_personal_account(workbook, file_path: str, employee_accountNo: str, written_row: int):
+    """
+    Compute the account summary (capital limit and next free row) after an entry was written
     
-    return current_row
+    Args:
+        workbook: The openpyxl workbook object, loaded with formulas
+        file_path (str): Path to the personal account file
+        employee_accountNo (str): Account number of the employee
+        written_row (int): The row the entry was written to
+        
+    Returns:
+        dict: limit_row, limit and next_free_row, or None if the summary could not be computed
+    """
+    try:
+        ws = find_employee_sheet(workbook, employee_accountNo, file_path)
+        limit_row, limit = compute_capital_limit(ws)
+        next_free_row = find_personal_account_entry_row(ws, written_row + 1)
+        return {"limit_row": limit_row, "limit": limit, "next_free_row": next_free_row}
+    except Exception as e:
+        logger.warning(f"Could not compute account summary for {employee_accountNo}: {str(e)}")
+        return None
 
 
 
@@ -225,11 +287,22 @@ def update_personal_account(employee_name: str, employee_accountNo: str, institu
         
         logger.info(f"The file path of the employee is {file_path}")
         
+        # Old format files are migrated to .xlsx once, on their first update
+        file_path = resolve_xls_personal_account_file(file_path)
+        
         # Determine file type and use appropriate handler
         if file_path.lower().endswith('.xlsx'):
             logger.info("Processing .xlsx file with openpyxl")
+            # Start the row search where the last update left off, when the file has not changed since
+            summary = get_account_summary(file_path, employee_accountNo)
+            search_from_row = summary["next_free_row"] if summary and summary["next_free_row"] else 1
+            file_stamp = get_file_stamp(file_path)
+            
             # Use existing atomic operations for .xlsx files
-            with atomic_excel_operation(file_path) as workbook:
+            committed = {}
+            with atomic_excel_operation(file_path, on_commit=lambda stamp: committed.update(stamp=stamp, directory_mtime_ns=get_directory_mtime_ns(file_path))) as workbook:
+                # Read under the file lock, before the replace touches the folder
+                directory_mtime_ns = get_directory_mtime_ns(file_path)
                 current_row = perform_personal_account_update(
                     workbook=workbook, 
                     file_path=file_path,  
@@ -241,13 +314,26 @@ def update_personal_account(employee_name: str, employee_accountNo: str, institu
                     interest=interest,
                     description=description,
                     bill_no=bill_no,
-                    cheque_no=cheque_no
+                    cheque_no=cheque_no,
+                    search_from_row=search_from_row
                 )
+                account_summary = summarize_personal_account(workbook, file_path, employee_accountNo, current_row)
+            
+            # The replace renamed a temporary file in the folder; the sheet tags are unchanged
+            refresh_personal_account_directory_index(file_path, directory_mtime_ns, committed.get("directory_mtime_ns"))
+            refresh_employee_sheet_index(file_path, file_stamp, committed.get("stamp"))
+            
+            # Stamped with the file as saved under the lock, not as found now
+            if account_summary is not None and committed.get("stamp"):
+                store_account_summary(file_path, employee_accountNo, stamp=committed["stamp"], **account_summary)
+            else:
+                discard_account_summaries(file_path)
         elif file_path.lower().endswith('.xls'):
             logger.info("Processing .xls file with xlrd/xlwt")
             current_row = perform_personal_account_update_xls(
                 file_path, 
                 employee_name, 
+                employee_accountNo,
                 date, 
                 capital, 
                 interest,
@@ -295,4 +381,369 @@ def update_personal_account(employee_name: str, employee_accountNo: str, institu
         return {
             "success": False,
             "error": error_message
-        }
\ No newline at end of file
+        }
+
+
+def check_entry_capital_limit(ws, entry: dict):
+    """
+    Validate the capital of a pending entry against the limit (Column K) of its
+    sheet as loaded, so earlier entries of the same batch that are not saved
+    yet are taken into account.
+    
+    Args:
+        ws: The employee worksheet loaded with formulas, or a SheetOverlay of it
+        entry (dict): The entry, as taken by update_personal_accounts_batch
+        
+    Raises:
+        ValueError: If the capital exceeds the limit or the limit cannot be read
+    """
+    capital = entry["capital"]
+    
+    if capital is None or float(capital) <= 0:
+        return
+    
+    employee_name = entry["employee_name"]
+    logger.info(f"Validating capital limit for {employee_name} ({entry['employee_accountNo']}) - Amount: {capital}")
+    
+    try:
+        current_row, limit_float = compute_capital_limit(ws)
+    except UnsupportedFormulaError:
+        raise
+    except ValueError:
+        raise ValueError(f"Could not find available rows to validate limit for {employee_name}")
+    
+    logger.info(f"Row {current_row} Limit: {limit_float}, Requested Capital: {capital}")
+    
+    if limit_float < float(capital):
+        raise ValueError(
+            f"Capital limit reached! Limit is {limit_float}, but attempted to pay {capital}."
+        )
+
+
+
+def _update_personal_account_file(file_path: str, entries: list, check_capital_limit: bool) -> list:
+    """
+    Apply the entries of one .xlsx personal account file in a single atomic operation.
+    Entries are appended in order, each sheet continuing below its previous entry.
+    An entry that fails validation or has no free rows is left out, the others are still written.
+    
+    Returns:
+        list: One result per entry, in the order given
+    """
+    results = []
+    search_from_rows = {}  # account number -> row the next search of its sheet starts at
+    written_rows = {}  # account number -> last row written to its sheet
+    account_summaries = {}
+    
+    file_stamp = get_file_stamp(file_path)
+    
+    committed = {}
+    with atomic_excel_operation(file_path, on_commit=lambda stamp: committed.update(stamp=stamp, directory_mtime_ns=get_directory_mtime_ns(file_path))) as workbook:
+        # Read under the file lock, before the replace touches the folder
+        directory_mtime_ns = get_directory_mtime_ns(file_path)
+        
+        # Rows planned on exactly this file content are written as planned, without searching or validating again
+        use_plans = all(entry.get("plan") for entry in entries) and get_file_stamp(file_path) == entries[0]["plan"]["file_stamp"]
+        if not use_plans and any(entry.get("plan") for entry in entries):
+            logger.info(f"{file_path} changed since the batch was planned, searching the rows again")
+        
+        for entry in entries:
+            employee_name = entry["employee_name"]
+            account_key = str(entry["employee_accountNo"]).strip()
+            
+            logger.info(f"Personal Account Update Request - Employee: {employee_name}, Bill No: {entry['bill_no']}, Cheque No: {entry['cheque_no']} (batched in {file_path})")
+            
+            if use_plans:
+                current_row = entry["plan"]["row"]
+                write_personal_account_entry(
+                    workbook[entry["plan"]["sheet_title"]],
+                    current_row,
+                    date=entry["date"],
+                    capital=entry["capital"],
+                    interest=entry["interest"],
+                    description=entry["description"],
+                    bill_no=entry["bill_no"],
+                    cheque_no=entry["cheque_no"]
+                )
+            else:
+                if check_capital_limit and entry["capital"]:
+                    try:
+                        check_entry_capital_limit(find_employee_sheet(workbook, entry["employee_accountNo"], file_path), entry)
+                    except ValueError as ve:
+                        logger.warning(f"Validation Failed for {employee_name}: {str(ve)}")
+                        results.append({"success": False, "error": str(ve), "validation_failed": True})
+                        continue
+                
+                if account_key not in search_from_rows:
+                    summary = get_account_summary(file_path, account_key)
+                    search_from_rows[account_key] = summary["next_free_row"] if summary and summary["next_free_row"] else 1
+                
+                try:
+                    current_row = perform_personal_account_update(
+                        workbook=workbook,
+                        file_path=file_path,
+                        employee_name=employee_name,
+                        employee_accountNo=entry["employee_accountNo"],
+                        institution_name=entry["institution_name"],
+                        date=entry["date"],
+                        capital=entry["capital"],
+                        interest=entry["interest"],
+                        description=entry["description"],
+                        bill_no=entry["bill_no"],
+                        cheque_no=entry["cheque_no"],
+                        search_from_row=search_from_rows[account_key]
+                    )
+                except ValueError as ve:
+                    # Raised before any cell of the entry was written
+                    logger.error(f"Validation error updating personal account for {employee_name}: {str(ve)}")
+                    results.append({"success": False, "error": str(ve)})
+                    continue
+            
+            # Every row before the written one was already searched
+            search_from_rows[account_key] = current_row + 1
+            written_rows[account_key] = current_row
+            
+            results.append({
+                "success": True,
+                "message": f"Successfully updated personal account for {employee_name} at row {current_row}",
+                "row_updated": current_row,
+                "file_path": file_path
+            })
+        
+        for account_key, written_row in written_rows.items():
+            account_summaries[account_key] = summarize_personal_account(workbook, file_path, account_key, written_row)
+    
+    # The replace renamed a temporary file in the folder; the sheet tags are unchanged
+    refresh_personal_account_directory_index(file_path, directory_mtime_ns, committed.get("directory_mtime_ns"))
+    refresh_employee_sheet_index(file_path, file_stamp, committed.get("stamp"))
+    
+    # Stamped with the file as saved under the lock, not as found now
+    if committed.get("stamp") and all(account_summary is not None for account_summary in account_summaries.values()):
+        for account_key, account_summary in account_summaries.items():
+            store_account_summary(file_path, account_key, stamp=committed["stamp"], **account_summary)
+    else:
+        discard_account_summaries(file_path)
+    
+    return results
+
+
+
+def _plan_personal_account_file(file_path: str, entries: list) -> list:
+    """
+    Plan the entries of one .xlsx personal account file on the cached workbook,
+    with the writes of earlier entries kept in sheet overlays, so nothing is changed.
+    
+    Returns:
+        list: One plan result per entry, in the order given
+    """
+    results = []
+    overlays = {}  # sheet title -> SheetOverlay with the planned entries
+    search_from_rows = {}  # sheet title -> row the next search of the sheet starts at
+    
+    with cached_workbook(file_path) as workbook:
+        file_stamp = get_file_stamp(file_path)
+        
+        for entry in entries:
+            employee_name = entry["employee_name"]
+            
+            try:
+                ws = find_employee_sheet(workbook, entry["employee_accountNo"], file_path)
+                overlay = overlays.setdefault(ws.title, SheetOverlay(ws))
+                
+                if entry["capital"]:
+                    check_entry_capital_limit(overlay, entry)
+                
+                if ws.title not in search_from_rows:
+                    summary = get_account_summary(file_path, entry["employee_accountNo"])
+                    search_from_rows[ws.title] = summary["next_free_row"] if summary and summary["next_free_row"] else 1
+                
+                row = find_personal_account_entry_row(overlay, search_from_rows[ws.title])
+                if row is None:
+                    raise ValueError(f"Could not find 4 consecutive empty rows in personal account file for {employee_name}")
+            except ValueError as ve:
+                results.append({"success": False, "error": str(ve)})
+                continue
+            
+            write_personal_account_entry(overlay, row, entry["date"], entry["capital"], entry["interest"], entry["description"], entry["bill_no"], entry["cheque_no"])
+            search_from_rows[ws.title] = row + 1
+            
+            results.append({
+                "success": True,
+                "plan": {"file_path": file_path, "file_stamp": file_stamp, "sheet_title": ws.title, "row": row}
+            })
+    
+    return results
+
+
+
+def _check_personal_account_file_xls(file_path: str, entries: list) -> list:
+    """
+    Check, read-only, that the entries of a file kept in .xls format can be
+    written: their sheet exists and has a free row. They are not planned, the
+    .xls update looks the row up again when writing.
+    
+    Returns:
+        list: One result per entry, success with plan None, or success False and the error
+    """
+    rb = xlrd.open_workbook(file_path)
+    results = []
+    
+    for entry in entries:
+        try:
+            _, sheet = find_employee_sheet_xls(rb, entry["employee_accountNo"], file_path)
+        except ValueError as ve:
+            results.append({"success": False, "error": str(ve)})
+            continue
+        
+        if find_personal_account_entry_row_xls(sheet) is None:
+            results.append({"success": False, "error": f"Could not find 4 consecutive empty rows in personal account file for {entry['employee_name']}"})
+            continue
+        
+        results.append({"success": True, "plan": None})
+    
+    return results
+
+
+
+def plan_personal_account_entries(entries: list) -> list:
+    """
+    Work out, without writing anything, where each batch entry goes: its file,
+    sheet and row, after checking its capital against the limit (Column K).
+    Earlier entries of the batch are taken into account for both. .xls files
+    are migrated to .xlsx first (see resolve_xls_personal_account_file); entries
+    in files kept in .xls format are checked read-only for their sheet and a
+    free row, and are written one by one without a plan.
+    
+    Args:
+        entries (list): Entry dicts as taken by update_personal_accounts_batch
+        
+    Returns:
+        list: One result per entry, in the original order: success and the plan
+            (file_path, file_stamp, sheet_title and row, None for files kept in .xls
+            format), or success False and the error
+    """
+    results = [None] * len(entries)
+    files = {}
+    
+    for position, entry in enumerate(entries):
+        try:
+            file_path = find_entry_personal_account_file(entry)
+        except FileNotFoundError as fe:
+            results[position] = {"success": False, "error": f"Account file not found: {str(fe)}"}
+            continue
+        
+        try:
+            file_path = resolve_xls_personal_account_file(file_path)
+        except Exception as e:
+            results[position] = {"success": False, "error": f"Error migrating personal account file {file_path}: {str(e)}"}
+            continue
+        
+        files.setdefault(file_path, []).append(position)
+    
+    for file_path, positions in files.items():
+        plan_file = _plan_personal_account_file if file_path.lower().endswith('.xlsx') else _check_personal_account_file_xls
+        try:
+            file_results = plan_file(file_path, [entries[position] for position in positions])
+        except Exception as e:
+            error_message = f"Error reading personal account file {file_path}: {str(e)}"
+            logger.error(error_message)
+            file_results = [{"success": False, "error": error_message} for _ in positions]
+        
+        for position, result in zip(positions, file_results):
+            results[position] = result
+    
+    return results
+
+
+
+def update_personal_accounts_batch(entries: list, check_capital_limit: bool = False) -> list:
+    """
+    Updates the personal accounts of several payments, opening and saving each
+    .xlsx file once. Entries are grouped by resolved file, every file is updated
+    in one atomic operation with its entries appended in the order given, so an
+    employee paid twice gets two consecutive entries. Entries in .xls files or
+    whose file cannot be found are handled one by one like update_personal_account.
+    
+    Args:
+        entries (list): Entry dicts with employee_name, employee_accountNo, institution_name,
+            date, capital, interest, description, bill_no and cheque_no, and optionally
+            the plan made for the entry by plan_personal_account_entries. Planned entries
+            are written to their planned rows when the file has not changed since.
+        check_capital_limit (bool, optional): Validate each capital against the limit
+            (Column K) first, counting the earlier entries of the batch. Defaults to False.
+        
+    Returns:
+        list: One result per entry, in the original order, shaped like the result of
+            update_personal_account. Entries that failed the capital limit check are
+            not written and their result has validation_failed set.
+    """
+    results = [None] * len(entries)
+    files = {}
+    
+    for position, entry in enumerate(entries):
+        if entry.get("plan"):
+            files.setdefault(entry["plan"]["file_path"], []).append(position)
+            continue
+        
+        try:
+            file_path = find_entry_personal_account_file(entry)
+            file_path = resolve_xls_personal_account_file(file_path)
+        except Exception:
+            # Reported by the single entry update below
+            file_path = None
+        
+        if file_path is not None and file_path.lower().endswith('.xlsx'):
+            files.setdefault(file_path, []).append(position)
+            continue
+        
+        if check_capital_limit and entry["capital"]:
+            try:
+                validate_capital_limit_xlsx(
+                    employee_name=entry["employee_name"],
+                    institution_name=entry["institution_name"],
+                    acc_no=entry["employee_accountNo"],
+                    capital=entry["capital"]
+                )
+            except ValueError as ve:
+                results[position] = {"success": False, "error": str(ve), "validation_failed": True}
+                continue
+            except FileNotFoundError as fe:
+                results[position] = {"success": False, "error": f"Account file not found: {str(fe)}", "validation_failed": True}
+                continue
+        
+        results[position] = update_personal_account(
+            employee_name=entry["employee_name"],
+            employee_accountNo=entry["employee_accountNo"],
+            institution_name=entry["institution_name"],
+            date=entry["date"],
+            capital=entry["capital"],
+            interest=entry["interest"],
+            description=entry["description"],
+            bill_no=entry["bill_no"],
+            cheque_no=entry["cheque_no"]
+        )
+    
+    for file_path, positions in files.items():
+        logger.info(f"Updating {len(positions)} personal account entries in {file_path} with one save")
+        
+        try:
+            file_results = _update_personal_account_file(file_path, [entries[position] for position in positions], check_capital_limit)
+        except ValueError as ve:
+            error_message = str(ve)
+            logger.error(f"Validation error updating personal accounts in {file_path}: {error_message}")
+            file_results = [{"success": False, "error": error_message} for _ in positions]
+        except FileNotFoundError as fe:
+            error_message = f"File not found: {str(fe)}"
+            logger.error(f"File error updating personal accounts in {file_path}: {error_message}")
+            file_results = [{"success": False, "error": error_message} for _ in positions]
+        except Exception as e:
+            error_message = f"Error updating personal accounts in {file_path}: {str(e)}"
+            logger.error(error_message)
+            import traceback
+            logger.error(traceback.format_exc())
+            file_results = [{"success": False, "error": error_message} for _ in positions]
+        
+        for position, result in zip(positions, file_results):
+            results[position] = result
+    
+    return results
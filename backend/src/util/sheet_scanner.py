@@ -0,0 +1,143 @@
+from openpyxl.utils import get_column_letter
+
+
+def iter_row_values(ws, min_col: int, max_col: int, min_row: int, max_row: int):
+    """
+    Stream the values of columns min_col to max_col for rows min_row to max_row.
+
+    Rows are read with iter_rows(values_only=True), which streams on read_only
+    worksheets. Rows past the last row of the sheet are yielded as empty without
+    touching the worksheet, so scanning ahead never creates cells.
+
+    Args:
+        ws: The openpyxl worksheet (regular or read_only)
+        min_col (int): First column to read
+        max_col (int): Last column to read
+        min_row (int): First row to read
+        max_row (int): Last row to read
+
+    Yields:
+        tuple: (row number, tuple of values)
+    """
+    row = min_row
+    last_row = min(ws.max_row or 0, max_row)
+
+    if row <= last_row:
+        for values in ws.iter_rows(min_row=row, max_row=last_row, min_col=min_col, max_col=max_col, values_only=True):
+            yield row, values
+            row += 1
+
+    empty = (None,) * (max_col - min_col + 1)
+    while row <= max_row:
+        yield row, empty
+        row += 1
+
+
+def find_empty_run(rows, run_length: int):
+    """
+    Find the first run of run_length consecutive empty rows
+
+    Args:
+        rows: Iterable of (row number, is_empty) in row order
+        run_length (int): Number of consecutive empty rows required
+
+    Returns:
+        int: The first row of the run, or None if there is none
+    """
+    empty_count = 0
+    first_empty_row = None
+
+    for row, is_empty in rows:
+        if is_empty:
+            if empty_count == 0:
+                first_empty_row = row
+            empty_count += 1
+
+            if empty_count >= run_length:
+                return first_empty_row
+        else:
+            empty_count = 0
+            first_empty_row = None
+
+    return None
+
+
+class _OverlayCell:
+    """
+    Cell of a SheetOverlay: reads fall through to the worksheet until the cell is written
+    """
+
+    def __init__(self, overlay, row: int, column: int):
+        self._overlay = overlay
+        self.row = row
+        self.column = column
+
+    @property
+    def coordinate(self) -> str:
+        return f"{get_column_letter(self.column)}{self.row}"
+
+    @property
+    def value(self):
+        return self._overlay.value(self.row, self.column)
+
+    @value.setter
+    def value(self, value):
+        self._overlay.values[(self.row, self.column)] = value
+
+
+class _OverlayWorkbook:
+    """
+    The overlay's workbook as seen by formulas: its own title resolves to the overlay
+    """
+
+    def __init__(self, overlay):
+        self._overlay = overlay
+
+    def __getitem__(self, title: str):
+        if title == self._overlay.title:
+            return self._overlay
+        return self._overlay.worksheet.parent[title]
+
+
+class SheetOverlay:
+    """
+    Pending writes on top of a worksheet, to plan several appends without
+    changing the worksheet (e.g. a cached workbook that must stay untouched).
+
+    Supports what the position scans and FormulaEvaluator use: title, parent,
+    max_row, cell(row, column).value (read and write) and
+    iter_rows(..., values_only=True), all seeing the pending writes.
+    """
+
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+        self.title = worksheet.title
+        self.parent = _OverlayWorkbook(self)
+        self.values = {}  # (row, column) -> pending value
+
+    @property
+    def max_row(self) -> int:
+        return max([self.worksheet.max_row or 0] + [row for row, _ in self.values])
+
+    def value(self, row: int, column: int):
+        if (row, column) in self.values:
+            return self.values[(row, column)]
+        if row > (self.worksheet.max_row or 0):
+            # Past the end of the sheet, without creating the cell
+            return None
+        return self.worksheet.cell(row=row, column=column).value
+
+    def cell(self, row: int, column: int) -> _OverlayCell:
+        return _OverlayCell(self, row, column)
+
+    def iter_rows(self, min_row: int, max_row: int, min_col: int, max_col: int, values_only: bool = True):
+        if not values_only:
+            raise ValueError("SheetOverlay only iterates values")
+
+        written_rows = {row for row, _ in self.values}
+        columns = range(min_col, max_col + 1)
+
+        for row, values in iter_row_values(self.worksheet, min_col, max_col, min_row, max_row):
+            if row in written_rows:
+                values = tuple(self.values.get((row, column), value) for column, value in zip(columns, values))
+            yield values
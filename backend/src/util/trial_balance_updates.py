@@ -6,6 +6,9 @@ from xlutils.copy import copy
 import logging
 from dotenv import load_dotenv
 from util.atomic_excel_operations import atomic_excel_operation  # Import our atomic operations
+from util.sheet_scanner import iter_row_values, find_empty_run
+from util.xlsx_patch import patch_xlsx_sheets, PatchConflict
+from util.file_locks import file_lock
 
 load_dotenv()
 
@@ -21,6 +24,22 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+def find_trial_balance_append_row(ws, start_row: int = 1):
+    """
+    Find the first row of the first run of 5 consecutive empty cells in column A
+    
+    Args:
+        ws: The openpyxl worksheet to scan
+        start_row (int, optional): Row to start scanning from. Defaults to 1.
+        
+    Returns:
+        int: The first empty row of the run, or None if no run was found
+    """
+    # Column A of the rows up to 9 past the end of the sheet
+    rows = iter_row_values(ws, 1, 1, start_row, ws.max_row + 9)
+    return find_empty_run(((row, values[0] in (None, "")) for row, values in rows), 5)
+
+
 def perform_interest_trial_balance_update(workbook, employee_name: str, employee_accountNo: str, institution_name: str, date: str, capital: float = None, interest: float = None):
     """
     Update interest trial balance worksheet logic
@@ -49,24 +68,7 @@ def perform_interest_trial_balance_update(workbook, employee_name: str, employee
     ws = workbook[INTEREST_WORKSHEET]
     
     # Find 5 consecutive empty rows and select the row before the first empty row
-    target_row = None
-    empty_rows_count = 0
-    first_empty_row = None
-    
-    for row in range(1, ws.max_row + 10):  # +10 to ensure we check enough rows
-        date_cell = ws.cell(row=row, column=1)  # Column A
-        
-        if date_cell.value in (None, ""):
-            if empty_rows_count == 0:
-                first_empty_row = row
-            empty_rows_count += 1
-            
-            if empty_rows_count >= 5:
-                target_row = first_empty_row
-                break
-        else:
-            empty_rows_count = 0
-            first_empty_row = None
+    target_row = find_trial_balance_append_row(ws)
     
     if target_row is None:
         raise ValueError("Could not find 5 consecutive empty rows for interest trial balance update")
@@ -145,24 +147,7 @@ def perform_capital_trial_balance_update(workbook, employee_name: str, employee_
     ws = workbook[CAPITAL_WORKSHEET]
     
     # Find 5 consecutive empty rows and select the row before the first empty row
-    target_row = None
-    empty_rows_count = 0
-    first_empty_row = None
-    
-    for row in range(1, ws.max_row + 10):  # +10 to ensure we check enough rows
-        date_cell = ws.cell(row=row, column=1)  # Column A
-        
-        if date_cell.value in (None, ""):
-            if empty_rows_count == 0:
-                first_empty_row = row
-            empty_rows_count += 1
-            
-            if empty_rows_count >= 5:
-                target_row = first_empty_row
-                break
-        else:
-            empty_rows_count = 0
-            first_empty_row = None
+    target_row = find_trial_balance_append_row(ws)
     
     if target_row is None:
         raise ValueError("Could not find 5 consecutive empty rows for capital trial balance update")
@@ -349,6 +334,220 @@ def update_capital_trial_balance(employee_name: str, employee_accountNo: str, in
         logger.error(error_message)
         import traceback
         logger.error(traceback.format_exc())
+        return {
+            "success": False,
+            "error": error_message
+        }
+
+
+def group_trial_balance_entries(entries: list) -> tuple:
+    """
+    Sum capital and interest amounts per date, keeping the order in which dates first appear
+    
+    Args:
+        entries (list): Dicts with date, capital and interest
+        
+    Returns:
+        tuple: (capital_totals, interest_totals) dicts of date -> summed amount, zero totals omitted
+    """
+    capital_totals = {}
+    interest_totals = {}
+    
+    for entry in entries:
+        date = entry.get("date")
+        capital = entry.get("capital")
+        interest = entry.get("interest")
+        
+        if capital:
+            capital_totals[date] = capital_totals.get(date, 0.0) + capital
+        if interest:
+            interest_totals[date] = interest_totals.get(date, 0.0) + interest
+    
+    return capital_totals, interest_totals
+
+
+def _add_to_amount(amount: float, sheet_title: str, date):
+    """
+    Build the patch delta adding amount to an existing column F value
+    """
+    def apply(current_amount):
+        # Convert to float, handle None or empty values
+        if current_amount is None or current_amount == "":
+            current_amount = 0.0
+        else:
+            current_amount = float(current_amount)
+        
+        logger.info(f"Updated existing entry in '{sheet_title}' for {date}: {current_amount} + {amount} = {current_amount + amount}")
+        return current_amount + amount
+    return apply
+
+
+def plan_trial_balance_totals_update(ws, totals: dict) -> tuple:
+    """
+    Work out the cell changes for summed per-date amounts in a trial balance
+    worksheet, from one streamed read of column A. Each date is either added
+    to the last entry (when the dates match) or written as a new row, exactly
+    as the single-entry updates would do one after another.
+    
+    Args:
+        ws: The openpyxl worksheet (capital or interest sheet), may be read_only
+        totals (dict): date -> amount to add in column F
+        
+    Returns:
+        tuple: (cells, results) where cells is a patch_xlsx_cells dict and results has one dict per date
+    """
+    cells = {}
+    results = []
+    
+    if not totals:
+        return cells, results
+    
+    if hasattr(ws, "reset_dimensions"):
+        # A read-only worksheet stops at its stored dimension, which other
+        # applications do not always keep up to date: read to the last row instead
+        ws.reset_dimensions()
+    
+    column_a = {row: values[0] for row, values in enumerate(ws.iter_rows(min_row=1, min_col=1, max_col=1, values_only=True), 1)}
+    last_row = max(column_a, default=0)
+    
+    def find_append_row(start_row):
+        # Same search as find_trial_balance_append_row, on column A including the planned rows
+        rows = ((row, column_a.get(row) in (None, "")) for row in range(start_row, last_row + 10))
+        return find_empty_run(rows, 5)
+    
+    target_row = find_append_row(1)
+    
+    if target_row is None:
+        raise ValueError(f"Could not find 5 consecutive empty rows in worksheet '{ws.title}'")
+    
+    for date, amount in totals.items():
+        previous_row = target_row - 1
+        previous_date = column_a.get(previous_row) if previous_row >= 1 else None
+        
+        if previous_date and str(previous_date).strip() == str(date).strip():
+            # Date matches, add to existing value in column F
+            delta = _add_to_amount(amount, ws.title, date)
+            previous = cells.get((previous_row, 6))
+            cells[(previous_row, 6)] = delta if previous is None else (lambda value, first=previous, second=delta: second(first(value)))
+            results.append({"date": date, "action": "updated_existing", "row_updated": previous_row, "amount": amount})
+        else:
+            cells[(target_row, 1)] = date  # Column A
+            cells[(target_row, 6)] = amount  # Column F
+            column_a[target_row] = date
+            last_row = max(last_row, target_row)
+            
+            logger.info(f"Created new entry in '{ws.title}' for {date}: {amount}")
+            results.append({"date": date, "action": "created_new", "row_updated": target_row, "amount": amount})
+            
+            # Only rows after the one just written can start the next empty run
+            next_row = find_append_row(target_row + 1)
+            if next_row is None:
+                raise ValueError(f"Could not find 5 consecutive empty rows in worksheet '{ws.title}'")
+            target_row = next_row
+    
+    return cells, results
+
+
+def _apply_cells(sheets: dict):
+    """
+    Apply planned trial balance cells through openpyxl, for files the patcher cannot rewrite.
+    The caller holds the file lock.
+    
+    Args:
+        sheets (dict): Worksheet title -> cells dict, as taken by patch_xlsx_sheets
+    """
+    with atomic_excel_operation(TRIAL_BALANCE_FILE) as workbook:
+        for sheet_title, cells in sheets.items():
+            ws = workbook[sheet_title]
+            for (row, column), value in cells.items():
+                cell = ws.cell(row=row, column=column)
+                cell.value = value(cell.value) if callable(value) else value
+
+
+def update_trial_balance_batch(entries: list) -> dict:
+    """
+    Updates both the capital and interest trial balance worksheets for a whole
+    batch of payments with a single streamed read and patch of the trial balance file.
+    Amounts are summed per date before being written.
+    
+    Args:
+        entries (list): Dicts with date, capital and interest
+        
+    Returns:
+        dict: A dictionary containing success status and per-date details for each worksheet
+    """
+    
+    try:
+        if not os.path.exists(TRIAL_BALANCE_FILE):
+            raise FileNotFoundError(f"Trial balance file not found: {TRIAL_BALANCE_FILE}")
+        
+        capital_totals, interest_totals = group_trial_balance_entries(entries)
+        
+        if not capital_totals and not interest_totals:
+            return {
+                "success": True,
+                "message": "No capital or interest to update",
+                "details": {"capital": [], "interest": []}
+            }
+        
+        logger.info(f"Updating trial balance for {len(entries)} entries: {len(capital_totals)} capital date(s), {len(interest_totals)} interest date(s)")
+        
+        # Positions are found from a streamed read and only the planned cells are
+        # patched, under one hold of the file lock
+        with file_lock(TRIAL_BALANCE_FILE):
+            workbook = load_workbook(TRIAL_BALANCE_FILE, read_only=True)
+            try:
+                if interest_totals and INTEREST_WORKSHEET not in workbook.sheetnames:
+                    raise ValueError(f"Interest worksheet '{INTEREST_WORKSHEET}' not found in trial balance file")
+                if capital_totals and CAPITAL_WORKSHEET not in workbook.sheetnames:
+                    raise ValueError(f"Capital worksheet '{CAPITAL_WORKSHEET}' not found in trial balance file")
+                
+                interest_cells, interest_results = plan_trial_balance_totals_update(workbook[INTEREST_WORKSHEET], interest_totals) if interest_totals else ({}, [])
+                capital_cells, capital_results = plan_trial_balance_totals_update(workbook[CAPITAL_WORKSHEET], capital_totals) if capital_totals else ({}, [])
+            finally:
+                workbook.close()
+            
+            sheets = {}
+            if interest_cells:
+                sheets[INTEREST_WORKSHEET] = interest_cells
+            if capital_cells:
+                sheets[CAPITAL_WORKSHEET] = capital_cells
+            try:
+                patch_xlsx_sheets(TRIAL_BALANCE_FILE, sheets)
+            except PatchConflict as pc:
+                logger.info(f"Cannot patch the trial balance ({str(pc)}), falling back to openpyxl")
+                _apply_cells(sheets)
+        
+        success_message = f"Successfully updated trial balance for {len(entries)} entries"
+        logger.info(success_message)
+        
+        return {
+            "success": True,
+            "message": success_message,
+            "details": {"capital": capital_results, "interest": interest_results}
+        }
+        
+    except ValueError as ve:
+        error_message = str(ve)
+        logger.error(f"Validation error in trial balance batch update: {error_message}")
+        return {
+            "success": False,
+            "error": error_message
+        }
+        
+    except FileNotFoundError as fe:
+        error_message = f"File not found: {str(fe)}"
+        logger.error(f"File error in trial balance batch update: {error_message}")
+        return {
+            "success": False,
+            "error": error_message
+        }
+        
+    except Exception as e:
+        error_message = f"Error updating trial balance batch: {str(e)}"
+        logger.error(error_message)
+        import traceback
+        logger.error(traceback.format_exc())
         return {
             "success": False,
             "error": error_message
@@ -1,42 +1,90 @@
 import logging
-from openpyxl import load_workbook
 from util.finding_files_sheets import find_personal_account_file, find_employee_sheet  # Import file and sheet finding functions
-import win32com.client
-import pythoncom
+from util.formula_evaluator import FormulaEvaluator, FormulaError, UnsupportedFormulaError
+from util.personal_account_summary import get_account_summary, store_account_summary
+from util.file_stamps import get_file_stamp
+from util.workbook_cache import cached_workbook
+from util.sheet_scanner import iter_row_values, find_empty_run
 
-def force_excel_recalculation(file_path):
+logger = logging.getLogger(__name__)
+
+
+def find_capital_limit_row(ws):
     """
-    Opens the Excel file using Microsoft Excel,
-    forces recalculation of formulas, and saves it.
+    Find the target row for the limit check: the first of 4 consecutive rows with an empty Column I
+
+    Returns:
+        int: The target row, or None if no such rows were found
     """
-    # Initialize COM for the current thread
-    pythoncom.CoInitialize()
-    
-    try:
-        excel = win32com.client.Dispatch("Excel.Application")
-        excel.Visible = False
-        excel.DisplayAlerts = False
+    # Column I of the rows up to 99 past the end of the sheet
+    rows = iter_row_values(ws, 9, 9, 1, ws.max_row + 99)
 
-        wb = excel.Workbooks.Open(file_path)
+    return find_empty_run(
+        ((row, values[0] is None or str(values[0]).strip() == "") for row, values in rows),
+        4
+    )
 
-        # Force full recalculation
-        excel.CalculateFull()
 
-        wb.Save()
-        wb.Close()
-        excel.Quit()
-    finally:
-        # Always uninitialize COM when done to free up resources
-        pythoncom.CoUninitialize()
+def compute_capital_limit(ws) -> tuple:
+    """
+    Compute the capital limit (Column K) at the target row of an employee sheet.
+    The sheet must be loaded with formulas (not data_only), they are evaluated in-process.
+
+    Returns:
+        tuple: (target_row, limit) where limit is a float
+
+    Raises:
+        ValueError: If no target row could be found
+        UnsupportedFormulaError: If the limit formula cannot be evaluated in-process
+    """
+    current_row = find_capital_limit_row(ws)
+
+    if current_row is None:
+        raise ValueError(f"Could not find available rows to validate limit in sheet {ws.title}")
+
+    # Read the Limit from Column K (Column 11) of the target row, or the rows just above it
+    evaluator = FormulaEvaluator(ws)
+    evaluator.evaluate_column(11, current_row)
+
+    limit_val = None
+    for limit_row in (current_row, current_row - 1, current_row - 2):
+        if limit_row < 1:
+            break
+
+        try:
+            limit_val = evaluator.cell_value(limit_row, 11)
+        except UnsupportedFormulaError as fe:
+            # The limit is unknown, never guess it
+            raise UnsupportedFormulaError(f"Cannot evaluate K{limit_row} of sheet {ws.title}: {str(fe)}")
+        except FormulaError as fe:
+            # Same as an error value (#REF!, #VALUE!...) computed by Excel, treated as 0 below
+            logger.warning(f"Could not evaluate limit formula in K{limit_row}: {str(fe)}")
+            limit_val = fe.args[0]
+            break
+
+        if limit_val is not None:
+            break
+
+    logger.info("The limit_val read from the sheet is: %s", limit_val)
+
+    # Handle conversion safely
+    try:
+        limit_float = float(limit_val) if limit_val is not None else 0.0
+    except (ValueError, TypeError):
+        # If the formula evaluates to error or string, treat limit as 0 or handle accordingly
+        limit_float = 0.0
+
+    return current_row, limit_float
 
-logger = logging.getLogger(__name__)
 
 def validate_capital_limit_xlsx(employee_name: str, institution_name: str, acc_no: str, capital: float):
     """
     Validates if the capital amount exceeds the limit in Column K.
     Finds the file and the next empty row (target row) to check the specific limit for that entry.
+    The account summary kept by the personal account updates is used when the
+    file has not changed since; the workbook is only opened otherwise.
     """
-    
+
     # 1. Early exit if no capital to validate
     if capital is None or float(capital) <= 0:
         return
@@ -48,91 +96,37 @@ def validate_capital_limit_xlsx(employee_name: str, institution_name: str, acc_n
         file_path = find_personal_account_file(employee_name, acc_no, institution_name)
     except FileNotFoundError as e:
         raise e
-    
-    force_excel_recalculation(file_path)
 
-    # 3. Load Workbook in READ-ONLY and DATA-ONLY mode
-    wb = load_workbook(file_path, data_only=True, read_only=True)
-    
-    try:
-        # 4. Find the correct sheet (Reuse existing logic)
-        ws = find_employee_sheet(wb, acc_no)
-        
-        # 5. Find the Target Row (The same logic as perform_personal_account_update)
-        current_row = None
-        empty_rows_count = 0
-        first_empty_row = None
-        
-        # We iterate to find the 4 consecutive empty rows
-        # for row in range(1, ws.max_row + 100): 
-        #     # In read_only mode, use ws.cell(row, col).value
-            
-        #     capital_val = ws.cell(row=row, column=9).value
-            
-        #     is_row_empty = all(val in (None, "") for val in [capital_val])
-            
-        #     if is_row_empty:
-        #         if empty_rows_count == 0:
-        #             first_empty_row = row
-        #         empty_rows_count += 1
-                
-        #         if empty_rows_count >= 4:
-        #             current_row = first_empty_row
-        #             break
-        #     else:
-        #         empty_rows_count = 0
-        #         first_empty_row = None
-
-        for row in range(1, ws.max_row + 100):
-
-            capital_val = ws.cell(row=row, column=9).value
-
-            is_row_empty = capital_val is None or str(capital_val).strip() == ""
-
-            if is_row_empty:
-                if empty_rows_count == 0:
-                    first_empty_row = row
-
-                empty_rows_count += 1
-
-                if empty_rows_count >= 4:
-                    current_row = first_empty_row
-                    break
-
-            else:
-                empty_rows_count = 0
-                first_empty_row = None
-
-        if current_row is None:
-            raise ValueError(f"Could not find available rows to validate limit for {employee_name}")
-
-        # 6. Read the Limit from Column K (Column 11) of the target row
-        limit_val = ws.cell(row=current_row, column=11).value
-
-        if limit_val is None:
-            limit_val = ws.cell(row=current_row - 1, column=11).value
-
-        if limit_val is None:
-            limit_val = ws.cell(row=current_row - 2, column=11).value
-
-
-        logger.info("The limit_val read from the sheet is: %s", limit_val)
-        
-        # Handle conversion safely
-        try:
-            limit_float = float(limit_val) if limit_val is not None else 0.0
-        except (ValueError, TypeError):
-            # If the formula evaluates to error or string, treat limit as 0 or handle accordingly
-            limit_float = 0.0
-
-        logger.info(f"Row {current_row} Limit: {limit_float}, Requested Capital: {capital}")
-
-        # 7. Compare
-        if limit_float < float(capital):
-            raise ValueError(
-                f"Capital limit reached! Limit is {limit_float}, but attempted to pay {capital}."
-            )
-
-    finally:
-        # Explicitly close the read-only workbook to free memory/file handles
-        wb.close()
\ No newline at end of file
+    # 3. Answer from the account summary when it is still current
+    summary = get_account_summary(file_path, acc_no)
+
+    if summary is not None:
+        current_row, limit_float = summary["limit_row"], summary["limit"]
+        logger.info(f"Using account summary for {acc_no}: limit row {current_row}")
+    else:
+        # 4. Get the Workbook with formulas from the workbook cache (locked while
+        # in use), column K is evaluated in-process. The personal account update
+        # that follows reuses the same cached workbook.
+        with cached_workbook(file_path) as wb:
+            stamp = get_file_stamp(file_path)
+
+            # 5. Find the correct sheet (Reuse existing logic)
+            ws = find_employee_sheet(wb, acc_no, file_path)
+
+            # 6. Find the Target Row and compute its Limit
+            try:
+                current_row, limit_float = compute_capital_limit(ws)
+            except UnsupportedFormulaError:
+                raise
+            except ValueError:
+                raise ValueError(f"Could not find available rows to validate limit for {employee_name}")
+
+        store_account_summary(file_path, acc_no, limit_row=current_row, limit=limit_float, stamp=stamp)
+
+    logger.info(f"Row {current_row} Limit: {limit_float}, Requested Capital: {capital}")
+
+    # 7. Compare
+    if limit_float < float(capital):
+        raise ValueError(
+            f"Capital limit reached! Limit is {limit_float}, but attempted to pay {capital}."
+        )
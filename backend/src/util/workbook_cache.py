@@ -0,0 +1,131 @@
+import os
+import threading
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from openpyxl import load_workbook
+from util.file_locks import file_lock
+from util.file_stamps import get_file_stamp
+
+load_dotenv()
+
+# Memory budget of the workbook cache, 0 disables it
+WORKBOOK_CACHE_MAX_MB = float(os.getenv('WORKBOOK_CACHE_MAX_MB', '256'))
+# A loaded openpyxl workbook takes roughly this many times its .xlsx size in memory
+LOADED_SIZE_FACTOR = 20
+
+logger = logging.getLogger(__name__)
+
+_entries = OrderedDict()  # normalized path -> {"workbook", "stamp", "bytes"}, least recently used first
+_cached_bytes = 0
+_cache_lock = threading.Lock()
+
+
+def _cache_key(file_path: str) -> str:
+    return os.path.normcase(os.path.abspath(file_path))
+
+
+def _is_cacheable(workbook) -> bool:
+    # Images and charts keep handles into the loaded file and cannot be saved twice
+    return not any(getattr(ws, "_images", None) or getattr(ws, "_charts", None) for ws in workbook.worksheets)
+
+
+def _take(key: str):
+    global _cached_bytes
+    with _cache_lock:
+        entry = _entries.pop(key, None)
+        if entry is not None:
+            _cached_bytes -= entry["bytes"]
+        return entry
+
+
+def checkout_workbook(file_path: str) -> tuple:
+    """
+    Get a workbook (loaded with formulas) for exclusive use. The cached copy is
+    handed out when the file has not changed since it was cached; it leaves
+    the cache until checked back in, so nobody else can see half-made changes.
+    The caller must hold the file lock.
+
+    Args:
+        file_path (str): Path of the .xlsx file
+
+    Returns:
+        tuple: (workbook, stamp of the file it was loaded from)
+    """
+    key = _cache_key(file_path)
+    stamp = get_file_stamp(file_path)
+    entry = _take(key)
+
+    if entry is not None:
+        if entry["stamp"] == stamp:
+            logger.info(f"Workbook cache hit for {file_path}")
+            return entry["workbook"], stamp
+        logger.info(f"Workbook cache entry for {file_path} is stale, reloading")
+        entry["workbook"].close()
+
+    return load_workbook(file_path), stamp
+
+
+def checkin_workbook(file_path: str, workbook, stamp: dict):
+    """
+    Put a workbook back in the cache. It must match the file on disk exactly:
+    unchanged since checkout, or just saved over it (with the new stamp).
+    Least recently used workbooks are evicted to stay within WORKBOOK_CACHE_MAX_MB.
+
+    Args:
+        file_path (str): Path of the .xlsx file
+        workbook: The workbook from checkout_workbook
+        stamp (dict): Stamp of the file the workbook matches
+
+    Returns:
+        bool: True if the workbook was cached, otherwise the caller should close it
+    """
+    global _cached_bytes
+
+    size = LOADED_SIZE_FACTOR * stamp["size"]
+    budget = WORKBOOK_CACHE_MAX_MB * 1024 * 1024
+
+    if size > budget or not _is_cacheable(workbook):
+        return False
+
+    evicted = []
+    with _cache_lock:
+        previous = _entries.pop(_cache_key(file_path), None)
+        if previous is not None:
+            _cached_bytes -= previous["bytes"]
+            if previous["workbook"] is not workbook:
+                evicted.append(previous["workbook"])
+
+        while _entries and _cached_bytes + size > budget:
+            _, entry = _entries.popitem(last=False)
+            _cached_bytes -= entry["bytes"]
+            evicted.append(entry["workbook"])
+
+        _entries[_cache_key(file_path)] = {"workbook": workbook, "stamp": stamp, "bytes": size}
+        _cached_bytes += size
+
+    for old_workbook in evicted:
+        old_workbook.close()
+
+    return True
+
+
+@contextmanager
+def cached_workbook(file_path: str):
+    """
+    Locked read handle on a workbook: the file lock is held and the workbook
+    checked out for the duration, then returned to the cache unchanged.
+    The workbook must not be modified.
+
+    Usage:
+        with cached_workbook(file_path) as wb:
+            ws = find_employee_sheet(wb, acc_no, file_path)
+    """
+    with file_lock(file_path):
+        workbook, stamp = checkout_workbook(file_path)
+        try:
+            yield workbook
+        finally:
+            if not checkin_workbook(file_path, workbook, stamp):
+                workbook.close()
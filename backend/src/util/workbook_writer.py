@@ -0,0 +1,238 @@
+import os
+import time
+import queue
+import threading
+import logging
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from dotenv import load_dotenv
+from openpyxl import load_workbook
+from util.file_locks import file_lock, EXCEL_LOCK_TIMEOUT_SECONDS
+from util.file_stamps import get_file_stamp
+from util.atomic_excel_operations import save_workbook_atomically
+
+load_dotenv()
+
+# Group commit limits: at most this many jobs per save, and how long to wait for more jobs after the first
+WORKBOOK_WRITER_MAX_BATCH = int(os.getenv('WORKBOOK_WRITER_MAX_BATCH', '50'))
+WORKBOOK_WRITER_MAX_WAIT_MS = float(os.getenv('WORKBOOK_WRITER_MAX_WAIT_MS', '10'))
+# Seconds a request waits for its write: the file lock wait of the group plus its load and save
+WORKBOOK_WRITER_RESULT_TIMEOUT_SECONDS = float(os.getenv('WORKBOOK_WRITER_RESULT_TIMEOUT_SECONDS', str(2 * EXCEL_LOCK_TIMEOUT_SECONDS)))
+
+logger = logging.getLogger(__name__)
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+class WriteTimeoutError(TimeoutError):
+    """
+    Raised when a write was not saved in time. written is False when the job
+    was cancelled before it started, so it will never be saved, and None when
+    it had started and may still be saved.
+    """
+
+    def __init__(self, message: str, written):
+        super().__init__(message)
+        self.written = written
+
+
+class _WriteJob:
+    def __init__(self, apply, on_commit):
+        self.apply = apply
+        self.on_commit = on_commit
+        self.future = Future()
+        self.result = None
+
+
+class WorkbookWriter:
+    """
+    Long-lived writer of one workbook. Keeps the workbook loaded, applies the
+    submitted jobs in order on a single thread and saves them in groups: one
+    save and atomic replace for up to max_batch jobs, or for the jobs that
+    arrive within max_wait_ms of the first one.
+
+    The workbook is reloaded whenever the file changed on disk since the last
+    save (another process or an atomic_excel_operation on the same file), and
+    every group is applied and saved under the file lock.
+    """
+
+    def __init__(self, file_path: str, max_batch: int = None, max_wait_ms: float = None):
+        self.file_path = file_path
+        self.max_batch = max(1, WORKBOOK_WRITER_MAX_BATCH if max_batch is None else max_batch)
+        self.max_wait_seconds = (WORKBOOK_WRITER_MAX_WAIT_MS if max_wait_ms is None else max_wait_ms) / 1000.0
+        self._queue = queue.Queue()
+        self._workbook = None
+        self._stamp = None
+        self._thread = threading.Thread(target=self._run, name=f"workbook-writer:{os.path.basename(file_path)}", daemon=True)
+        self._thread.start()
+
+    def submit(self, apply, on_commit=None) -> Future:
+        """
+        Queue a mutation of the workbook.
+
+        Args:
+            apply (callable): Called with the workbook on the writer thread, its return value is the job result.
+                If it raises, none of its changes are saved and the future gets the exception.
+            on_commit (callable, optional): Called with the job result after the group was saved, still under the file lock
+
+        Returns:
+            Future: Resolves to the job result once the changes are saved to disk
+        """
+        job = _WriteJob(apply, on_commit)
+        self._queue.put(job)
+        return job.future
+
+    def _take_group(self) -> list:
+        group = []
+        while not group:
+            self._start(self._queue.get(), group)
+        deadline = time.monotonic() + self.max_wait_seconds
+
+        while len(group) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    self._start(self._queue.get(timeout=remaining), group)
+                else:
+                    self._start(self._queue.get_nowait(), group)
+            except queue.Empty:
+                break
+
+        return group
+
+    @staticmethod
+    def _start(job: _WriteJob, group: list):
+        # Jobs cancelled by wait_for_write while queued are dropped, the others can no longer be cancelled
+        if job.future.set_running_or_notify_cancel():
+            group.append(job)
+
+    def _run(self):
+        while True:
+            group = self._take_group()
+            try:
+                self._commit_group(group)
+            except Exception as e:
+                logger.error(f"Error committing {len(group)} jobs to {self.file_path}: {str(e)}")
+                self._unload()
+                for job in group:
+                    if not job.future.done():
+                        job.future.set_exception(e)
+
+    def _load(self):
+        stamp = get_file_stamp(self.file_path)
+        if self._workbook is None or stamp != self._stamp:
+            self._unload()
+            self._workbook = load_workbook(self.file_path)
+            self._stamp = stamp
+            logger.info(f"Loaded workbook {self.file_path} into writer")
+
+    def _unload(self):
+        if self._workbook is not None:
+            self._workbook.close()
+        self._workbook = None
+        self._stamp = None
+
+    def _apply_group(self, group: list) -> list:
+        """
+        Apply the jobs of a group to the workbook. When a job fails, its partial
+        changes are dropped by reloading the file and replaying the jobs that
+        succeeded before it.
+
+        Returns:
+            list: The jobs that succeeded, in order
+        """
+        applied = []
+
+        for job in group:
+            try:
+                job.result = job.apply(self._workbook)
+                applied.append(job)
+            except Exception as e:
+                logger.error(f"Write job on {self.file_path} failed: {str(e)}")
+                job.future.set_exception(e)
+                applied = self._replay(applied)
+
+        return applied
+
+    def _replay(self, jobs: list) -> list:
+        """
+        Reload the saved file and apply the jobs again, dropping any that now fail
+
+        Returns:
+            list: The jobs that were applied
+        """
+        while True:
+            self._unload()
+            self._load()
+
+            for position, job in enumerate(jobs):
+                try:
+                    job.result = job.apply(self._workbook)
+                except Exception as e:
+                    logger.error(f"Write job on {self.file_path} failed on replay: {str(e)}")
+                    job.future.set_exception(e)
+                    jobs = jobs[:position] + jobs[position + 1:]
+                    break
+            else:
+                return jobs
+
+    def _commit_group(self, group: list):
+        with file_lock(self.file_path) as lock_wait_seconds:
+            self._load()
+            applied = self._apply_group(group)
+
+            if not applied:
+                return
+
+            save_workbook_atomically(self._workbook, self.file_path)
+            self._stamp = get_file_stamp(self.file_path)
+            logger.info(f"Committed {len(applied)} jobs to {self.file_path} (lock wait {lock_wait_seconds:.3f}s)")
+
+            for job in applied:
+                if job.on_commit is not None:
+                    try:
+                        job.on_commit(job.result)
+                    except Exception as e:
+                        logger.warning(f"Post-commit step failed for {self.file_path}: {str(e)}")
+
+        for job in applied:
+            job.future.set_result(job.result)
+
+
+def wait_for_write(future: Future, timeout: float = None):
+    """
+    Wait for a job submitted to a WorkbookWriter. A job still queued when the
+    timeout expires is cancelled, so a request that gave up never has its write
+    saved later.
+
+    Args:
+        future (Future): The future returned by submit
+        timeout (float, optional): Seconds to wait. Defaults to WORKBOOK_WRITER_RESULT_TIMEOUT_SECONDS.
+
+    Returns:
+        The job result
+
+    Raises:
+        WriteTimeoutError: If the job was not saved in time
+    """
+    timeout = WORKBOOK_WRITER_RESULT_TIMEOUT_SECONDS if timeout is None else timeout
+
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        if future.cancel():
+            raise WriteTimeoutError(f"The workbook is busy, nothing was written after {timeout:.0f}s, try again", written=False)
+        raise WriteTimeoutError(f"The write is taking longer than {timeout:.0f}s and may still be saved, check the workbook before trying again", written=None)
+
+
+def get_workbook_writer(file_path: str) -> WorkbookWriter:
+    """
+    Get the writer of a workbook, started on first use
+    """
+    key = os.path.normcase(os.path.abspath(file_path))
+    with _writers_lock:
+        writer = _writers.get(key)
+        if writer is None:
+            writer = WorkbookWriter(file_path)
+            _writers[key] = writer
+        return writer
@@ -0,0 +1,669 @@
+import os
+import sys
+import json
+import struct
+import logging
+import argparse
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import xlrd
+from xlrd.formula import decompile_formula, FMLA_TYPE_CELL, FMLA_TYPE_SHARED
+from openpyxl import Workbook, load_workbook
+from openpyxl.utils import get_column_letter
+from openpyxl.styles import Font, PatternFill, Border, Side, Alignment, Color
+from dotenv import load_dotenv
+from util.file_locks import file_lock
+from util.atomic_excel_operations import replace_file_atomically
+from util.excel_journal import fsync_directory
+from util.formula_evaluator import FormulaEvaluator, FormulaError
+from util.employee_sheet_index import parse_account_from_j2
+
+load_dotenv()
+
+PERSONAL_ACCOUNT_ROOTPATH = os.getenv('PERSONAL_ACCOUNT_ROOTPATH')
+MANIFEST_FILE = os.getenv('XLS_MIGRATION_MANIFEST_FILEPATH') or (
+    os.path.join(PERSONAL_ACCOUNT_ROOTPATH, ".xls_migration_manifest.json") if PERSONAL_ACCOUNT_ROOTPATH else None
+)
+# Migrated .xls files are kept under their name plus this suffix, which the file search ignores
+ARCHIVED_SUFFIX = ".migrated"
+
+# BIFF8 record types read from the sheet streams
+_FORMULA_RECORD = 0x0006
+_SHRFMLA_RECORD = 0x04BC
+_EOF_RECORD = 0x000A
+_TEXP_TOKEN = 0x01
+
+# Column of the capital limit formulas in the employee sheets
+LIMIT_COLUMN = 11
+
+# BIFF8 codes of the cell formatting, by position, as openpyxl names
+_UNDERLINES = {0x00: None, 0x01: "single", 0x02: "double", 0x21: "singleAccounting", 0x22: "doubleAccounting"}
+_ESCAPEMENTS = {0: None, 1: "superscript", 2: "subscript"}
+_FILL_PATTERNS = [
+    None, "solid", "mediumGray", "darkGray", "lightGray", "darkHorizontal", "darkVertical",
+    "darkDown", "darkUp", "darkGrid", "darkTrellis", "lightHorizontal", "lightVertical",
+    "lightDown", "lightUp", "lightGrid", "lightTrellis", "gray125", "gray0625"
+]
+_BORDER_STYLES = [
+    None, "thin", "medium", "dashed", "dotted", "thick", "double", "hair", "mediumDashed",
+    "dashDot", "mediumDashDot", "dashDotDot", "mediumDashDotDot", "slantDashDot"
+]
+_HORIZONTAL_ALIGNMENTS = [None, "left", "center", "right", "fill", "justify", "centerContinuous", "distributed"]
+# Bottom is the default vertical alignment, which openpyxl writes as None
+_VERTICAL_ALIGNMENTS = ["top", "center", None, "justify", "distributed"]
+
+# Cell style attributes copied from the .xls XF records and compared after conversion
+STYLE_ATTRIBUTES = ("font", "fill", "border", "alignment")
+
+logger = logging.getLogger(__name__)
+
+
+class XlsConversionError(ValueError):
+    """
+    An .xls file could not be converted exactly, it is left as it is
+    """
+
+
+def _read_formula_tokens(book, sheet_index: int) -> dict:
+    """
+    Read the formula tokens of one sheet from its BIFF records, which xlrd
+    parses for the cached results only. The book must be opened on_demand
+    so its stream is still in memory.
+
+    Returns:
+        dict: (rowx, colx) -> formula text
+    """
+    mem = book.mem
+    position = book._sh_abs_posn[sheet_index]
+    cell_tokens = {}
+    shared_tokens = {}  # (first rowx, first colx) -> tokens of the shared formula
+
+    while position + 4 <= len(mem):
+        record_type, length = struct.unpack('<HH', mem[position:position + 4])
+        data = mem[position + 4:position + 4 + length]
+        position += 4 + length
+
+        if record_type == _EOF_RECORD:
+            break
+        if record_type == _FORMULA_RECORD:
+            rowx, colx = struct.unpack('<HH', data[0:4])
+            token_length = struct.unpack('<H', data[20:22])[0]
+            cell_tokens[(rowx, colx)] = data[22:22 + token_length]
+        elif record_type == _SHRFMLA_RECORD:
+            first_rowx, _, first_colx, _, _, token_length = struct.unpack('<HHBBxBH', data[:10])
+            shared_tokens[(first_rowx, first_colx)] = data[10:10 + token_length]
+
+    formulas = {}
+    for (rowx, colx), tokens in cell_tokens.items():
+        if tokens[:1] == bytes([_TEXP_TOKEN]) and len(tokens) == 5:
+            # Part of a shared formula, its tokens are relative to this cell
+            base = struct.unpack('<HH', tokens[1:5])
+            if base not in shared_tokens:
+                raise XlsConversionError(f"Array or table formula at {xlrd.cellname(rowx, colx)} is not supported")
+            tokens, formula_type = shared_tokens[base], FMLA_TYPE_SHARED
+        else:
+            formula_type = FMLA_TYPE_CELL
+
+        try:
+            text = decompile_formula(book, tokens, len(tokens), formula_type, browx=rowx, bcolx=colx)
+        except Exception as e:
+            raise XlsConversionError(f"Could not read the formula at {xlrd.cellname(rowx, colx)}: {str(e)}")
+
+        if not text:
+            raise XlsConversionError(f"Could not read the formula at {xlrd.cellname(rowx, colx)}")
+        formulas[(rowx, colx)] = text
+
+    return formulas
+
+
+def _color(book, colour_index: int):
+    """
+    Get the openpyxl color of a palette index, None for the automatic and system colors
+    """
+    rgb = book.colour_map.get(colour_index)
+    if rgb is None:
+        return None
+    return Color(rgb="FF%02X%02X%02X" % rgb)
+
+
+def _lookup(codes: list, code: int, label: str):
+    if code >= len(codes):
+        raise XlsConversionError(f"Unknown {label} code {code}")
+    return codes[code]
+
+
+def _xf_style(book, xf_index: int) -> dict:
+    """
+    Turn an .xls XF record into openpyxl font, fill, border and alignment objects
+    """
+    xf = book.xf_list[xf_index]
+    font = book.font_list[xf.font_index]
+
+    if font.underline_type not in _UNDERLINES or font.escapement not in _ESCAPEMENTS:
+        raise XlsConversionError(f"Unsupported font formatting in cell format {xf_index}")
+
+    background = xf.background
+    fill_type = _lookup(_FILL_PATTERNS, background.fill_pattern, "fill pattern")
+    if fill_type is None:
+        fill = PatternFill()
+    else:
+        fill = PatternFill(
+            fill_type=fill_type,
+            fgColor=_color(book, background.pattern_colour_index) or Color(),
+            bgColor=_color(book, background.background_colour_index) or Color()
+        )
+
+    border = xf.border
+    def side(line_style: int, colour_index: int) -> Side:
+        style = _lookup(_BORDER_STYLES, line_style, "border style")
+        return Side(style=style, color=_color(book, colour_index) if style else None)
+
+    alignment = xf.alignment
+    return {
+        "font": Font(
+            name=font.name,
+            size=font.height / 20,
+            bold=font.weight >= 700,
+            italic=bool(font.italic),
+            underline=_UNDERLINES[font.underline_type],
+            strike=bool(font.struck_out),
+            vertAlign=_ESCAPEMENTS[font.escapement],
+            color=_color(book, font.colour_index)
+        ),
+        "fill": fill,
+        "border": Border(
+            left=side(border.left_line_style, border.left_colour_index),
+            right=side(border.right_line_style, border.right_colour_index),
+            top=side(border.top_line_style, border.top_colour_index),
+            bottom=side(border.bottom_line_style, border.bottom_colour_index),
+            diagonal=side(border.diag_line_style, border.diag_colour_index),
+            diagonalUp=bool(border.diag_up),
+            diagonalDown=bool(border.diag_down)
+        ),
+        "alignment": Alignment(
+            horizontal=_lookup(_HORIZONTAL_ALIGNMENTS, alignment.hor_align, "horizontal alignment"),
+            vertical=_lookup(_VERTICAL_ALIGNMENTS, alignment.vert_align, "vertical alignment"),
+            textRotation=alignment.rotation,
+            wrap_text=bool(alignment.text_wrapped),
+            shrink_to_fit=bool(alignment.shrink_to_fit),
+            indent=alignment.indent_level
+        )
+    }
+
+
+def _cell_value(book, sheet, rowx: int, colx: int):
+    """
+    Get the value of an xlrd cell as it is written to openpyxl, None for empty cells
+    """
+    cell = sheet.cell(rowx, colx)
+
+    if cell.ctype in (xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK):
+        return None
+    if cell.ctype == xlrd.XL_CELL_TEXT:
+        return cell.value if cell.value != "" else None
+    if cell.ctype == xlrd.XL_CELL_DATE:
+        return xlrd.xldate.xldate_as_datetime(cell.value, book.datemode)
+    if cell.ctype == xlrd.XL_CELL_BOOLEAN:
+        return bool(cell.value)
+    if cell.ctype == xlrd.XL_CELL_ERROR:
+        return xlrd.error_text_from_code.get(cell.value, "#N/A")
+    return cell.value
+
+
+def read_xls_workbook(xls_path: str) -> list:
+    """
+    Read every sheet of an .xls file, with the formulas of formula cells
+
+    Args:
+        xls_path (str): Path of the .xls file
+
+    Returns:
+        list: Per sheet in workbook order, a dict with name, visibility, cells
+            ((row, column) -> value, 1-based, formulas as "=..."), limit_results
+            (row -> saved result of the column K formula), number_formats,
+            styles ((row, column) -> font, fill, border and alignment, for
+            formatted empty cells too), column_widths, hidden_columns,
+            row_heights, hidden_rows, freeze_panes and merged ranges
+
+    Raises:
+        XlsConversionError: If the file uses a feature that cannot be converted exactly
+    """
+    book = xlrd.open_workbook(xls_path, formatting_info=True, on_demand=True)
+    try:
+        if book.biff_version < 80:
+            raise XlsConversionError(f"Excel version {book.biff_version} files are not supported, only Excel 97-2003")
+
+        sheets = []
+        xf_styles = {}
+        for sheet_index in range(book.nsheets):
+            sheet = book.sheet_by_index(sheet_index)
+            formulas = _read_formula_tokens(book, sheet_index)
+            cells = {}
+            number_formats = {}
+            styles = {}
+            limit_results = {}
+
+            for rowx in range(sheet.nrows):
+                for colx in range(sheet.row_len(rowx)):
+                    if (rowx, colx) in formulas:
+                        value = "=" + formulas[(rowx, colx)]
+                        # The result Excel saved with the limit formula, to check the converted formula against
+                        if colx + 1 == LIMIT_COLUMN and sheet.cell_type(rowx, colx) == xlrd.XL_CELL_NUMBER:
+                            limit_results[rowx + 1] = sheet.cell_value(rowx, colx)
+                    else:
+                        value = _cell_value(book, sheet, rowx, colx)
+
+                    if value is not None:
+                        cells[(rowx + 1, colx + 1)] = value
+
+                    # Empty cells with a record of their own carry formatting, e.g. borders
+                    xf_index = sheet.cell_xf_index(rowx, colx)
+                    if xf_index not in xf_styles:
+                        xf_styles[xf_index] = _xf_style(book, xf_index)
+                    styles[(rowx + 1, colx + 1)] = xf_styles[xf_index]
+
+                    xf = book.xf_list[xf_index]
+                    number_format = book.format_map[xf.format_key].format_str
+                    if number_format and number_format != "General":
+                        number_formats[(rowx + 1, colx + 1)] = number_format
+
+            freeze_panes = None
+            if sheet.panes_are_frozen and (sheet.horz_split_pos or sheet.vert_split_pos):
+                freeze_panes = f"{get_column_letter(sheet.vert_split_pos + 1)}{sheet.horz_split_pos + 1}"
+
+            sheets.append({
+                "name": sheet.name,
+                "visibility": sheet.visibility,
+                "cells": cells,
+                "limit_results": limit_results,
+                "number_formats": number_formats,
+                "styles": styles,
+                "column_widths": {colx + 1: info.width / 256 for colx, info in sheet.colinfo_map.items()},
+                "hidden_columns": [colx + 1 for colx, info in sheet.colinfo_map.items() if info.hidden],
+                # Row heights are kept when set by hand, in points (twips / 20)
+                "row_heights": {
+                    rowx + 1: info.height / 20 for rowx, info in sheet.rowinfo_map.items()
+                    if info.height_mismatch and not info.hidden
+                },
+                "hidden_rows": [rowx + 1 for rowx, info in sheet.rowinfo_map.items() if info.hidden],
+                "freeze_panes": freeze_panes,
+                "merged": [(rlo + 1, rhi, clo + 1, chi) for rlo, rhi, clo, chi in sheet.merged_cells]
+            })
+
+        return sheets
+    finally:
+        book.release_resources()
+
+
+def build_xlsx_workbook(sheets: list) -> Workbook:
+    """
+    Build an openpyxl workbook from the sheets read by read_xls_workbook
+    """
+    workbook = Workbook()
+    workbook.remove(workbook.active)
+
+    for source in sheets:
+        ws = workbook.create_sheet(title=source["name"])
+        if source["visibility"] == 1:
+            ws.sheet_state = "hidden"
+        elif source["visibility"] == 2:
+            ws.sheet_state = "veryHidden"
+
+        for (row, column), value in source["cells"].items():
+            ws.cell(row=row, column=column).value = value
+        for (row, column), number_format in source["number_formats"].items():
+            ws.cell(row=row, column=column).number_format = number_format
+        for (row, column), style in source["styles"].items():
+            cell = ws.cell(row=row, column=column)
+            for attribute in STYLE_ATTRIBUTES:
+                setattr(cell, attribute, style[attribute])
+        for column, width in source["column_widths"].items():
+            ws.column_dimensions[get_column_letter(column)].width = width
+        for column in source["hidden_columns"]:
+            ws.column_dimensions[get_column_letter(column)].hidden = True
+        for row, height in source["row_heights"].items():
+            ws.row_dimensions[row].height = height
+        for row in source["hidden_rows"]:
+            ws.row_dimensions[row].hidden = True
+        ws.freeze_panes = source["freeze_panes"]
+        for first_row, last_row, first_column, last_column in source["merged"]:
+            ws.merge_cells(start_row=first_row, end_row=last_row, start_column=first_column, end_column=last_column)
+
+    return workbook
+
+
+def _verify_limit_results(ws, limit_results: dict):
+    """
+    Evaluate the converted column K formulas and compare them with the results saved in the .xls file
+    """
+    evaluator = FormulaEvaluator(ws)
+    evaluator.evaluate_column(LIMIT_COLUMN, max(limit_results))
+
+    for row, saved_result in limit_results.items():
+        try:
+            result = evaluator.cell_value(row, LIMIT_COLUMN)
+        except FormulaError as fe:
+            raise XlsConversionError(f"Limit formula {ws.title}!K{row} cannot be evaluated after conversion: {str(fe)}")
+
+        if not isinstance(result, (int, float)) or abs(float(result) - saved_result) > 1e-6 * max(1.0, abs(saved_result)):
+            raise XlsConversionError(f"Limit formula {ws.title}!K{row} gives {result!r} after conversion instead of {saved_result!r}")
+
+
+def _verify_layout(source: dict, ws):
+    """
+    Compare the cell styles, number formats, row heights, hidden rows and
+    columns and frozen panes of a converted sheet with the .xls sheet
+    """
+    for (row, column), style in source["styles"].items():
+        cell = ws.cell(row=row, column=column)
+        for attribute in STYLE_ATTRIBUTES:
+            if getattr(cell, attribute) != style[attribute]:
+                raise XlsConversionError(f"The {attribute} of cell {ws.title}!{cell.coordinate} differs after conversion")
+
+        number_format = source["number_formats"].get((row, column), "General")
+        if cell.number_format != number_format:
+            raise XlsConversionError(
+                f"Number format of cell {ws.title}!{cell.coordinate} differs after conversion: {number_format!r} became {cell.number_format!r}"
+            )
+
+    for row, height in source["row_heights"].items():
+        if ws.row_dimensions[row].height != height:
+            raise XlsConversionError(f"Height of row {ws.title}!{row} differs after conversion")
+    for row in source["hidden_rows"]:
+        if not ws.row_dimensions[row].hidden:
+            raise XlsConversionError(f"Row {ws.title}!{row} is no longer hidden after conversion")
+    for column in source["hidden_columns"]:
+        if not ws.column_dimensions[get_column_letter(column)].hidden:
+            raise XlsConversionError(f"Column {ws.title}!{get_column_letter(column)} is no longer hidden after conversion")
+    if ws.freeze_panes != source["freeze_panes"]:
+        raise XlsConversionError(f"Frozen panes of {ws.title} differ after conversion")
+
+
+def verify_conversion(sheets: list, xlsx_path: str):
+    """
+    Compare a written .xlsx file with the .xls sheets it was built from: sheet
+    order and names, every cell value and formula (which covers the J2
+    account tags), and the cell formatting (font, fill, border, alignment and
+    number format), row heights, hidden rows and columns and frozen panes.
+    The column K limit formulas of employee sheets are also evaluated the way
+    the capital limit check does and compared with the results Excel saved in
+    the .xls file. Page setup is not read from .xls files and is not carried over.
+
+    Raises:
+        XlsConversionError: On the first difference found
+    """
+    workbook = load_workbook(xlsx_path)
+    try:
+        if workbook.sheetnames != [source["name"] for source in sheets]:
+            raise XlsConversionError(f"Sheets differ after conversion: {workbook.sheetnames}")
+
+        for source, ws in zip(sheets, workbook.worksheets):
+            written_count = 0
+            for row in ws.iter_rows():
+                for cell in row:
+                    if cell.value is None:
+                        continue
+                    written_count += 1
+
+                    expected = source["cells"].get((cell.row, cell.column))
+                    if isinstance(expected, datetime) or isinstance(cell.value, datetime):
+                        matches = expected == cell.value
+                    elif isinstance(expected, (int, float)) and not isinstance(expected, bool):
+                        matches = isinstance(cell.value, (int, float)) and float(cell.value) == float(expected)
+                    else:
+                        matches = expected == cell.value
+
+                    if not matches:
+                        raise XlsConversionError(
+                            f"Cell {ws.title}!{cell.coordinate} differs after conversion: {expected!r} became {cell.value!r}"
+                        )
+
+            if written_count != len(source["cells"]):
+                raise XlsConversionError(f"Sheet {ws.title} has {written_count} cells after conversion instead of {len(source['cells'])}")
+
+            _verify_layout(source, ws)
+
+            if source["limit_results"] and parse_account_from_j2(ws.cell(row=2, column=10).value) is not None:
+                _verify_limit_results(ws, source["limit_results"])
+    finally:
+        workbook.close()
+
+
+def convert_xls_to_xlsx(xls_path: str, xlsx_path: str) -> dict:
+    """
+    Convert an .xls file to a new .xlsx file and verify the result by reading it back.
+    The .xlsx file is written atomically and removed again if the verification fails.
+    The caller must hold the locks of both files.
+
+    Args:
+        xls_path (str): Path of the .xls file, left unchanged
+        xlsx_path (str): Path of the .xlsx file to create
+
+    Returns:
+        dict: Number of sheets, cells and formulas converted
+
+    Raises:
+        XlsConversionError: If the file cannot be converted exactly
+    """
+    if os.path.exists(xlsx_path):
+        raise XlsConversionError(f"Cannot convert {xls_path}, {xlsx_path} already exists")
+
+    sheets = read_xls_workbook(xls_path)
+    workbook = build_xlsx_workbook(sheets)
+
+    replace_file_atomically(xlsx_path, workbook.save)
+    try:
+        verify_conversion(sheets, xlsx_path)
+    except Exception:
+        os.remove(xlsx_path)
+        raise
+
+    return {
+        "sheets": len(sheets),
+        "cells": sum(len(source["cells"]) for source in sheets),
+        "formulas": sum(
+            1 for source in sheets for value in source["cells"].values()
+            if isinstance(value, str) and value.startswith("=")
+        )
+    }
+
+
+def _manifest_key(file_path: str) -> str:
+    file_path = os.path.abspath(file_path)
+    if PERSONAL_ACCOUNT_ROOTPATH:
+        return os.path.relpath(file_path, os.path.abspath(PERSONAL_ACCOUNT_ROOTPATH))
+    return file_path
+
+
+def read_manifest() -> dict:
+    """
+    Get the recorded migrations, by .xls path relative to PERSONAL_ACCOUNT_ROOTPATH.
+    Files the migration tool could not convert are recorded with an error instead of an xlsx path.
+    """
+    if not MANIFEST_FILE:
+        return {}
+
+    try:
+        with open(MANIFEST_FILE, "r", encoding="utf-8") as manifest:
+            return json.load(manifest)
+    except FileNotFoundError:
+        return {}
+
+
+def record_migrations(records: dict):
+    """
+    Add migration records (see migrate_personal_account_file) to the manifest, by .xls key
+    """
+    if not MANIFEST_FILE or not records:
+        return
+
+    with file_lock(MANIFEST_FILE):
+        manifest = read_manifest()
+        manifest.update(records)
+        content = json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8")
+        replace_file_atomically(MANIFEST_FILE, lambda manifest_file: manifest_file.write(content))
+
+
+def migrate_personal_account_file(xls_path: str) -> dict:
+    """
+    Migrate an .xls personal account file to .xlsx once: the converted and
+    verified .xlsx file is created next to it, the .xls file is renamed with
+    ARCHIVED_SUFFIX and the mapping recorded in the manifest. From then on the
+    file search finds the .xlsx file, which takes the regular .xlsx path.
+
+    Args:
+        xls_path (str): Path of the .xls file
+
+    Returns:
+        dict: The migration record, with xls, xlsx and archived paths and the conversion counts
+
+    Raises:
+        XlsConversionError: If the file cannot be converted exactly, nothing is changed
+        FileNotFoundError: If the .xls file does not exist and was not migrated before
+    """
+    with file_lock(xls_path):
+        if not os.path.exists(xls_path):
+            # Migrated by another request while this one waited for the lock
+            migration = read_manifest().get(_manifest_key(xls_path))
+            if migration is None or "xlsx" not in migration:
+                raise FileNotFoundError(f"Personal account file not found: {xls_path}")
+            return migration
+
+        xlsx_path = os.path.splitext(xls_path)[0] + ".xlsx"
+        archived_path = xls_path + ARCHIVED_SUFFIX
+
+        with file_lock(xlsx_path):
+            counts = convert_xls_to_xlsx(xls_path, xlsx_path)
+
+        os.replace(xls_path, archived_path)
+        fsync_directory(os.path.dirname(os.path.abspath(xls_path)))
+
+        migration = {
+            "xls": _manifest_key(xls_path),
+            "xlsx": _manifest_key(xlsx_path),
+            "archived": _manifest_key(archived_path),
+            "migrated_at": datetime.now().isoformat(timespec="seconds"),
+            **counts
+        }
+        record_migrations({migration["xls"]: migration})
+
+    logger.info(f"Migrated {xls_path} to {xlsx_path} ({counts['sheets']} sheets, {counts['formulas']} formulas)")
+    return migration
+
+
+def find_xls_files(root_path: str) -> list:
+    """
+    Find the .xls files under root_path, skipping Excel's temporary owner files (~$...)
+
+    Returns:
+        list: Paths of the .xls files, sorted
+    """
+    xls_paths = []
+    for directory_path, _, file_names in os.walk(root_path):
+        for file_name in file_names:
+            if file_name.lower().endswith('.xls') and not file_name.startswith('~$'):
+                xls_paths.append(os.path.join(directory_path, file_name))
+    return sorted(xls_paths)
+
+
+def check_xls_file(xls_path: str) -> dict:
+    """
+    Convert an .xls file into a temporary folder and verify it, without changing anything
+
+    Returns:
+        dict: The conversion counts (see convert_xls_to_xlsx)
+
+    Raises:
+        XlsConversionError: If the file cannot be converted exactly
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        xlsx_path = os.path.join(temp_dir, os.path.splitext(os.path.basename(xls_path))[0] + ".xlsx")
+        with file_lock(xls_path), file_lock(xlsx_path):
+            return convert_xls_to_xlsx(xls_path, xlsx_path)
+
+
+def _migrate_tree_file(xls_path: str, check_only: bool) -> dict:
+    """
+    Migrate (or only check) one file for migrate_personal_account_tree, in a worker process
+    """
+    try:
+        if check_only:
+            return {"xls": _manifest_key(xls_path), "status": "checked", **check_xls_file(xls_path)}
+        return {"status": "migrated", **migrate_personal_account_file(xls_path)}
+    except Exception as e:
+        # Reported with the others, the file is left as it was
+        return {"xls": _manifest_key(xls_path), "status": "failed", "error": f"{type(e).__name__}: {str(e)}"}
+
+
+def migrate_personal_account_tree(root_path: str = None, workers: int = None, check_only: bool = False) -> list:
+    """
+    Migrate every .xls file under the personal account folder to .xlsx (see
+    migrate_personal_account_file), spreading the files over a process pool.
+    Files that fail are recorded in the manifest with their error and keep the .xls path.
+
+    Args:
+        root_path (str, optional): Folder to walk. Defaults to PERSONAL_ACCOUNT_ROOTPATH.
+        workers (int, optional): Number of worker processes. Defaults to the number of CPUs.
+        check_only (bool, optional): Only convert into a temporary folder and verify,
+            nothing is changed or recorded. Defaults to False.
+
+    Returns:
+        list: One result per file with its status (migrated, checked or failed), in path order
+    """
+    root_path = root_path or PERSONAL_ACCOUNT_ROOTPATH
+    if not root_path:
+        raise ValueError("PERSONAL_ACCOUNT_ROOTPATH is not set")
+
+    xls_paths = find_xls_files(root_path)
+    workers = min(workers or os.cpu_count() or 1, max(len(xls_paths), 1))
+    logger.info(f"Found {len(xls_paths)} .xls files under {root_path}, processing with {workers} workers")
+
+    if workers <= 1:
+        results = [_migrate_tree_file(xls_path, check_only) for xls_path in xls_paths]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            results = list(pool.map(_migrate_tree_file, xls_paths, [check_only] * len(xls_paths)))
+
+    failures = {
+        result["xls"]: {"xls": result["xls"], "error": result["error"], "failed_at": datetime.now().isoformat(timespec="seconds")}
+        for result in results if result["status"] == "failed"
+    }
+    if failures and not check_only:
+        record_migrations(failures)
+
+    return results
+
+
+def main(argv: list = None) -> int:
+    """
+    Command line entry point, run from backend/src:
+
+        python -m util.xls_migration [--check] [--workers N]
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m util.xls_migration",
+        description="Convert the .xls personal account files under PERSONAL_ACCOUNT_ROOTPATH to .xlsx"
+    )
+    parser.add_argument("--check", action="store_true", help="only convert into a temporary folder and verify, change nothing")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: number of CPUs)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    results = migrate_personal_account_tree(workers=args.workers, check_only=args.check)
+
+    for result in results:
+        if result["status"] == "failed":
+            print(f"FAILED   {result['xls']}: {result['error']}")
+        else:
+            print(f"{result['status'].upper():<8} {result['xls']} ({result['sheets']} sheets, {result['cells']} cells, {result['formulas']} formulas)")
+
+    failed_count = sum(1 for result in results if result["status"] == "failed")
+    print(f"{len(results) - failed_count} of {len(results)} files converted" + ("" if args.check else f", manifest: {MANIFEST_FILE}"))
+    return 1 if failed_count else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,513 @@
+import re
+import html
+import math
+import zipfile
+import posixpath
+import logging
+import xml.etree.ElementTree as ET
+from openpyxl.utils import get_column_letter, column_index_from_string
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from util.file_locks import file_lock
+from util.atomic_excel_operations import replace_file_atomically
+from util.file_stamps import get_file_stamp
+
+logger = logging.getLogger(__name__)
+
+MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PACKAGE_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+WORKBOOK_PART = "xl/workbook.xml"
+WORKBOOK_RELS_PART = "xl/_rels/workbook.xml.rels"
+SHARED_STRINGS_PART = "xl/sharedStrings.xml"
+CALC_CHAIN_PART = "xl/calcChain.xml"
+CONTENT_TYPES_PART = "[Content_Types].xml"
+
+_ATTRIBUTE_RE = re.compile(r'([\w:]+)="([^"]*)"')
+_CELL_REF_RE = re.compile(r"^([A-Z]+)(\d+)$")
+
+
+class PatchConflict(ValueError):
+    """
+    A cell did not hold the value the patch expected, nothing was written
+    """
+
+
+def _attributes(tag: str) -> dict:
+    return dict(_ATTRIBUTE_RE.findall(tag))
+
+
+def _split_ref(ref: str) -> tuple:
+    match = _CELL_REF_RE.match(ref)
+    if not match:
+        raise ValueError(f"Invalid cell reference: {ref}")
+    return int(match.group(2)), column_index_from_string(match.group(1))
+
+
+class _SheetXml:
+    """
+    Regex-level view of a worksheet part: rows and cells are located and
+    rewritten as text, so everything outside the patched rows stays byte-for-byte.
+    """
+
+    def __init__(self, xml: str):
+        self.xml = xml
+        prefix_match = re.search(r"<(\w+:)?sheetData\b", xml)
+        if prefix_match is None:
+            raise ValueError("Worksheet has no sheetData")
+        self.prefix = prefix_match.group(1) or ""
+        p = re.escape(self.prefix)
+        self.row_re = re.compile(rf"<{p}row\b[^>]*?/>|<{p}row\b[^>]*>.*?</{p}row>", re.S)
+        self.cell_re = re.compile(rf"<{p}c\b[^>]*?/>|<{p}c\b[^>]*>.*?</{p}c>", re.S)
+        self.sheet_data_re = re.compile(rf"<{p}sheetData\b[^>]*?/>|<{p}sheetData\b[^>]*>(.*?)</{p}sheetData>", re.S)
+
+    def rows(self) -> list:
+        """
+        Locate every row of sheetData, in document order
+
+        Returns:
+            list: (row number, match of its <row> element) pairs
+        """
+        sheet_data = self.sheet_data_re.search(self.xml)
+        found = []
+        row_number = 0
+        for match in self.row_re.finditer(self.xml, sheet_data.start(), sheet_data.end()):
+            open_tag = match.group(0)[:match.group(0).index(">") + 1]
+            r = _attributes(open_tag).get("r")
+            row_number = int(r) if r else row_number + 1
+            found.append((row_number, match))
+        return found
+
+
+def _element_text(fragment: str, prefix: str, name: str) -> str:
+    p = re.escape(prefix)
+    match = re.search(rf"<{p}{name}\b[^>]*?(?:/>|>(.*?)</{p}{name}>)", fragment, re.S)
+    if match is None:
+        return None
+    return html.unescape(match.group(1) or "")
+
+
+def _inline_text(fragment: str, prefix: str) -> str:
+    p = re.escape(prefix)
+    # Rich text runs are concatenated, phonetic runs (rPh) are not part of the value
+    fragment = re.sub(rf"<{p}rPh\b.*?</{p}rPh>", "", fragment, flags=re.S)
+    return "".join(html.unescape(text) for text in re.findall(rf"<{p}t\b[^>]*>(.*?)</{p}t>", fragment, re.S))
+
+
+class _SharedStrings:
+    """
+    Shared string table, only parsed when a patched cell refers to it
+    """
+
+    def __init__(self, source: zipfile.ZipFile):
+        self.source = source
+        self.strings = None
+
+    def get(self, index: int) -> str:
+        if self.strings is None:
+            self.strings = []
+            if SHARED_STRINGS_PART in self.source.namelist():
+                with self.source.open(SHARED_STRINGS_PART) as part:
+                    for _, element in ET.iterparse(part):
+                        if element.tag == f"{{{MAIN_NS}}}si":
+                            # Plain text or rich text runs, phonetic runs (rPh) are not part of the value
+                            texts = element.findall(f"{{{MAIN_NS}}}t") + element.findall(f"{{{MAIN_NS}}}r/{{{MAIN_NS}}}t")
+                            self.strings.append("".join(t.text or "" for t in texts))
+                            element.clear()
+        return self.strings[index]
+
+
+def _formula_type(cell_xml: str, prefix: str) -> str:
+    """
+    Get the t attribute of a cell's <f> element ("normal" when absent), None without a formula
+    """
+    p = re.escape(prefix)
+    match = re.search(rf"<{p}f\b([^>]*?)/?>", cell_xml)
+    if match is None:
+        return None
+    return _attributes(match.group(1)).get("t", "normal")
+
+
+def _read_cell_value(cell_xml: str, prefix: str, shared_strings: _SharedStrings):
+    """
+    Decode a cell the way openpyxl loads it without data_only: formulas read
+    as "=<formula>", numbers as int or float (dates stay serial numbers)
+
+    Raises:
+        PatchConflict: For cells of shared or array formulas, whose text is kept
+            on another cell and which cannot be rewritten one cell at a time
+    """
+    open_tag = cell_xml[:cell_xml.index(">") + 1]
+    if open_tag.endswith("/>"):
+        return None
+
+    cell_type = _attributes(open_tag).get("t", "n")
+    formula_type = _formula_type(cell_xml, prefix)
+    if formula_type in ("shared", "array"):
+        ref = _attributes(open_tag).get("r", "")
+        raise PatchConflict(f"Cell {ref} is part of a {formula_type} formula")
+
+    formula = _element_text(cell_xml, prefix, "f")
+    if formula is not None:
+        return f"={formula}"
+
+    if cell_type == "inlineStr":
+        return _inline_text(cell_xml, prefix)
+
+    value = _element_text(cell_xml, prefix, "v")
+    if value is None:
+        return None
+    if cell_type == "s":
+        return shared_strings.get(int(value))
+    if cell_type == "b":
+        return value.strip() == "1"
+    if cell_type in ("str", "e", "d"):
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+def _write_cell(ref: str, style: str, value, prefix: str) -> str:
+    """
+    Serialize a cell. Strings are written inline so the shared string table is never touched.
+    """
+    style_attr = f' s="{style}"' if style is not None else ""
+    tag = f"{prefix}c"
+
+    if value is None:
+        return f'<{tag} r="{ref}"{style_attr}/>'
+
+    if isinstance(value, bool):
+        return f'<{tag} r="{ref}"{style_attr} t="b"><{prefix}v>{int(value)}</{prefix}v></{tag}>'
+
+    if isinstance(value, (int, float)):
+        if isinstance(value, float) and not math.isfinite(value):
+            raise ValueError(f"Cannot write {value} to cell {ref}")
+        # Integral floats are written without ".0", as openpyxl does
+        text = str(int(value)) if isinstance(value, float) and value.is_integer() and abs(value) < 1e15 else repr(value)
+        return f'<{tag} r="{ref}"{style_attr}><{prefix}v>{text}</{prefix}v></{tag}>'
+
+    if isinstance(value, str):
+        if ILLEGAL_CHARACTERS_RE.search(value):
+            raise ValueError(f"Cannot write control characters to cell {ref}")
+        if value.startswith("=") and len(value) > 1:
+            return f'<{tag} r="{ref}"{style_attr}><{prefix}f>{html.escape(value[1:], quote=False)}</{prefix}f></{tag}>'
+        return (
+            f'<{tag} r="{ref}"{style_attr} t="inlineStr"><{prefix}is>'
+            f'<{prefix}t xml:space="preserve">{html.escape(value, quote=False)}</{prefix}t>'
+            f'</{prefix}is></{tag}>'
+        )
+
+    raise TypeError(f"Unsupported value type for cell {ref}: {type(value).__name__}")
+
+
+def _resolve_sheet_part(source: zipfile.ZipFile, sheet_title: str = None) -> str:
+    """
+    Find the zip member of a worksheet by title, or of the active sheet when no title is given
+    """
+    workbook = ET.fromstring(source.read(WORKBOOK_PART))
+    sheets = workbook.findall(f"{{{MAIN_NS}}}sheets/{{{MAIN_NS}}}sheet")
+
+    if sheet_title is None:
+        view = workbook.find(f"{{{MAIN_NS}}}bookViews/{{{MAIN_NS}}}workbookView")
+        active = int(view.get("activeTab", 0)) if view is not None else 0
+        sheet = sheets[active] if active < len(sheets) else sheets[0]
+    else:
+        sheet = next((s for s in sheets if s.get("name") == sheet_title), None)
+        if sheet is None:
+            raise KeyError(f"Worksheet {sheet_title} does not exist.")
+
+    rel_id = sheet.get(f"{{{REL_NS}}}id")
+    rels = ET.fromstring(source.read(WORKBOOK_RELS_PART))
+    for rel in rels.iter(f"{{{PACKAGE_REL_NS}}}Relationship"):
+        if rel.get("Id") == rel_id:
+            target = rel.get("Target")
+            if target.startswith("/"):
+                return target.lstrip("/")
+            return posixpath.normpath(posixpath.join(posixpath.dirname(WORKBOOK_PART), target))
+
+    raise ValueError(f"Worksheet part of {sheet.get('name')} not found")
+
+
+def _patch_row(row_xml: str, row_number: int, row_cells: dict, sheet: _SheetXml, shared_strings, changes: dict) -> str:
+    """
+    Rebuild one <row> element with the patched cells replaced or inserted in column order
+    """
+    prefix = sheet.prefix
+    if row_xml is None:
+        open_tag, body, close_tag = f'<{prefix}row r="{row_number}">', "", f"</{prefix}row>"
+    elif row_xml.endswith("/>") and row_xml.index(">") == len(row_xml) - 1:
+        open_tag, body, close_tag = row_xml[:-2].rstrip() + ">", "", f"</{prefix}row>"
+    else:
+        open_end = row_xml.index(">") + 1
+        close_start = row_xml.rindex("<")
+        open_tag, body, close_tag = row_xml[:open_end], row_xml[open_end:close_start], row_xml[close_start:]
+
+    if 'r="' not in open_tag:
+        open_tag = open_tag.replace(f"<{prefix}row", f'<{prefix}row r="{row_number}"', 1)
+
+    cells = {}
+    for match in sheet.cell_re.finditer(body):
+        cell_xml = match.group(0)
+        ref = _attributes(cell_xml[:cell_xml.index(">") + 1]).get("r")
+        column = _split_ref(ref)[1] if ref else (max(cells) + 1 if cells else 1)
+        cells[column] = cell_xml
+    trailing = sheet.cell_re.sub("", body).strip()
+
+    for column, new_value in row_cells.items():
+        ref = f"{get_column_letter(column)}{row_number}"
+        old_xml = cells.get(column)
+        old_value = _read_cell_value(old_xml, prefix, shared_strings) if old_xml else None
+
+        if callable(new_value):
+            new_value = new_value(old_value)
+
+        style = _attributes(old_xml[:old_xml.index(">") + 1]).get("s") if old_xml else None
+        cells[column] = _write_cell(ref, style, new_value, prefix)
+        changes[(row_number, column)] = {
+            "old": old_value,
+            "new": new_value,
+            "had_formula": bool(old_xml) and _element_text(old_xml, prefix, "f") is not None
+        }
+
+    # Spans are an optional loading hint, drop them if a cell was added outside
+    spans = _attributes(open_tag).get("spans")
+    if spans and ":" in spans:
+        first, last = (int(part) for part in spans.split(":"))
+        if min(cells) < first or max(cells) > last:
+            open_tag = re.sub(r'\sspans="[^"]*"', "", open_tag)
+
+    return open_tag + "".join(cells[column] for column in sorted(cells)) + trailing + close_tag
+
+
+def _find_cell_value(sheet: _SheetXml, row_xml: str, column: int, shared_strings):
+    for match in sheet.cell_re.finditer(row_xml):
+        cell_xml = match.group(0)
+        ref = _attributes(cell_xml[:cell_xml.index(">") + 1]).get("r")
+        if ref and _split_ref(ref)[1] == column:
+            return _read_cell_value(cell_xml, sheet.prefix, shared_strings)
+    return None
+
+
+def _update_dimension(xml: str, prefix: str, cells: dict) -> str:
+    """
+    Grow the <dimension> range so it covers the patched cells
+    """
+    p = re.escape(prefix)
+    match = re.search(rf'<{p}dimension\b[^>]*\bref="([^"]*)"', xml)
+    if match is None or not cells:
+        return xml
+
+    bounds = [_split_ref(ref) for ref in match.group(1).split(":") if ref]
+    rows = [row for row, _ in bounds] + [row for row, _ in cells]
+    columns = [column for _, column in bounds] + [column for _, column in cells]
+    ref = f"{get_column_letter(min(columns))}{min(rows)}:{get_column_letter(max(columns))}{max(rows)}"
+
+    return xml[:match.start(1)] + ref + xml[match.end(1):]
+
+
+def _patch_sheet_xml(xml: str, cells: dict, expectations: dict, shared_strings) -> tuple:
+    """
+    Apply the cell patches to a worksheet part
+
+    Returns:
+        tuple: (patched sheet xml, {(row, col): change})
+    """
+    sheet = _SheetXml(xml)
+
+    # An empty sheet may have <sheetData/>, open it up so rows can be inserted
+    sheet_data = sheet.sheet_data_re.search(xml)
+    if sheet_data.group(0).endswith("/>"):
+        xml = xml[:sheet_data.start()] + sheet_data.group(0)[:-2].rstrip() + f"></{sheet.prefix}sheetData>" + xml[sheet_data.end():]
+        sheet = _SheetXml(xml)
+        sheet_data = sheet.sheet_data_re.search(xml)
+
+    cells_by_row = {}
+    for (row_number, column), value in cells.items():
+        cells_by_row.setdefault(row_number, {})[column] = value
+
+    rows = sheet.rows()
+    located = {row_number: match for row_number, match in rows}
+
+    # Every expectation is checked before anything is patched
+    for (row_number, column), expected in expectations.items():
+        old_value = _find_cell_value(sheet, located[row_number].group(0), column, shared_strings) if row_number in located else None
+        matches = expected(old_value) if callable(expected) else old_value == expected
+        if not matches:
+            raise PatchConflict(f"Cell {get_column_letter(column)}{row_number} holds {old_value!r}, not the expected value")
+
+    changes = {}
+    replacements = []  # (start, end, text)
+    sheet_data_end = sheet_data.start(1) + len(sheet_data.group(1))
+
+    for row_number in sorted(cells_by_row):
+        match = located.get(row_number)
+        new_row = _patch_row(match.group(0) if match else None, row_number, cells_by_row[row_number], sheet, shared_strings, changes)
+
+        if match is not None:
+            replacements.append((match.start(), match.end(), new_row))
+        else:
+            # Insert before the first row that comes after it, or at the end of sheetData
+            position = next((m.start() for r, m in rows if r > row_number), sheet_data_end)
+            replacements.append((position, position, new_row))
+
+    pieces = []
+    last = 0
+    for start, end, text in sorted(replacements, key=lambda item: item[0]):
+        pieces.append(xml[last:start])
+        pieces.append(text)
+        last = end
+    pieces.append(xml[last:])
+
+    return _update_dimension("".join(pieces), sheet.prefix, cells), changes
+
+
+def _set_full_calc_on_load(workbook_xml: str) -> str:
+    """
+    Make Excel recalculate every formula when the file is next opened, since
+    the cached results of formulas depending on patched cells are now stale
+    """
+    prefix_match = re.search(r"<(\w+:)?workbook\b", workbook_xml)
+    prefix = prefix_match.group(1) or "" if prefix_match else ""
+    p = re.escape(prefix)
+
+    calc_pr = re.search(rf"<{p}calcPr\b[^>]*?/?>", workbook_xml)
+    if calc_pr is not None:
+        tag = calc_pr.group(0)
+        if re.search(r'\sfullCalcOnLoad="(1|true)"', tag):
+            return workbook_xml
+        tag = re.sub(r'\sfullCalcOnLoad="[^"]*"', "", tag)
+        tag = re.sub(rf"^<{p}calcPr", f'<{prefix}calcPr fullCalcOnLoad="1"', tag)
+        return workbook_xml[:calc_pr.start()] + tag + workbook_xml[calc_pr.end():]
+
+    # calcPr follows sheets, functionGroups, externalReferences and definedNames in the schema
+    position = None
+    for name in ("sheets", "functionGroups", "externalReferences", "definedNames"):
+        for match in re.finditer(rf"</{p}{name}>|<{p}{name}\b[^>]*/>", workbook_xml):
+            position = match.end()
+    if position is None:
+        return workbook_xml
+
+    return workbook_xml[:position] + f'<{prefix}calcPr fullCalcOnLoad="1"/>' + workbook_xml[position:]
+
+
+def _drop_calc_chain(parts: dict, source: zipfile.ZipFile) -> set:
+    """
+    Remove the calculation chain, which lists formula cells and is invalid once
+    one of them was overwritten. Excel rebuilds it on load.
+
+    Returns:
+        set: The zip members to leave out
+    """
+    if CALC_CHAIN_PART not in source.namelist():
+        return set()
+
+    content_types = parts.get(CONTENT_TYPES_PART) or source.read(CONTENT_TYPES_PART).decode("utf-8")
+    parts[CONTENT_TYPES_PART] = re.sub(r'<Override\b[^>]*PartName="/xl/calcChain.xml"[^>]*/>', "", content_types)
+
+    rels = parts.get(WORKBOOK_RELS_PART) or source.read(WORKBOOK_RELS_PART).decode("utf-8")
+    parts[WORKBOOK_RELS_PART] = re.sub(r'<Relationship\b[^>]*Target="[^"]*calcChain.xml"[^>]*/>', "", rels)
+
+    return {CALC_CHAIN_PART}
+
+
+def _write_package(source: zipfile.ZipFile, target_file, parts: dict, dropped: set):
+    """
+    Write the package with the replaced parts; every other member keeps its content and order
+    """
+    with zipfile.ZipFile(target_file, "w") as target:
+        for info in source.infolist():
+            if info.filename in dropped:
+                continue
+            if info.filename in parts:
+                target.writestr(info, parts[info.filename].encode("utf-8"))
+            else:
+                target.writestr(info, source.read(info))
+
+
+def patch_xlsx_sheets(file_path: str, sheets: dict, expectations: dict = None, on_commit=None) -> dict:
+    """
+    Change cells of several worksheets of an .xlsx file in one atomic replace.
+    See patch_xlsx_cells for the cell and expectation formats.
+
+    Args:
+        file_path (str): Path of the .xlsx file
+        sheets (dict): Worksheet title (None for the active sheet) -> cells dict
+        expectations (dict, optional): Worksheet title -> expectations dict
+        on_commit (optional): Called with the stamp of the patched file after the
+            replace, while the file lock is still held
+
+    Returns:
+        dict: Worksheet title -> changes, as returned by patch_xlsx_cells
+
+    Raises:
+        PatchConflict: If an expectation does not hold, or a patched or expected cell
+            is part of a shared or array formula; nothing is written
+        KeyError: If a worksheet does not exist
+    """
+    expectations = expectations or {}
+
+    with file_lock(file_path) as lock_wait_seconds:
+        logger.info(f"Acquired lock on {file_path} after {lock_wait_seconds:.3f}s")
+
+        with zipfile.ZipFile(file_path) as source:
+            shared_strings = _SharedStrings(source)
+            parts = {}
+            changes = {}
+
+            for sheet_title, cells in sheets.items():
+                sheet_part = _resolve_sheet_part(source, sheet_title)
+                sheet_xml, changes[sheet_title] = _patch_sheet_xml(
+                    source.read(sheet_part).decode("utf-8"), cells, expectations.get(sheet_title, {}), shared_strings
+                )
+                parts[sheet_part] = sheet_xml
+
+            parts[WORKBOOK_PART] = _set_full_calc_on_load(source.read(WORKBOOK_PART).decode("utf-8"))
+            dropped = set()
+            if any(change["had_formula"] for sheet_changes in changes.values() for change in sheet_changes.values()):
+                dropped = _drop_calc_chain(parts, source)
+
+            replace_file_atomically(file_path, lambda target_file: _write_package(source, target_file, parts, dropped))
+
+        if on_commit is not None:
+            on_commit(get_file_stamp(file_path))
+
+    logger.info(f"Patched {sum(len(sheet_changes) for sheet_changes in changes.values())} cells of {len(sheets)} worksheets in {file_path}")
+    return changes
+
+
+def patch_xlsx_cells(file_path: str, cells: dict, sheet_title: str = None, expectations: dict = None, on_commit=None) -> dict:
+    """
+    Change cells of an .xlsx file without loading it into openpyxl. Only the
+    worksheet part is read and only its patched <row> elements are rewritten;
+    strings are written inline so sharedStrings is never rewritten, and every
+    other part keeps its content. The file is replaced through the atomic,
+    locked and journaled path used by atomic_excel_operation.
+
+    Usage:
+        patch_xlsx_cells(MAIN_LEDGER_FILE, {(12, 3): lambda old: (old or 0) + 100},
+                         expectations={(12, 12): "John"})
+
+    Args:
+        file_path (str): Path of the .xlsx file
+        cells (dict): (row, col) -> new value, or a callable taking the current value and
+            returning the new one. Values: None, bool, int, float or str ("=..." writes a formula).
+            Current values read like openpyxl without data_only: formulas as "=<formula>".
+        sheet_title (str, optional): Worksheet to patch. Defaults to the active sheet.
+        expectations (dict, optional): (row, col) -> expected current value, or a predicate
+            taking it. If one does not hold, nothing is written.
+        on_commit (optional): Called with the stamp of the patched file after the
+            replace, while the file lock is still held
+
+    Returns:
+        dict: (row, col) -> {"old": value, "new": value, "had_formula": bool}
+
+    Raises:
+        PatchConflict: If an expectation does not hold, or a patched or expected cell
+            is part of a shared or array formula; nothing is written
+        KeyError: If the worksheet does not exist
+    """
+    changes = patch_xlsx_sheets(file_path, {sheet_title: cells}, {sheet_title: expectations or {}}, on_commit)
+    return changes[sheet_title]
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The backend modules are imported as in backend/src (e.g. "from util.xlsx_patch import ...")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
@@ -0,0 +1,124 @@
+import os
+import hashlib
+import pytest
+from openpyxl import Workbook, load_workbook
+import util.master_data as master_data
+import util.main_ledger_update as main_ledger_update
+import util.finding_files_sheets as finding_files_sheets
+import util.employee_sheet_index as employee_sheet_index
+import excel_controllers.excel_controller as excel_controller
+from util.master_data import MasterDataUnavailable
+from util.personal_accounts import plan_personal_account_entries
+from util.batch_personal_accounts import run_personal_account_phase
+
+EMPLOYEES = ("A", "B", "C")
+
+
+def _unavailable(*args, **kwargs):
+    raise MasterDataUnavailable("not configured in tests")
+
+
+@pytest.fixture
+def root(tmp_path, monkeypatch):
+    """
+    A cashbook, a main ledger with one institution and a personal account file
+    per employee, each with a capital limit of 1000 in K5 and running balances below
+    """
+    accounts = tmp_path / "accounts"
+    (accounts / "INST").mkdir(parents=True)
+
+    cashbook = Workbook()
+    cashbook.active.title = "Sheet1"
+    cashbook.save(str(tmp_path / "cashbook.xlsx"))
+
+    ledger = Workbook()
+    ws = ledger.active
+    ws["L1"] = "INST"
+    for row, name in enumerate(EMPLOYEES, start=2):
+        ws.cell(row=row, column=12).value = name
+        ws.cell(row=row, column=18).value = f"ACC{name}"
+    ledger.save(str(tmp_path / "ledger.xlsx"))
+
+    for name in EMPLOYEES:
+        workbook = Workbook()
+        ws = workbook.active
+        ws.title = "Account"
+        ws["J2"] = f"x/y/ACC{name}/z"
+        ws["K5"] = 1000
+        for row in range(1, 6):
+            ws.cell(row=row, column=1).value = "header"
+            ws.cell(row=row, column=9).value = "header"
+        for row in range(6, 60):
+            ws.cell(row=row, column=11).value = f"=K{row - 1}-I{row}"
+        workbook.save(str(accounts / "INST" / f"{name}.xlsx"))
+
+    monkeypatch.setattr(master_data, "get_master_data", _unavailable)
+    monkeypatch.setattr(main_ledger_update, "MAIN_LEDGER_FILE", str(tmp_path / "ledger.xlsx"))
+    monkeypatch.setattr(finding_files_sheets, "PERSONAL_ACCOUNT_ROOTPATH", str(accounts))
+    monkeypatch.setattr(employee_sheet_index, "SHEET_INDEX_DIR", str(tmp_path / "sheet_index"))
+    monkeypatch.setattr(excel_controller, "EXCEL_FILE_PATH", str(tmp_path / "cashbook.xlsx"))
+    return tmp_path
+
+
+def _digests(root):
+    digests = {}
+    for dir_path, _, file_names in os.walk(root):
+        for file_name in file_names:
+            if file_name.endswith(".xlsx"):
+                with open(os.path.join(dir_path, file_name), "rb") as file:
+                    digests[file_name] = hashlib.md5(file.read()).hexdigest()
+    return digests
+
+
+def _entry(name, capital):
+    return {
+        "employee_name": name, "employee_accountNo": f"ACC{name}", "institution_name": "INST",
+        "date": "2024-01-01", "capital": capital, "interest": None,
+        "description": None, "bill_no": "BS", "cheque_no": ""
+    }
+
+
+def _capital_column(path, rows):
+    ws = load_workbook(path)["Account"]
+    return [ws.cell(row=row, column=9).value for row in rows]
+
+
+def test_batch_with_one_bad_employee_writes_nothing(root):
+    before = _digests(root)
+    employees = [
+        {"institution": "INST", "name": "A", "accNo": "ACCA", "capitalAmount": "100", "interestAmount": "10"},
+        {"institution": "INST", "name": "B", "accNo": "ACCB", "capitalAmount": "2000", "interestAmount": "10"},
+        {"institution": "INST", "name": "C", "accNo": "ACCC", "capitalAmount": "50", "interestAmount": "10"},
+    ]
+
+    response = excel_controller.app.test_client().post("/submitExcelBatchPayment", json={
+        "date": "2024-01-01", "first_entry": "5", "employees": employees,
+        "ledger_debit_column": "C", "ledger_interest_column": "D"
+    })
+
+    assert response.status_code == 400
+    errors = response.get_json()["errors"]
+    assert len(errors) == 1 and errors[0].startswith("B: Capital limit reached")
+    assert _digests(root) == before
+
+
+def test_file_changed_after_planning_is_searched_and_validated_again(root):
+    path = str(root / "accounts" / "INST" / "A.xlsx")
+    entries = [_entry("A", 100.0), _entry("A", 300.0)]
+
+    plans = plan_personal_account_entries(entries)
+    assert [plan["plan"]["row"] for plan in plans] == [6, 7]
+    for entry, plan in zip(entries, plans):
+        entry["plan"] = plan["plan"]
+
+    # Written after planning: the planned row is taken and the limit drops to 200
+    workbook = load_workbook(path)
+    workbook["Account"]["A6"] = "2024-01-01"
+    workbook["Account"]["I6"] = 800
+    workbook.save(path)
+
+    outcomes = run_personal_account_phase(entries)
+
+    assert outcomes[0]["result"]["row_updated"] == 7
+    assert outcomes[1]["validation_failed"]
+    assert _capital_column(path, (6, 7, 8)) == [800, 100, None]
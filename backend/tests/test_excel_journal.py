@@ -0,0 +1,113 @@
+import os
+import time
+import threading
+import pytest
+import util.excel_journal as excel_journal
+from util.excel_journal import record_prepared, record_finished, recover_incomplete_operations, COMMITTED, ROLLED_BACK
+from util.file_locks import file_lock
+
+
+@pytest.fixture
+def journal(tmp_path, monkeypatch):
+    path = str(tmp_path / ".excel_journal.jsonl")
+    monkeypatch.setattr(excel_journal, "JOURNAL_FILE", path)
+    return path
+
+
+@pytest.fixture
+def target(tmp_path):
+    path = str(tmp_path / "book.xlsx")
+    temp_path = str(tmp_path / "book.xlsx.tmp")
+    with open(path, "w") as file:
+        file.write("old")
+    with open(temp_path, "w") as file:
+        file.write("new")
+    return path, temp_path
+
+
+@pytest.fixture
+def finished(monkeypatch):
+    recorded = []
+
+    def recording_finish(op_id, state):
+        recorded.append((op_id, state))
+        record_finished(op_id, state)
+
+    monkeypatch.setattr(excel_journal, "record_finished", recording_finish)
+    return recorded
+
+
+def _states(op_id):
+    return [record["state"] for record in excel_journal._read_records() if record["id"] == op_id]
+
+
+def test_prepared_operation_with_its_temp_file_is_rolled_back(journal, target, finished):
+    path, temp_path = target
+    op_id = record_prepared(path, temp_path)
+
+    assert recover_incomplete_operations() == 1
+    assert finished == [(op_id, ROLLED_BACK)]
+    assert not os.path.exists(temp_path)
+    with open(path) as file:
+        assert file.read() == "old"
+    assert excel_journal._unfinished(excel_journal._read_records()) == {}
+    assert recover_incomplete_operations() == 0
+
+
+def test_prepared_operation_without_its_temp_file_is_committed(journal, target, finished):
+    path, temp_path = target
+    op_id = record_prepared(path, temp_path)
+    os.replace(temp_path, path)
+
+    assert recover_incomplete_operations() == 1
+    assert finished == [(op_id, COMMITTED)]
+    with open(path) as file:
+        assert file.read() == "new"
+
+
+def test_journal_is_compacted_to_the_unfinished_operations(journal, target, monkeypatch):
+    path, temp_path = target
+    monkeypatch.setattr(excel_journal, "JOURNAL_COMPACT_BYTES", 0)
+
+    done = record_prepared(path, temp_path)
+    record_finished(done, COMMITTED)
+    assert _states(done) == []
+
+    pending = record_prepared(path, temp_path)
+    other = record_prepared(path, temp_path)
+    record_finished(other, ROLLED_BACK)
+
+    assert _states(pending) == ["prepared"]
+    assert _states(other) == []
+    assert len(excel_journal._read_records()) == 1
+
+
+def test_torn_last_record_is_skipped(journal, target):
+    path, temp_path = target
+    op_id = record_prepared(path, temp_path)
+    with open(journal, "a") as file:
+        file.write('{"id": "torn", "sta')
+
+    assert list(excel_journal._unfinished(excel_journal._read_records())) == [op_id]
+
+
+def test_operation_still_running_under_the_file_lock_is_left_alone(journal, target, finished):
+    path, temp_path = target
+    result = {}
+
+    with file_lock(path):
+        op_id = record_prepared(path, temp_path)
+        recovery = threading.Thread(target=lambda: result.update(recovered=recover_incomplete_operations()))
+        recovery.start()
+        # Recovery waits for the lock while the operation finishes its replace
+        time.sleep(0.2)
+        assert recovery.is_alive()
+        os.replace(temp_path, path)
+        record_finished(op_id, COMMITTED)
+
+    recovery.join(timeout=10)
+    assert result == {"recovered": 0}
+    assert finished == []
+    assert _states(op_id) == []
+    with open(path) as file:
+        assert file.read() == "new"
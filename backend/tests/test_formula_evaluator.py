@@ -0,0 +1,102 @@
+import pytest
+from openpyxl import Workbook
+from util.formula_evaluator import parse_formula, FormulaEvaluator, FormulaError, UnsupportedFormulaError
+from util.validate_capital_limit_utilities import compute_capital_limit
+
+
+def _sheet(cells: dict):
+    ws = Workbook().active
+    ws.title = "Sheet1"
+    for coordinate, value in cells.items():
+        ws[coordinate] = value
+    return ws
+
+
+def _value(ws, coordinate: str):
+    cell = ws[coordinate]
+    return FormulaEvaluator(ws).cell_value(cell.row, cell.column)
+
+
+def test_parse_follows_excel_precedence():
+    assert parse_formula("=1+2*3") == ("bin", "+", ("const", 1.0), ("bin", "*", ("const", 2.0), ("const", 3.0)))
+    assert parse_formula("-2^2") == ("bin", "^", ("neg", ("const", 2.0)), ("const", 2.0))
+    assert parse_formula("=A1&\"x\"=B2") == (
+        "bin", "=", ("bin", "&", ("ref", None, 1, 1, 1, 1, False), ("const", "x")), ("ref", None, 2, 2, 2, 2, False)
+    )
+
+
+def test_parse_references():
+    assert parse_formula("=$B$2:A10") == ("ref", None, 2, 1, 10, 2, True)
+    assert parse_formula("='My ''Sheet'''!K4") == ("ref", "My 'Sheet'", 4, 11, 4, 11, False)
+
+
+@pytest.mark.parametrize("formula", ["=1+", "=(1", "=1 2", "=A1:"])
+def test_parse_rejects_unsupported_syntax(formula):
+    with pytest.raises(UnsupportedFormulaError):
+        parse_formula(formula)
+
+
+def test_evaluates_arithmetic_and_functions():
+    ws = _sheet({
+        "A1": 10, "A2": 2.5, "A3": "text", "A4": None,
+        "B1": "=SUM(A1:A4)*2-MAX(A1,A2)/2",
+        "B2": "=ROUND(2.345,2)",
+        "B3": "=IF(A1>5,\"big\",\"small\")",
+        "B4": "=50%+ABS(-1)",
+        "B5": "=Sheet2!A1+1",
+    })
+    ws.parent.create_sheet("Sheet2")["A1"] = 4
+
+    assert _value(ws, "B1") == 20.0
+    assert _value(ws, "B2") == 2.35
+    assert _value(ws, "B3") == "big"
+    assert _value(ws, "B4") == 1.5
+    assert _value(ws, "B5") == 5.0
+
+
+def test_formula_referring_to_an_empty_cell_gives_zero():
+    ws = _sheet({"K4": "=K3", "K5": "=IF(TRUE,K3)"})
+
+    assert _value(ws, "K3") is None
+    assert _value(ws, "K4") == 0.0
+    assert _value(ws, "K5") == 0.0
+
+
+def test_excel_error_values_are_formula_errors():
+    ws = _sheet({"A1": "=1/0", "A2": "=\"x\"+1", "A3": "=#REF!"})
+
+    for coordinate in ("A1", "A2", "A3"):
+        with pytest.raises(FormulaError) as error:
+            _value(ws, coordinate)
+        assert not isinstance(error.value, UnsupportedFormulaError)
+
+
+def test_unsupported_function_and_circular_reference_are_unsupported():
+    ws = _sheet({"A1": "=VLOOKUP(1,B1:C2,2)", "A2": "=A3", "A3": "=A2"})
+
+    with pytest.raises(UnsupportedFormulaError, match="VLOOKUP"):
+        _value(ws, "A1")
+    with pytest.raises(UnsupportedFormulaError, match="Circular"):
+        _value(ws, "A2")
+
+
+def test_capital_limit_refuses_a_formula_it_cannot_evaluate():
+    ws = _sheet({"I1": "x", "I2": "x", "K2": "=VLOOKUP(K1,A1:B2,2)", "K3": "=K2"})
+
+    with pytest.raises(ValueError, match="Cannot evaluate K3"):
+        compute_capital_limit(ws)
+
+
+def test_capital_limit_of_an_error_value_is_zero():
+    ws = _sheet({"I1": "x", "I2": "x", "K3": "=K2/0"})
+
+    assert compute_capital_limit(ws) == (3, 0.0)
+
+
+def test_capital_limit_falls_back_to_the_rows_above_a_blank_limit():
+    ws = _sheet({"I1": "x", "I2": "x", "K1": 100, "K2": "=K1-30"})
+
+    assert compute_capital_limit(ws) == (3, 70.0)
+
+    ws["K3"] = "=K4"
+    assert compute_capital_limit(ws) == (3, 0.0)
@@ -0,0 +1,111 @@
+import time
+import pytest
+from openpyxl import Workbook, load_workbook
+import util.workbook_writer as workbook_writer
+from util.workbook_writer import WorkbookWriter, WriteTimeoutError, wait_for_write
+from util.file_locks import file_lock
+
+
+@pytest.fixture
+def workbook_path(tmp_path):
+    workbook = Workbook()
+    workbook.active.title = "Sheet1"
+    path = str(tmp_path / "book.xlsx")
+    workbook.save(path)
+    return path
+
+
+@pytest.fixture
+def saves(monkeypatch):
+    saved = []
+    save = workbook_writer.save_workbook_atomically
+
+    def counting_save(workbook, file_path):
+        saved.append(file_path)
+        save(workbook, file_path)
+
+    monkeypatch.setattr(workbook_writer, "save_workbook_atomically", counting_save)
+    return saved
+
+
+def _set(coordinate, value):
+    def apply(workbook):
+        workbook["Sheet1"][coordinate] = value
+        return coordinate
+    return apply
+
+
+def _cells(path):
+    ws = load_workbook(path)["Sheet1"]
+    return {coordinate: ws[coordinate].value for coordinate in ("A1", "A2", "A3")}
+
+
+def test_jobs_of_a_group_are_saved_once(workbook_path, saves):
+    writer = WorkbookWriter(workbook_path, max_batch=3, max_wait_ms=5000)
+
+    futures = [writer.submit(_set(coordinate, value)) for coordinate, value in (("A1", 1), ("A2", 2), ("A3", 3))]
+
+    assert [wait_for_write(future, timeout=10) for future in futures] == ["A1", "A2", "A3"]
+    assert saves == [workbook_path]
+    assert _cells(workbook_path) == {"A1": 1, "A2": 2, "A3": 3}
+
+
+def test_failing_job_is_dropped_and_the_rest_of_the_group_is_saved(workbook_path, saves):
+    def failing(workbook):
+        workbook["Sheet1"]["A2"] = "partial"
+        raise ValueError("bad entry")
+
+    writer = WorkbookWriter(workbook_path, max_batch=3, max_wait_ms=5000)
+    first = writer.submit(_set("A1", 1))
+    bad = writer.submit(failing)
+    last = writer.submit(_set("A3", 3))
+
+    assert wait_for_write(first, timeout=10) == "A1"
+    assert wait_for_write(last, timeout=10) == "A3"
+    with pytest.raises(ValueError, match="bad entry"):
+        wait_for_write(bad, timeout=10)
+    assert len(saves) == 1
+    assert _cells(workbook_path) == {"A1": 1, "A2": None, "A3": 3}
+
+
+def test_queued_job_cancelled_at_the_timeout_is_never_written(workbook_path, saves):
+    writer = WorkbookWriter(workbook_path, max_batch=1, max_wait_ms=0)
+
+    with file_lock(workbook_path):
+        # The writer takes the first job and blocks on the lock, the second one stays queued
+        started = writer.submit(_set("A1", 1))
+        deadline = time.monotonic() + 10
+        while not started.running():
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        queued = writer.submit(_set("A2", 2))
+
+        with pytest.raises(WriteTimeoutError) as error:
+            wait_for_write(queued, timeout=0.1)
+        assert error.value.written is False
+        assert queued.cancelled()
+
+        with pytest.raises(WriteTimeoutError) as error:
+            wait_for_write(started, timeout=0.1)
+        assert error.value.written is None
+
+    assert wait_for_write(started, timeout=10) == "A1"
+    # Queued after the cancelled job, so the writer has passed it once this one is saved
+    assert wait_for_write(writer.submit(_set("A3", 3)), timeout=10) == "A3"
+    assert len(saves) == 2
+    assert _cells(workbook_path) == {"A1": 1, "A2": None, "A3": 3}
+
+
+def test_on_commit_runs_once_per_job_in_queue_order(workbook_path, saves):
+    committed = []
+    writer = WorkbookWriter(workbook_path, max_batch=3, max_wait_ms=5000)
+
+    futures = [
+        writer.submit(_set(coordinate, value), on_commit=committed.append)
+        for coordinate, value in (("A3", 3), ("A1", 1), ("A2", 2))
+    ]
+    for future in futures:
+        wait_for_write(future, timeout=10)
+
+    assert committed == ["A3", "A1", "A2"]
+    assert len(saves) == 1
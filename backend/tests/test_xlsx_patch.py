@@ -0,0 +1,121 @@
+import re
+import zipfile
+import hashlib
+import pytest
+from openpyxl import Workbook, load_workbook
+from util.xlsx_patch import patch_xlsx_cells, PatchConflict
+
+SHEET_PART = "xl/worksheets/sheet1.xml"
+
+
+def _digest(path):
+    with open(path, "rb") as file:
+        return hashlib.md5(file.read()).hexdigest()
+
+
+def _rewrite_sheet(path, rewrite):
+    """
+    Rewrite the sheet part of an .xlsx file, for XML openpyxl does not write itself
+    """
+    with zipfile.ZipFile(path) as source:
+        members = [(info, source.read(info)) for info in source.infolist()]
+    with zipfile.ZipFile(path, "w") as target:
+        for info, data in members:
+            if info.filename == SHEET_PART:
+                data = rewrite(data.decode("utf-8")).encode("utf-8")
+            target.writestr(info, data)
+
+
+@pytest.fixture
+def workbook_path(tmp_path):
+    workbook = Workbook()
+    ws = workbook.active
+    ws.title = "Ledger"
+    ws["A1"] = "John"
+    ws["C1"] = 100
+    ws["A2"] = "Jane"
+    ws["C2"] = 50.5
+    ws["D5"] = "untouched"
+    path = str(tmp_path / "ledger.xlsx")
+    workbook.save(path)
+    return path
+
+
+@pytest.fixture
+def shared_formula_path(tmp_path):
+    workbook = Workbook()
+    ws = workbook.active
+    for row in range(1, 5):
+        ws.cell(row=row, column=1).value = row
+        ws.cell(row=row, column=2).value = f"=A{row}*2"
+    path = str(tmp_path / "shared.xlsx")
+    workbook.save(path)
+
+    def make_shared(xml):
+        # B1 becomes the master of a shared formula over B1:B4, as Excel saves filled-down formulas
+        xml = xml.replace("<f>A1*2</f>", '<f t="shared" ref="B1:B4" si="0">A1*2</f>')
+        return re.sub(r"<f>A[234]\*2</f>", '<f t="shared" si="0"/>', xml)
+
+    _rewrite_sheet(path, make_shared)
+    return path
+
+
+def test_patch_writes_values_and_keeps_other_cells(workbook_path):
+    changes = patch_xlsx_cells(workbook_path, {(1, 3): lambda old: old + 25, (2, 4): "note", (7, 1): 3.25})
+
+    assert changes[(1, 3)] == {"old": 100, "new": 125, "had_formula": False}
+    ws = load_workbook(workbook_path)["Ledger"]
+    assert ws["C1"].value == 125
+    assert ws["D2"].value == "note"
+    assert ws["A7"].value == 3.25
+    assert ws["C2"].value == 50.5
+    assert ws["D5"].value == "untouched"
+
+
+def test_failed_expectation_writes_nothing(workbook_path):
+    before = _digest(workbook_path)
+
+    with pytest.raises(PatchConflict):
+        patch_xlsx_cells(workbook_path, {(1, 3): 1}, expectations={(1, 1): "Jane"})
+
+    assert _digest(workbook_path) == before
+
+
+def test_writing_formula_drops_nothing_else(workbook_path):
+    patch_xlsx_cells(workbook_path, {(3, 3): "=C1+C2"})
+
+    ws = load_workbook(workbook_path)["Ledger"]
+    assert ws["C3"].value == "=C1+C2"
+    assert ws["A1"].value == "John"
+
+
+@pytest.mark.parametrize("cell", [(1, 2), (3, 2)], ids=["master", "dependent"])
+def test_shared_formula_cells_are_not_patched(shared_formula_path, cell):
+    before = _digest(shared_formula_path)
+
+    with pytest.raises(PatchConflict):
+        patch_xlsx_cells(shared_formula_path, {cell: 0})
+
+    assert _digest(shared_formula_path) == before
+
+
+def test_shared_formula_cells_are_not_read_for_expectations(shared_formula_path):
+    with pytest.raises(PatchConflict):
+        patch_xlsx_cells(shared_formula_path, {(1, 3): 1}, expectations={(2, 2): "=A2*2"})
+
+
+def test_array_formula_cells_are_not_patched(workbook_path):
+    _rewrite_sheet(workbook_path, lambda xml: re.sub(
+        r'(<c r="C1"[^>]*>)<v>100</v>', r'\1<f t="array" ref="C1">SUM(A1:A2)</f><v>100</v>', xml
+    ))
+
+    with pytest.raises(PatchConflict):
+        patch_xlsx_cells(workbook_path, {(1, 3): 1})
+
+
+def test_other_cells_of_shared_formula_rows_can_be_patched(shared_formula_path):
+    patch_xlsx_cells(shared_formula_path, {(2, 3): "x"})
+
+    ws = load_workbook(shared_formula_path).active
+    assert ws["C2"].value == "x"
+    assert ws["B3"].value == "=A3*2"